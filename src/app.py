@@ -6,13 +6,33 @@ Flask Web 应用 - 多模型 AI 聊天界面
 """
 
 import os
+import hmac
 import time
-from flask import Flask, render_template, request, jsonify
+import hashlib
+import mimetypes
+from functools import wraps, partial
+from flask import Flask, render_template, request, jsonify, Response, abort
 from dotenv import load_dotenv
 from config import Config
 from logger import logger
-from web_search import web_search_tool
-from myllm import myllm
+from web_search import web_search_tool, SEARCH_TOOL, SEARCH_TOOL_NAME, SEARCH_SYSTEM_PROMPT
+from search_context import search_context_builder
+from myllm import myllm, ModelSwitch, ToolRound, ToolResult, chunk_text
+from usage import usage_tracker, estimate_usage
+from utils import extract_usage, calculate_cost, has_cost_rates
+from image_processor import image_processor, ImageTooLargeError
+from token_counter import token_counter, ContextLengthError, IMAGE_TOKENS
+from conversation_store import conversation_store
+from stream_registry import stream_registry
+from deadline import Deadline, DeadlineExceeded
+from timing import RequestTimer
+from search_classifier import search_classifier
+from ollama_manager import ollama_manager
+from http_pool import connection_pools
+from page_fetcher import page_fetcher
+from shared_cache import shared_cache
+from profiler import profiler, ProfilingMiddleware
+from static_assets import static_assets, compress_response, CompressedPayload, IMMUTABLE_MAX_AGE
 
 # 加载环境变量
 load_dotenv()
@@ -34,6 +54,14 @@ app.config.from_object(Config)
 app.config['JSON_AS_ASCII'] = False
 app.config['JSONIFY_MIMETYPE'] = 'application/json; charset=utf-8'
 
+# 模板中通过 asset_url 引用本地托管的前端依赖
+app.jinja_env.globals['asset_url'] = static_assets.url
+static_assets.check()
+
+# 配置了管理令牌时才挂载性能分析中间件，未配置时请求路径上没有任何额外开销
+if Config.ADMIN_TOKEN:
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profiler)
+
 # 配置环境变量
 for model_config in Config.MODELS:
     if os.getenv(model_config.api_key_env):
@@ -47,21 +75,219 @@ if os.getenv("AZURE_API_VERSION"):
 available_models = myllm.get_available_models()
 logger.info(f"已加载 {len(available_models)} 个可用模型")
 
+
+def start_background_tasks(warm_up_models: bool = True):
+    """
+    启动后台任务
+    多进程部署时由 gunicorn 钩子分别调用：用量落盘和分词器加载在每个 worker 中运行，Ollama 预加载只在主进程中运行一份
+
+    Args:
+        warm_up_models: 是否启动 Ollama 模型预加载
+    """
+    # 启动用量统计定期落盘
+    usage_tracker.start()
+
+    # 在后台加载可用模型的分词器，首批请求也能按模型的分词器计数
+    token_counter.preload(available_models)
+
+    # 预加载本地 Ollama 模型，避免首个请求等待模型加载
+    if warm_up_models:
+        ollama_manager.start()
+
+
+def reinit_after_fork():
+    """在 fork 出的 worker 进程中重建不能跨进程共用的资源：日志文件句柄、连接池、数据库连接、线程池和锁"""
+    logger.reset_after_fork()
+    connection_pools.reset_after_fork()
+    conversation_store.reset_after_fork()
+    stream_registry.reset_after_fork()
+    page_fetcher.reset_after_fork()
+    web_search_tool.reset_after_fork()
+    shared_cache.reset_after_fork()
+    usage_tracker.reset_after_fork()
+
+
+def shutdown():
+    """进程退出前写入用量统计并关闭连接池"""
+    ollama_manager.stop()
+    usage_tracker.stop()
+    connection_pools.close()
+
+
+def get_client_id() -> str:
+    """获取客户端标识，优先使用请求头 X-Client-Id"""
+    return request.headers.get('X-Client-Id') or request.remote_addr or 'unknown'
+
+
+def record_usage(model_config, client_id, messages, usage, completion_text=''):
+    """
+    记录一次调用的用量和成本
+    供应商没有返回用量时在本地估算
+    """
+    estimated = not usage
+    if estimated:
+        usage = estimate_usage(model_config, messages, completion_text)
+    elif usage.get('cached_tokens'):
+        logger.info(f"提示词缓存命中 - {model_config.display_name}: "
+                    f"{usage['cached_tokens']}/{usage['prompt_tokens']} 输入 tokens")
+    cost = calculate_cost(usage, model_config.model_name)
+    usage_tracker.record(model_config.name, client_id, usage, cost, estimated)
+    usage_info = {**usage, 'cost': cost, 'estimated': estimated}
+    if not has_cost_rates(model_config.model_name):
+        # 没有价格信息的模型成本记为 0，前端显示为未知
+        usage_info['cost_unknown'] = True
+    return usage_info
+
+def parse_chat_request():
+    """
+    解析聊天请求，支持 JSON 和带图片上传的 multipart 表单
+    返回 (请求参数, 图片列表)，图片为上传文件或 data URL
+    """
+    if request.mimetype == 'multipart/form-data':
+        form = request.form
+        data = {
+            'message': form.get('message', ''),
+            'model': form.get('model', 'gpt-4o'),
+            'stream': form.get('stream', 'false').lower() == 'true',
+            'web_search': form.get('web_search', 'false').lower(),
+            'conversation_id': form.get('conversation_id'),
+            'compare': form.get('compare')
+        }
+        return data, request.files.getlist('images')
+    
+    data = request.get_json() or {}
+    return data, data.get('images') or []
+
+
+def parse_web_search_mode(value):
+    """联网查询开关：true / false，或 auto 表示由本地分类器按问题判断"""
+    if isinstance(value, str):
+        value = value.strip().lower()
+        return 'auto' if value == 'auto' else value == 'true'
+    return bool(value)
+
+def parse_compare_models(value):
+    """对比模式的模型列表：JSON 数组或逗号分隔的字符串，去重并保持顺序"""
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        return []
+    keys = [str(key).strip() for key in value if str(key).strip()]
+    return list(dict.fromkeys(keys))
+
+def resolve_compare_models(model_keys, is_stream):
+    """
+    校验对比模式的模型列表，返回模型配置列表
+
+    Raises:
+        ValueError: 模型数量不合法、模型不可用或未使用流式输出
+    """
+    if not is_stream:
+        raise ValueError('对比模式仅支持流式输出')
+    if not 2 <= len(model_keys) <= Config.COMPARE_MAX_MODELS:
+        raise ValueError(f'对比模式需要选择 2 到 {Config.COMPARE_MAX_MODELS} 个模型')
+    model_configs = []
+    for model_key in model_keys:
+        is_valid, error_msg, model_config = myllm.validate_model(model_key)
+        if not is_valid:
+            raise ValueError(error_msg)
+        model_configs.append(model_config)
+    return model_configs
+
+def prepare_images(uploads, model_config):
+    """按目标模型的分辨率处理上传的图片，返回 data URL 列表"""
+    if len(uploads) > Config.MAX_IMAGES_PER_MESSAGE:
+        raise ValueError(f"每条消息最多上传 {Config.MAX_IMAGES_PER_MESSAGE} 张图片")
+    
+    images = []
+    for upload in uploads:
+        if isinstance(upload, str):
+            images.append(image_processor.process_data_url(upload, model_config.image_max_side))
+        else:
+            images.append(image_processor.process(upload.stream, model_config.image_max_side))
+    return images
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': f'请求体过大，上限为 {Config.MAX_CONTENT_LENGTH // (1024 * 1024)}MB'}), 413
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.headers.get('Accept-Encoding', ''))
+
+# 首页只依赖模型列表，按模型列表版本缓存渲染结果
+_index_cache = {}
+
+def get_index_payload() -> CompressedPayload:
+    """获取渲染好的首页，模型列表不变时复用缓存"""
+    models_dict = {model.name: {'name': model.display_name} for model in available_models}
+    version = hashlib.sha256(repr((sorted(models_dict.items()), Config.MAX_IMAGES_PER_MESSAGE)).encode('utf-8')).hexdigest()
+    payload = _index_cache.get(version)
+    if payload is None:
+        html = render_template('index.html', models=models_dict, max_images=Config.MAX_IMAGES_PER_MESSAGE)
+        payload = CompressedPayload(html.encode('utf-8'), 'text/html')
+        _index_cache.clear()
+        _index_cache[version] = payload
+    return payload
+
+def payload_response(payload: CompressedPayload) -> Response:
+    """按客户端支持的压缩算法返回缓存内容"""
+    data, encoding = payload.get(request.headers.get('Accept-Encoding', ''))
+    response = Response(data, mimetype=payload.mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(payload.etag)
+    return response
+
 @app.route('/')
 def index():
-    # 转换为模板需要的格式
-    models_dict = {model.name: {'name': model.display_name} for model in available_models}
-    return render_template('index.html', models=models_dict)
+    payload = get_index_payload()
+    if payload.etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(payload.etag)
+    else:
+        response = payload_response(payload)
+    # 每次都向服务端确认，模型列表变化后立即生效
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/assets/<fingerprint>/<path:filename>')
+def assets(fingerprint, filename):
+    """带指纹的静态资源，内容随指纹变化，可以长期缓存"""
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    payload = static_assets.load(filename, mimetype)
+    if payload is None:
+        abort(404)
+    response = payload_response(payload)
+    if fingerprint == static_assets.fingerprint(filename):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # 旧指纹仍返回当前内容，但不允许长期缓存
+        response.cache_control.no_cache = True
+    return response
 
 @app.route('/chat', methods=['POST'])
 def chat():
     start_time = time.time()
+    # 各阶段耗时，非流式响应通过 Server-Timing 头返回，流式响应在结束前发送 timing 事件
+    timer = RequestTimer()
     try:
-        data = request.get_json()
+        with timer.span('parse'):
+            data, uploads = parse_chat_request()
+        # 整个请求共用一个截止时间，客户端可以通过 deadline 字段（秒）指定
+        deadline = Deadline.from_request(data.get('deadline'))
         message = data.get('message', '').strip()
         model_key = data.get('model', 'gpt-4o')
         is_stream = data.get('stream', False)
-        is_web_search = data.get('web_search', False)
+        web_search_mode = parse_web_search_mode(data.get('web_search', False))
+        compare_keys = parse_compare_models(data.get('compare'))
+        if compare_keys:
+            # 对比模式下以第一个模型确定联网上下文预算等
+            model_key = compare_keys[0]
         
         if not message:
             logger.warning(f"收到空消息请求 - 模型: {model_key}")
@@ -73,45 +299,257 @@ def chat():
             logger.error(f"模型验证失败: {error_msg}")
             return jsonify({'error': error_msg}), 400
         
-        logger.info(f"处理聊天请求 - 模型: {model_config.display_name}, 消息长度: {len(message)}, 流式: {is_stream}, 联网查询: {is_web_search}")
+        # 对比模式：同一问题并发发给多个模型
+        compare_configs = []
+        if compare_keys:
+            try:
+                compare_configs = resolve_compare_models(compare_keys, is_stream)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        # 处理上传的图片
+        images = []
+        if uploads:
+            target_configs = compare_configs or [model_config]
+            for target_config in target_configs:
+                if not target_config.supports_vision:
+                    return jsonify({'error': f'模型 {target_config.display_name} 不支持图片输入'}), 400
+            try:
+                with timer.span('images'):
+                    # 对比模式下按分辨率上限最小的模型缩放，所有模型共用同一组图片
+                    image_config = min(target_configs, key=lambda config: config.image_max_side)
+                    images = prepare_images(uploads, image_config)
+            except ImageTooLargeError as e:
+                return jsonify({'error': str(e)}), 413
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        
+        # 当前消息本身就超出模型上下文时在本地直接拒绝，不必等上游返回错误；
+        # 会话历史和搜索结果放不下时在发出请求前裁剪（见 MyLLM.build_completion_params）
+        try:
+            for target_config in compare_configs or [model_config]:
+                token_counter.fit(target_config, [{'role': 'user', 'content': message}], Config.MAX_TOKENS,
+                                  len(images) * IMAGE_TOKENS)
+        except ContextLengthError as e:
+            return jsonify({'error': str(e)}), 413
+        
+        # 支持工具调用的模型在流式回答中自行决定是否搜索以及搜索什么，不再单独调用模型提取关键词
+        use_search_tool = (bool(web_search_mode) and is_stream and Config.WEB_SEARCH_TOOL_CALLING
+                           and model_config.supports_tools and not compare_configs)
+        
+        # 自动联网模式下由本地分类器判断，跳过翻译、改写、代码等不需要检索的问题
+        if use_search_tool:
+            is_web_search = False
+        elif web_search_mode == 'auto':
+            with timer.span('classify'):
+                decision = search_classifier.classify(message)
+            is_web_search = decision.needs_web
+            logger.info(f"自动联网判断: {'联网' if decision.needs_web else '不联网'} "
+                        f"(置信度: {decision.confidence:.2f}, 依据: {decision.reason})")
+        else:
+            is_web_search = web_search_mode
+        
+        logger.info(f"处理聊天请求 - 模型: {model_config.display_name}, 消息长度: {len(message)}, 图片: {len(images)}, 流式: {is_stream}, 联网查询: {'工具调用' if use_search_tool else is_web_search}")
+        
+        # 加载会话历史，新会话或未知会话 ID 时创建新会话
+        # 历史按目标模型（对比模式下为上下文最小的模型）的剩余上下文裁剪：扣除输出、当前问题、图片和搜索结果
+        conversation_id = data.get('conversation_id')
+        with timer.span('history'):
+            if conversation_id and conversation_store.conversation_exists(conversation_id):
+                history_config = min(compare_configs or [model_config],
+                                     key=lambda config: config.context_window or float('inf'))
+                reserved_tokens = (Config.MAX_TOKENS + token_counter.count_text(message, history_config)
+                                   + len(images) * IMAGE_TOKENS)
+                if is_web_search or use_search_tool:
+                    search_rounds = Config.MAX_TOOL_ROUNDS if use_search_tool else 1
+                    reserved_tokens += (token_counter.count_text(SEARCH_SYSTEM_PROMPT, history_config)
+                                        + search_rounds * search_context_builder.get_budget(history_config))
+                history = conversation_store.build_context(
+                    conversation_id, model_config=history_config, reserved_tokens=reserved_tokens
+                )
+            elif compare_configs:
+                # 对比模式的问答不写入会话，不为其创建新会话
+                conversation_id = None
+                history = []
+            else:
+                conversation_id = conversation_store.create_conversation(title=message)
+                history = []
         
         # 处理联网查询
         if is_web_search:
             try:
-                enhanced_prompt, search_results = web_search_tool.perform_web_search(message)
-                messages = [{'role': 'user', 'content': enhanced_prompt}]
+                enhanced_prompt, search_results, injected = web_search_tool.perform_web_search(
+                    message, model_key, deadline, timer
+                )
+                # 固定的回答要求在前、会话历史居中、搜索结果和问题在最后，前缀在多次请求间保持不变，可命中供应商的提示词缓存；
+                # 查询失败或没有结果时系统消息中“以下附有搜索结果”的说明不成立，不发送
+                system = [{'role': 'system', 'content': SEARCH_SYSTEM_PROMPT}] if injected else []
+                messages = system + history + [{'role': 'user', 'content': enhanced_prompt}]
                 logger.info(f"联网查询完成，获取到 {len(search_results)} 条搜索结果")
             except Exception as e:
                 logger.error(f"联网查询失败: {e}")
-                messages = [{'role': 'user', 'content': message}]
+                messages = history + [{'role': 'user', 'content': message}]
         else:
-            messages = [{'role': 'user', 'content': message}]
+            messages = history + [{'role': 'user', 'content': message}]
         
         # 使用统一的模型调用接口
         completion_kwargs = {
             'max_tokens': Config.MAX_TOKENS,
             'temperature': Config.TEMPERATURE,
-            'stream': is_stream
+            'stream': is_stream,
+            'images': images,
+            'deadline': deadline,
+            'timer': timer
         }
+        if use_search_tool:
+            completion_kwargs['tools'] = [SEARCH_TOOL]
+            completion_kwargs['tool_handler'] = partial(
+                web_search_tool.run_search_tool, user_query=message, model_key=model_key,
+                deadline=deadline, timer=timer
+            )
+            # 明确开启联网时第一轮强制搜索，自动模式由模型决定
+            completion_kwargs['tool_choice'] = (
+                'auto' if web_search_mode == 'auto'
+                else {'type': 'function', 'function': {'name': SEARCH_TOOL_NAME}}
+            )
         
-        if is_stream:
+        client_id = get_client_id()
+        
+        if compare_configs:
+            return handle_compare_response(compare_configs, messages, completion_kwargs, start_time, client_id)
+        elif is_stream:
             # 流式响应
-            return handle_streaming_response(model_key, messages, completion_kwargs, model_config, start_time)
+            return handle_streaming_response(model_key, messages, completion_kwargs, model_config, start_time, client_id, conversation_id, message)
         else:
             # 非流式响应
-            return handle_normal_response(model_key, messages, completion_kwargs, model_config, start_time)
+            return handle_normal_response(model_key, messages, completion_kwargs, model_config, start_time, client_id, conversation_id, message)
             
     except Exception as e:
         response_time = time.time() - start_time
         error_msg = str(e)
         model_name = model_config.display_name if 'model_config' in locals() else model_key
         logger.log_api_call(model_name, False, response_time, error_msg)
-        return jsonify({'error': f'请求失败: {error_msg}'}), 500
+        return with_server_timing(jsonify({'error': f'请求失败: {error_msg}'}), timer), 500
+
+def with_server_timing(response, timer):
+    """附加 Server-Timing 响应头，并把耗时分解写入日志"""
+    response.headers['Server-Timing'] = timer.server_timing()
+    logger.info(f"请求耗时分解: {timer.summary()}")
+    return response
+
+@app.route('/chat/<stream_id>/cancel', methods=['POST'])
+def cancel_chat(stream_id):
+    """取消进行中的流式生成"""
+    if not stream_registry.cancel(stream_id):
+        return jsonify({'error': '生成不存在或已结束'}), 404
+    return jsonify({'cancelled': True})
+
+@app.route('/ollama/status', methods=['GET'])
+def ollama_status():
+    """获取本地 Ollama 模型的加载状态"""
+    return jsonify({'keep_alive': ollama_manager.keep_alive, 'models': ollama_manager.status()})
+
+@app.route('/metrics/pools', methods=['GET'])
+def pool_metrics():
+    """获取各上游连接池的使用情况"""
+    return jsonify(connection_pools.metrics())
+
+@app.route('/metrics/cache', methods=['GET'])
+def cache_metrics():
+    """获取共享缓存的条目数、占用空间和本进程的命中率"""
+    return jsonify(shared_cache.stats())
 
-def handle_normal_response(model_key, messages, completion_kwargs, model_config, start_time):
-    """处理非流式响应"""
+@app.route('/usage', methods=['GET'])
+def usage():
+    """获取按模型和客户端聚合的用量与成本"""
+    return jsonify(usage_tracker.snapshot())
+
+@app.route('/conversations/<conversation_id>/messages', methods=['GET'])
+def conversation_messages(conversation_id):
+    """分页获取会话历史消息，使用 before 参数向前翻页"""
+    if not conversation_store.conversation_exists(conversation_id):
+        return jsonify({'error': '会话不存在'}), 404
+    limit = request.args.get('limit', 50, type=int)
+    before_id = request.args.get('before', type=int)
+    return jsonify(conversation_store.get_messages(conversation_id, limit, before_id))
+
+def require_admin(view):
+    """管理接口鉴权：未配置 ADMIN_TOKEN 时接口不存在，请求需携带 Authorization: Bearer <令牌>"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.ADMIN_TOKEN:
+            abort(404)
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(token.encode(), Config.ADMIN_TOKEN.encode()):
+            return jsonify({'error': '管理令牌无效'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def download_response(data: bytes, name: str, extension: str = 'txt',
+                      mimetype: str = 'text/plain; charset=utf-8') -> Response:
+    """以附件形式返回分析结果，文件名带进程号以区分不同的 worker"""
+    return Response(data, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{name}-{os.getpid()}-{int(time.time())}.{extension}"'
+    })
+
+@app.route('/admin/profile/cpu', methods=['GET', 'POST', 'DELETE'])
+@require_admin
+def admin_profile_cpu():
+    """查看（GET）、启用（POST，参数 requests 或 seconds）或停止（DELETE）CPU 分析"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        return jsonify(profiler.start_cpu(data.get('requests'), data.get('seconds')))
+    if request.method == 'DELETE':
+        return jsonify(profiler.stop_cpu())
+    return jsonify(profiler.cpu_status())
+
+@app.route('/admin/profile/cpu/report', methods=['GET'])
+@require_admin
+def admin_profile_cpu_report():
+    """下载 CPU 分析结果，format=prof 时为可用 snakeviz 打开的 pstats 文件"""
+    fmt = request.args.get('format', 'text')
+    report = profiler.cpu_report(fmt, request.args.get('sort', 'cumulative'), request.args.get('limit', 50, type=int))
+    if report is None:
+        return jsonify({'error': '当前进程还没有分析结果', **profiler.cpu_status()}), 404
+    if fmt == 'prof':
+        return download_response(report, 'cpu', 'prof', 'application/octet-stream')
+    return download_response(report, 'cpu')
+
+@app.route('/admin/profile/memory', methods=['GET', 'POST', 'DELETE'])
+@require_admin
+def admin_profile_memory():
+    """查看（GET）、开始跟踪并记录基准快照（POST）或停止跟踪（DELETE）内存分配"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        return jsonify(profiler.start_memory(int(data.get('frames', 10))))
+    if request.method == 'DELETE':
+        return jsonify(profiler.stop_memory())
+    return jsonify(profiler.memory_status())
+
+@app.route('/admin/profile/memory/diff', methods=['GET'])
+@require_admin
+def admin_profile_memory_diff():
+    """下载当前内存与基准快照的对比"""
+    report = profiler.memory_diff(request.args.get('limit', 30, type=int), request.args.get('key', 'lineno'))
+    if report is None:
+        return jsonify({'error': '当前进程未开始内存跟踪', **profiler.memory_status()}), 404
+    return download_response(report, 'memory')
+
+@app.route('/admin/threads', methods=['GET'])
+@require_admin
+def admin_threads():
+    """下载所有线程的调用栈"""
+    return download_response(profiler.thread_stacks(), 'threads')
+
+def handle_normal_response(model_key, messages, completion_kwargs, model_config, start_time, client_id, conversation_id, user_message):
+    """
+    处理非流式响应
+    会话中只保存用户的原始消息（不保存搜索增强后的提示词），且在调用成功后与回答一起写入
+    """
+    timer = completion_kwargs['timer']
     try:
-        response = myllm.completion(
+        # 主模型失败时自动切换备用模型
+        response, model_config = myllm.completion_with_fallback(
             model_key=model_key,
             messages=messages,
             **completion_kwargs
@@ -124,58 +562,332 @@ def handle_normal_response(model_key, messages, completion_kwargs, model_config,
         if response.choices and len(response.choices) > 0:
             reply = response.choices[0].message.content
             logger.log_api_call(model_config.display_name, True, response_time)
-            return jsonify({'reply': reply})
+            usage_info = record_usage(model_config, client_id, messages, extract_usage(response), reply or '')
+            conversation_store.add_exchange(conversation_id, user_message, reply or '', model_config.name)
+            return with_server_timing(jsonify({
+                'reply': reply,
+                'usage': usage_info,
+                'conversation_id': conversation_id,
+                'model': model_config.name,
+                'model_name': model_config.display_name
+            }), timer)
         else:
             logger.log_api_call(model_config.display_name, False, response_time, "模型返回空响应")
-            return jsonify({'error': '模型返回空响应'}), 500
+            return with_server_timing(jsonify({'error': '模型返回空响应'}), timer), 500
+    except DeadlineExceeded as e:
+        response_time = time.time() - start_time
+        logger.log_api_call(model_config.display_name, False, response_time, str(e))
+        return with_server_timing(jsonify({'error': f'请求超时: {e}'}), timer), 504
+    except ContextLengthError as e:
+        logger.log_api_call(model_config.display_name, False, time.time() - start_time, str(e))
+        return with_server_timing(jsonify({'error': str(e)}), timer), 413
     except Exception as e:
         response_time = time.time() - start_time
         error_msg = str(e)
         logger.log_api_call(model_config.display_name, False, response_time, error_msg)
-        return jsonify({'error': f'请求失败: {error_msg}'}), 500
+        return with_server_timing(jsonify({'error': f'请求失败: {error_msg}'}), timer), 500
 
-def handle_streaming_response(model_key, messages, completion_kwargs, model_config, start_time):
-    """处理流式响应"""
+def handle_streaming_response(model_key, messages, completion_kwargs, model_config, start_time, client_id, conversation_id, user_message):
+    """
+    处理流式响应
+    生成结束后把用户的原始消息和回答一起写入会话；出错或取消且没有任何输出时不写入
+    """
     from flask import Response
     import json
     
     def generate():
+        stream_id, cancel_event = stream_registry.register()
+        response = None
+        content_parts = []
+        # 当前模型输出的部分，模型切换后重新计数
+        segment_parts = []
+        stream_usage = {}
+        active_model = model_config
+        finalized = False
+
+        deadline = completion_kwargs.get('deadline')
+        timer = completion_kwargs['timer']
+        stream_started = time.perf_counter()
+        first_token_at = None
+
+        def record_stream_timing():
+            """记录首 token 和生成阶段的耗时"""
+            if first_token_at is not None:
+                timer.add('ttft', first_token_at - stream_started)
+                timer.add('generation', time.perf_counter() - first_token_at)
+            logger.info(f"请求耗时分解: {timer.summary()}")
+
+        def current_messages():
+            """当前轮次的请求消息，工具调用后包含工具结果"""
+            return getattr(response, 'messages', None) or messages
+
+        def finalize(reason=None):
+            """保存本轮问答并记录用量，reason 非空表示生成被提前终止，此时用量按已生成的内容估算"""
+            nonlocal finalized
+            finalized = True
+            reply = ''.join(content_parts)
+            if reason:
+                myllm.close_stream(response)
+            if reply or not reason:
+                conversation_store.add_exchange(conversation_id, user_message, reply, active_model.name)
+            usage_info = record_usage(active_model, client_id, current_messages(), stream_usage, ''.join(segment_parts))
+            if reason:
+                logger.info(f"流式生成提前终止({reason}) - 模型: {active_model.display_name}, "
+                            f"已生成 {usage_info.get('completion_tokens', 0)} tokens, 成本: ${usage_info['cost']:.6f}")
+            return usage_info
+
         try:
-            response = myllm.completion(
-                model_key=model_key,
-                messages=messages,
-                **completion_kwargs
-            )
-            
-            for chunk in response:
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta = chunk.choices[0].delta
-                    if hasattr(delta, 'content') and delta.content:
-                        # 发送流式数据
-                        data = json.dumps({'content': delta.content}, ensure_ascii=False)
+            # 先告知客户端会话 ID 和流 ID，后续请求据此续接对话或取消生成
+            yield f"data: {json.dumps({'conversation_id': conversation_id, 'stream_id': stream_id})}\n\n"
+
+            # 主模型失败时切换备用模型继续输出，用户取消后不再回退
+            stream_started = time.perf_counter()
+            if 'tools' in completion_kwargs:
+                response = myllm.stream_with_tools(
+                    model_key=model_key,
+                    messages=messages,
+                    should_stop=cancel_event.is_set,
+                    **completion_kwargs
+                )
+            else:
+                response = myllm.stream_with_fallback(
+                    model_key=model_key,
+                    messages=messages,
+                    should_stop=cancel_event.is_set,
+                    **completion_kwargs
+                )
+            stream_registry.attach(stream_id, response.close)
+
+            try:
+                for chunk in response:
+                    if cancel_event.is_set() or (deadline and deadline.expired):
+                        break
+                    if isinstance(chunk, ModelSwitch):
+                        # 失败模型已生成部分的用量单独记录，之后按新模型计数
+                        record_usage(chunk.from_model, client_id, current_messages(), stream_usage, chunk.partial_text)
+                        logger.log_api_call(chunk.from_model.display_name, False, time.time() - start_time, chunk.error)
+                        active_model = chunk.to_model
+                        segment_parts = []
+                        stream_usage = {}
+                        data = json.dumps({'model_switch': {
+                            'from': chunk.from_model.display_name,
+                            'to': chunk.to_model.display_name,
+                            'model': chunk.to_model.name,
+                            'continued': bool(content_parts)
+                        }}, ensure_ascii=False)
+                        yield f"data: {data}\n\n"
+                        continue
+                    if isinstance(chunk, ToolRound):
+                        # 发起工具调用的这一轮单独记录用量，工具参数计入输出
+                        arguments_text = ''.join(call['arguments'] for call in chunk.calls)
+                        record_usage(chunk.model, client_id, chunk.messages, stream_usage,
+                                     chunk.partial_text + arguments_text)
+                        segment_parts = []
+                        stream_usage = {}
+                        data = json.dumps({'tool_calls': [
+                            {'name': call['name'], 'arguments': call['arguments']} for call in chunk.calls
+                        ]}, ensure_ascii=False)
                         yield f"data: {data}\n\n"
+                        continue
+                    if isinstance(chunk, ToolResult):
+                        data = json.dumps({'tool_result': {'name': chunk.name, **chunk.summary}}, ensure_ascii=False)
+                        yield f"data: {data}\n\n"
+                        continue
+                    # 用量通常在最后一个（choices 为空的）分块中返回
+                    stream_usage = extract_usage(chunk) or stream_usage
+                    if chunk.choices and len(chunk.choices) > 0:
+                        delta = chunk.choices[0].delta
+                        if hasattr(delta, 'content') and delta.content:
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                            content_parts.append(delta.content)
+                            segment_parts.append(delta.content)
+                            # 发送流式数据
+                            data = json.dumps({'content': delta.content}, ensure_ascii=False)
+                            yield f"data: {data}\n\n"
+            except Exception:
+                # 取消时上游连接被关闭、或到达截止时间读取超时，迭代会抛出异常
+                if not (cancel_event.is_set() or (deadline and deadline.expired)):
+                    raise
+
+            # 保存助手回复并发送用量信息
+            if cancel_event.is_set():
+                stop_reason = 'cancelled'
+            elif deadline and deadline.expired:
+                stop_reason = 'deadline'
+            else:
+                stop_reason = None
+            usage_info = finalize(stop_reason)
+            if stop_reason:
+                yield f"data: {json.dumps({'stopped': stop_reason})}\n\n"
+            yield f"data: {json.dumps({'usage': usage_info}, ensure_ascii=False)}\n\n"
+            
+            # 发送耗时分解，浏览器控制台中可查看
+            record_stream_timing()
+            yield f"data: {json.dumps({'timing': timer.to_dict()}, ensure_ascii=False)}\n\n"
             
             # 发送结束标记
             yield "data: [DONE]\n\n"
             
             # 记录成功的API调用
             response_time = time.time() - start_time
-            logger.log_api_call(model_config.display_name, True, response_time)
+            logger.log_api_call(active_model.display_name, True, response_time)
             
+        except GeneratorExit:
+            # 客户端断开连接（关闭页面或中止请求），立即停止上游生成
+            if not finalized and response is not None:
+                finalize('disconnected')
+                record_stream_timing()
+            raise
         except Exception as e:
             # 发送错误信息
             error_msg = str(e)
             error_data = json.dumps({'error': error_msg}, ensure_ascii=False)
             yield f"data: {error_data}\n\n"
+            record_stream_timing()
+            yield f"data: {json.dumps({'timing': timer.to_dict()}, ensure_ascii=False)}\n\n"
             
             # 记录失败的API调用
             response_time = time.time() - start_time
-            logger.log_api_call(model_config.display_name, False, response_time, error_msg)
+            logger.log_api_call(active_model.display_name, False, response_time, error_msg)
+        finally:
+            stream_registry.unregister(stream_id)
+            if not finalized:
+                myllm.close_stream(response)
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            # 响应头发出时只有模型调用之前的阶段（解析、会话、联网查询）已完成，其余阶段见 timing 事件
+            'Server-Timing': completion_kwargs['timer'].server_timing(include_total=False),
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Content-Type'
+        }
+    )
+
+def handle_compare_response(model_configs, messages, completion_kwargs, start_time, client_id):
+    """
+    处理对比模式的流式响应
+    多个模型的输出复用同一个 SSE 连接，每个事件带有模型键名；各模型结束时发送首 token 耗时、生成速度和成本
+    """
+    from flask import Response
+    import json
+    
+    def event(payload):
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        stream_id, cancel_event = stream_registry.register()
+        deadline = completion_kwargs.get('deadline')
+        timer = completion_kwargs['timer']
+        states = {
+            config.name: {'config': config, 'parts': [], 'usage': {}, 'first_token_at': None, 'done': False}
+            for config in model_configs
+        }
+        response = None
+        stream_started = time.perf_counter()
+        
+        def stop_reason():
+            if cancel_event.is_set():
+                return 'cancelled'
+            if deadline and deadline.expired:
+                return 'deadline'
+            return None
+        
+        def finish_model(model_key, error=None):
+            """记录一个模型的用量和耗时，返回该模型的统计信息"""
+            state = states[model_key]
+            state['done'] = True
+            config = state['config']
+            finished_at = time.perf_counter()
+            text = ''.join(state['parts'])
+            stats = {'total_ms': round((finished_at - stream_started) * 1000, 1)}
+            # 没有任何输出的失败调用不计用量，与单模型流式响应一致
+            if text or not error:
+                stats.update(record_usage(config, client_id, messages, state['usage'], text))
+            first_token_at = state['first_token_at']
+            if first_token_at is not None:
+                ttft = first_token_at - stream_started
+                generation = finished_at - first_token_at
+                timer.add('ttft', ttft, model_key)
+                timer.add('generation', generation, model_key)
+                stats['ttft_ms'] = round(ttft * 1000, 1)
+                completion_tokens = stats.get('completion_tokens', 0)
+                stats['tokens_per_second'] = round(completion_tokens / generation, 1) if generation > 0 else None
+            logger.log_api_call(config.display_name, error is None, time.time() - start_time, error)
+            return stats
+        
+        try:
+            yield event({'stream_id': stream_id, 'compare': [
+                {'model': config.name, 'name': config.display_name} for config in model_configs
+            ]})
+            
+            stream_started = time.perf_counter()
+            response = myllm.stream_many(
+                [config.name for config in model_configs], messages,
+                should_stop=cancel_event.is_set, **completion_kwargs
+            )
+            stream_registry.attach(stream_id, response.close)
+            
+            for model_key, item in response:
+                state = states[model_key]
+                if isinstance(item, Exception):
+                    # 取消时上游连接被关闭、或到达截止时间读取超时，按停止处理
+                    reason = stop_reason()
+                    if reason:
+                        yield event({'model': model_key, 'stopped': reason, 'done': finish_model(model_key)})
+                    else:
+                        yield event({'model': model_key, 'error': str(item), 'done': finish_model(model_key, str(item))})
+                    continue
+                if item is None:
+                    payload = {'model': model_key, 'done': finish_model(model_key)}
+                    if stop_reason():
+                        payload['stopped'] = stop_reason()
+                    yield event(payload)
+                    continue
+                # 用量通常在最后一个（choices 为空的）分块中返回
+                state['usage'] = extract_usage(item) or state['usage']
+                text = chunk_text(item)
+                if text:
+                    if state['first_token_at'] is None:
+                        state['first_token_at'] = time.perf_counter()
+                    state['parts'].append(text)
+                    yield event({'model': model_key, 'content': text})
+            
+            # 到达截止时间时仍在生成的模型
+            response.close()
+            for model_key, state in states.items():
+                if not state['done']:
+                    yield event({'model': model_key, 'stopped': stop_reason() or 'deadline', 'done': finish_model(model_key)})
+            
+            logger.info(f"请求耗时分解: {timer.summary()}")
+            yield event({'timing': timer.to_dict()})
+            yield "data: [DONE]\n\n"
+        
+        except GeneratorExit:
+            # 客户端断开连接，停止所有模型并记录已生成部分的用量
+            if response is not None:
+                response.close()
+            for model_key, state in states.items():
+                if not state['done']:
+                    finish_model(model_key)
+            raise
+        except Exception as e:
+            if response is not None:
+                response.close()
+            yield event({'error': str(e)})
+            logger.log_api_call('对比模式', False, time.time() - start_time, str(e))
+        finally:
+            stream_registry.unregister(stream_id)
     
     return Response(
         generate(),
         mimetype='text/event-stream',
         headers={
+            'Server-Timing': completion_kwargs['timer'].server_timing(include_total=False),
             'Cache-Control': 'no-cache',
             'Connection': 'keep-alive',
             'Access-Control-Allow-Origin': '*',
@@ -188,6 +900,7 @@ if __name__ == '__main__':
     logger.info(f"监听地址: {Config.HOST}:{Config.PORT}")
     logger.info(f"调试模式: {Config.DEBUG}")
     
+    start_background_tasks()
     app.run(
         debug=Config.DEBUG,
         host=Config.HOST,
@@ -7,7 +7,7 @@
 
 import os
 from typing import Dict, List, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -21,6 +21,13 @@ class ModelConfig:
     base_url: Optional[str] = None
     custom_llm_provider: Optional[str] = None
     enabled: bool = True
+    search_context_tokens: Optional[int] = None  # 联网查询上下文 token 预算，None 表示使用全局默认值
+    supports_vision: bool = False  # 是否支持图片输入
+    supports_tools: bool = False  # 是否支持工具调用（function calling）
+    image_max_side: int = 1536  # 图片缩放后的最长边像素数
+    fallbacks: List[str] = field(default_factory=list)  # 调用失败时依次尝试的备用模型键名
+    context_window: Optional[int] = None  # 上下文长度（输入加输出的 token 数），None 表示不在本地校验
+    tokenizer: Optional[str] = None  # 本地计数使用的分词器（见 token_counter.TokenCounter），None 表示按字符估算
 
 
 class Config:
@@ -31,9 +38,132 @@ class Config:
     HOST = os.getenv('HOST', '127.0.0.1')
     PORT = int(os.getenv('PORT', 5000))
     
+    # 生产部署配置（gunicorn.conf.py）：WEB_CONCURRENCY 为 0 时按 CPU 核数计算 worker 数
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 0))
+    GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 8))
+    GUNICORN_MAX_REQUESTS = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+    GUNICORN_MAX_REQUESTS_JITTER = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+    # 部署在反向代理之后时信任的代理层数，用于从 X-Forwarded-For 取得真实客户端地址
+    PROXY_COUNT = int(os.getenv('PROXY_COUNT', 0))
+    
+    # 管理接口令牌（性能分析等），为空时不启用管理接口
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+    
     # 聊天配置
     MAX_TOKENS = int(os.getenv('MAX_TOKENS', 1000))
     TEMPERATURE = float(os.getenv('TEMPERATURE', 0.7))
+    # 为支持显式缓存标记的供应商（Anthropic）标记系统消息和会话历史为可缓存前缀
+    PROMPT_CACHE_ENABLED = os.getenv('PROMPT_CACHE_ENABLED', 'True').lower() == 'true'
+    
+    # 上下文长度校验：请求发出之前在本地计数，裁剪放不下的早期历史，并把 max_tokens 限制在剩余上下文之内
+    CONTEXT_CHECK_ENABLED = os.getenv('CONTEXT_CHECK_ENABLED', 'True').lower() == 'true'
+    CONTEXT_AUTO_TRIM = os.getenv('CONTEXT_AUTO_TRIM', 'True').lower() == 'true'
+    # 剩余上下文少于该值时（或裁剪后仍如此）拒绝请求
+    MIN_COMPLETION_TOKENS = int(os.getenv('MIN_COMPLETION_TOKENS', 256))
+    # 启动时在后台加载各模型的分词器，加载完成之前按字符估算 token 数
+    TOKENIZER_PRELOAD = os.getenv('TOKENIZER_PRELOAD', 'True').lower() == 'true'
+    
+    # 请求截止时间配置（秒），客户端可以在请求中指定更短或不超过上限的截止时间
+    REQUEST_DEADLINE = float(os.getenv('REQUEST_DEADLINE', 60))
+    MAX_REQUEST_DEADLINE = float(os.getenv('MAX_REQUEST_DEADLINE', 180))
+    # 联网查询阶段最多占用的剩余时间比例，其余留给模型回答
+    SEARCH_DEADLINE_SHARE = float(os.getenv('SEARCH_DEADLINE_SHARE', 0.4))
+    KEYWORD_EXTRACTION_TIMEOUT = float(os.getenv('KEYWORD_EXTRACTION_TIMEOUT', 5))
+    SEARCH_REQUEST_TIMEOUT = float(os.getenv('SEARCH_REQUEST_TIMEOUT', 10))
+    
+    # 图片上传配置
+    MAX_IMAGE_BYTES = int(os.getenv('MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+    MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 40_000_000))
+    MAX_IMAGES_PER_MESSAGE = int(os.getenv('MAX_IMAGES_PER_MESSAGE', 4))
+    IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+    IMAGE_CACHE_SIZE = int(os.getenv('IMAGE_CACHE_SIZE', 64))
+    # Flask 请求体大小上限，超出时直接返回 413
+    MAX_CONTENT_LENGTH = MAX_IMAGE_BYTES * MAX_IMAGES_PER_MESSAGE + 1024 * 1024
+    
+    # 启动时发现前端依赖未下载到本地，是否在后台自动下载（下载完成前页面从 CDN 加载）
+    STATIC_AUTO_FETCH = os.getenv('STATIC_AUTO_FETCH', 'True').lower() == 'true'
+    
+    # 会话存储配置
+    CONVERSATION_DB = os.getenv('CONVERSATION_DB', os.path.join('data', 'conversations.db'))
+    # 每轮发送的历史消息 token 预算；模型上下文的剩余部分（扣除输出、当前问题和搜索结果）更小时以剩余部分为准
+    HISTORY_MAX_TOKENS = int(os.getenv('HISTORY_MAX_TOKENS', 4000))
+    HISTORY_MAX_MESSAGES = int(os.getenv('HISTORY_MAX_MESSAGES', 50))
+    # 多进程部署时，worker 检查本进程的流式生成是否被其他 worker 取消的间隔（秒）
+    STREAM_CANCEL_POLL_INTERVAL = float(os.getenv('STREAM_CANCEL_POLL_INTERVAL', 0.5))
+    
+    # 用量统计配置
+    USAGE_FILE = os.getenv('USAGE_FILE', os.path.join('logs', 'usage.json'))
+    USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', 60))
+    
+    # 共享缓存配置：sqlite 在所有 worker 间共享，memory 为进程内缓存，none 关闭缓存
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'sqlite')
+    CACHE_DB = os.getenv('CACHE_DB', os.path.join('data', 'cache.db'))
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # 各类缓存的过期时间（秒），0 表示不缓存
+    LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 3600))
+    SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 600))
+    
+    # 联网查询配置
+    SEARCH_CONTEXT_TOKENS = int(os.getenv('SEARCH_CONTEXT_TOKENS', 1500))
+    SEARCH_SNIPPET_TOKENS = int(os.getenv('SEARCH_SNIPPET_TOKENS', 300))
+    SEARCH_PAGE_TOKENS = int(os.getenv('SEARCH_PAGE_TOKENS', 600))
+    SEARCH_CANDIDATES = int(os.getenv('SEARCH_CANDIDATES', 20))
+    SEARCH_RESULTS_PER_KEYWORD = int(os.getenv('SEARCH_RESULTS_PER_KEYWORD', 10))
+    SEARCH_TOP_K = int(os.getenv('SEARCH_TOP_K', 5))
+    # 自动联网模式：本地分类器判断需要联网的概率不低于该阈值时才执行联网查询
+    AUTO_SEARCH_THRESHOLD = float(os.getenv('AUTO_SEARCH_THRESHOLD', 0.5))
+    # 可选的补充训练样本（JSONL，每行 {"text": ..., "label": 0 或 1}）
+    SEARCH_CLASSIFIER_DATA = os.getenv('SEARCH_CLASSIFIER_DATA', '')
+    # 支持工具调用的模型在流式回答时自行决定是否搜索及搜索关键词，省去单独的关键词提取调用
+    WEB_SEARCH_TOOL_CALLING = os.getenv('WEB_SEARCH_TOOL_CALLING', 'True').lower() == 'true'
+    MAX_TOOL_ROUNDS = int(os.getenv('MAX_TOOL_ROUNDS', 2))
+    
+    # 搜索引擎调用方式：single 只使用 DEFAULT_SEARCH_ENGINE，parallel 同时查询所有已配置的引擎
+    SEARCH_ENGINE_MODE = os.getenv('SEARCH_ENGINE_MODE', 'single').lower()
+    # 并行模式下去重后的结果达到该条数即返回，不再等待较慢的引擎
+    SEARCH_FIRST_K = int(os.getenv('SEARCH_FIRST_K', SEARCH_CANDIDATES))
+    # 并行模式下已有结果时最多等待的秒数
+    SEARCH_MERGE_TIMEOUT = float(os.getenv('SEARCH_MERGE_TIMEOUT', 3))
+    SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', 8))
+    # 近似重复检测：SimHash 指纹相差不超过该位数的摘要或正文视为重复，每组只保留最相关的一条
+    SIMHASH_MAX_DISTANCE = int(os.getenv('SIMHASH_MAX_DISTANCE', 6))
+    SIMHASH_MAX_CHARS = int(os.getenv('SIMHASH_MAX_CHARS', 2000))
+    
+    # 搜索结果重排序配置（向量模型为空时只使用 BM25）
+    RERANK_EMBEDDING_MODEL = os.getenv('RERANK_EMBEDDING_MODEL', '')
+    RERANK_EMBEDDING_WEIGHT = float(os.getenv('RERANK_EMBEDDING_WEIGHT', 0.5))
+    
+    # 网页正文抓取配置
+    SEARCH_FETCH_TOP_K = int(os.getenv('SEARCH_FETCH_TOP_K', 3))
+    PAGE_FETCH_WORKERS = int(os.getenv('PAGE_FETCH_WORKERS', 4))
+    PAGE_FETCH_MAX_BYTES = int(os.getenv('PAGE_FETCH_MAX_BYTES', 512 * 1024))
+    PAGE_FETCH_TIMEOUT = float(os.getenv('PAGE_FETCH_TIMEOUT', 4))
+    PAGE_MAX_CHARS = int(os.getenv('PAGE_MAX_CHARS', 8000))
+    # 页面正文存入共享缓存的时间（秒），0 表示不缓存
+    PAGE_CACHE_TTL = float(os.getenv('PAGE_CACHE_TTL', 3600))
+    IQS_MAIN_TEXT = os.getenv('IQS_MAIN_TEXT', 'False').lower() == 'true'
+    
+    # Ollama 本地模型配置：keep_alive 为时长（如 30m）或秒数（-1 表示常驻内存）
+    OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+    OLLAMA_WARMUP = os.getenv('OLLAMA_WARMUP', 'True').lower() == 'true'
+    OLLAMA_WARMUP_INTERVAL = float(os.getenv('OLLAMA_WARMUP_INTERVAL', 600))
+    OLLAMA_WARMUP_TIMEOUT = float(os.getenv('OLLAMA_WARMUP_TIMEOUT', 300))
+    
+    # 上游 HTTP 连接池配置：每个上游主机一个共享连接池，HTTPS 上游在安装 h2 时使用 HTTP/2
+    HTTP_POOL_ENABLED = os.getenv('HTTP_POOL_ENABLED', 'True').lower() == 'true'
+    HTTP_POOL_MAX_CONNECTIONS = int(os.getenv('HTTP_POOL_MAX_CONNECTIONS', 20))
+    HTTP_POOL_MAX_KEEPALIVE = int(os.getenv('HTTP_POOL_MAX_KEEPALIVE', 10))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 120))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 600))
+    HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'True').lower() == 'true'
+    
+    # 模型回退配置：主模型失败时按 ModelConfig.fallbacks 依次切换备用模型
+    MODEL_FALLBACK_ENABLED = os.getenv('MODEL_FALLBACK_ENABLED', 'True').lower() == 'true'
+    
+    # 对比模式：同一问题最多同时发给的模型数
+    COMPARE_MAX_MODELS = int(os.getenv('COMPARE_MAX_MODELS', 4))
     
     # 模型配置
     MODELS: List[ModelConfig] = [
@@ -43,7 +173,13 @@ class Config:
             provider="openai",
             model_name="gpt-4o",
             api_key_env="OPENAI_API_KEY",
-            enabled=False  # 暂时屏蔽
+            enabled=False,  # 暂时屏蔽
+            supports_vision=True,
+            supports_tools=True,
+            image_max_side=2048,
+            fallbacks=["azure-gpt-4o", "claude-3-sonnet"],
+            context_window=128000,
+            tokenizer="tiktoken:o200k_base"
         ),
         ModelConfig(
             name="claude-3-sonnet",
@@ -51,7 +187,13 @@ class Config:
             provider="anthropic",
             model_name="claude-3-sonnet-20240229",
             api_key_env="ANTHROPIC_API_KEY",
-            enabled=False  # 暂时屏蔽
+            enabled=False,  # 暂时屏蔽
+            supports_vision=True,
+            supports_tools=True,
+            image_max_side=1568,
+            fallbacks=["gpt-4o", "azure-gpt-4o"],
+            context_window=200000,
+            tokenizer="anthropic"
         ),
         ModelConfig(
             name="azure-gpt-4o",
@@ -59,7 +201,13 @@ class Config:
             provider="azure",
             model_name="azure/gpt-4o",
             api_key_env="AZURE_API_KEY",
-            base_url=os.getenv('AZURE_API_BASE')
+            base_url=os.getenv('AZURE_API_BASE'),
+            supports_vision=True,
+            supports_tools=True,
+            image_max_side=2048,
+            fallbacks=["gpt-4o", "qwen2.5-72b-instruct"],
+            context_window=128000,
+            tokenizer="tiktoken:o200k_base"
         ),
         ModelConfig(
             name="qwen2.5-72b-instruct",
@@ -67,7 +215,11 @@ class Config:
             provider="openai",
             model_name="openai/qwen2.5-72b-instruct",
             api_key_env="DASHSCOPE_API_KEY",
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            supports_tools=True,
+            fallbacks=["baichuan4", "qwq"],
+            context_window=131072,
+            tokenizer="huggingface:Qwen/Qwen2.5-72B-Instruct/tokenizer.json"
         ),
         ModelConfig(
             name="baichuan4",
@@ -75,7 +227,9 @@ class Config:
             provider="openai",
             model_name="openai/Baichuan4-turbo",
             api_key_env="BAICHUAN_API_KEY",
-            base_url=os.getenv('BAICHUAN_BASE_URL')
+            base_url=os.getenv('BAICHUAN_BASE_URL'),
+            fallbacks=["qwen2.5-72b-instruct", "qwq"],
+            context_window=32768
         ),
         ModelConfig(
             name="DeepSeek-R1",
@@ -83,16 +237,23 @@ class Config:
             provider="huggingface",
             model_name="huggingface/together/deepseek-ai/DeepSeek-R1",
             api_key_env="HF_TOKEN",
-            custom_llm_provider="huggingface"
+            custom_llm_provider="huggingface",
+            fallbacks=["qwen2.5-72b-instruct", "qwq"],
+            context_window=128000,
+            tokenizer="huggingface:deepseek-ai/DeepSeek-R1/tokenizer.json"
         ),
         ModelConfig(
             name="qwq",
             display_name="Ollama QwQ",
             provider="ollama",
-            model_name="ollama/qwq",
+            model_name="ollama_chat/qwq",  # 使用 /api/chat 接口，支持 keep_alive
             api_key_env="OLLAMA_API_KEY",
             base_url="http://localhost:11434",
-            enabled=True
+            enabled=True,
+            search_context_tokens=1000,  # 本地模型上下文较小
+            fallbacks=["qwen2.5-72b-instruct"],
+            context_window=32768,
+            tokenizer="huggingface:Qwen/QwQ-32B/tokenizer.json"
         )
     ]
     
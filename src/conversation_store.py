@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话存储模块
+使用 SQLite 保存多轮对话，并按模型 token 预算增量裁剪上下文
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional
+from config import Config, ModelConfig
+from logger import logger
+from utils import estimate_tokens
+from token_counter import token_counter
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    model TEXT,
+    token_count INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id);
+CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at);
+"""
+
+
+class ConversationStore:
+    """
+    会话存储
+    每个线程使用独立的 SQLite 连接，数据库以 WAL 模式运行，读写互不阻塞
+    消息写入时按字符估算一次 token 数并保存，未指定目标模型时裁剪上下文直接使用该估算值；
+    指定了目标模型时按模型的分词器计数（计数按文本缓存），与请求发出前的上下文校验使用同一计数
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or Config.CONVERSATION_DB
+        self._local = threading.local()
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = connection
+        return connection
+
+    def create_conversation(self, title: str = '') -> str:
+        """创建新会话，返回会话 ID"""
+        conversation_id = uuid.uuid4().hex
+        now = time.time()
+        self._connection().execute(
+            'INSERT INTO conversations (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)',
+            (conversation_id, title[:100], now, now)
+        )
+        return conversation_id
+
+    def conversation_exists(self, conversation_id: str) -> bool:
+        """检查会话是否存在"""
+        row = self._connection().execute(
+            'SELECT 1 FROM conversations WHERE id = ?', (conversation_id,)
+        ).fetchone()
+        return row is not None
+
+    def add_message(self, conversation_id: str, role: str, content: str, model: str = None) -> int:
+        """
+        追加一条消息
+
+        Args:
+            conversation_id: 会话 ID
+            role: 消息角色（user / assistant）
+            content: 消息内容
+            model: 生成该消息的模型键名
+
+        Returns:
+            int: 消息 ID
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = connection.execute(
+                'INSERT INTO messages (conversation_id, role, content, model, token_count, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (conversation_id, role, content, model, estimate_tokens(content), now)
+            )
+            connection.execute('UPDATE conversations SET updated_at = ? WHERE id = ?', (now, conversation_id))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.lastrowid
+
+    def add_exchange(self, conversation_id: str, user_content: str, assistant_content: str,
+                     model: str = None) -> int:
+        """
+        在同一个事务中追加一轮问答
+        用户消息在回答生成之后才与回答一起写入，调用失败或取消且没有输出时不留下没有回答的用户消息
+
+        Returns:
+            int: 助手消息 ID
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for role, content, message_model in (('user', user_content, None),
+                                                 ('assistant', assistant_content, model)):
+                cursor = connection.execute(
+                    'INSERT INTO messages (conversation_id, role, content, model, token_count, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (conversation_id, role, content, message_model, estimate_tokens(content), now)
+                )
+            connection.execute('UPDATE conversations SET updated_at = ? WHERE id = ?', (now, conversation_id))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.lastrowid
+
+    def get_messages(self, conversation_id: str, limit: int = 50, before_id: int = None) -> Dict[str, Any]:
+        """
+        分页获取历史消息，从最新的消息往前翻页
+
+        Args:
+            conversation_id: 会话 ID
+            limit: 每页消息数
+            before_id: 只返回 ID 小于该值的消息，用于翻页
+
+        Returns:
+            Dict[str, Any]: 按时间正序排列的消息和下一页游标
+        """
+        limit = max(1, min(limit, 200))
+        rows = self._connection().execute(
+            'SELECT id, role, content, model, created_at FROM messages '
+            'WHERE conversation_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+            (conversation_id, before_id if before_id is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        messages = [dict(row) for row in reversed(rows)]
+        return {
+            'messages': messages,
+            'next_before': messages[0]['id'] if has_more and messages else None
+        }
+
+    def build_context(self, conversation_id: str, max_tokens: int = None, max_messages: int = None,
+                      model_config: Optional[ModelConfig] = None, reserved_tokens: int = 0) -> List[Dict[str, str]]:
+        """
+        按 token 预算组装历史上下文
+        从最新的消息往前逐行读取，超出预算即停止
+
+        Args:
+            conversation_id: 会话 ID
+            max_tokens: 历史消息的 token 预算，未指定时为 HISTORY_MAX_TOKENS，
+                目标模型配置了上下文长度时不超过上下文长度减去 reserved_tokens
+            max_messages: 最多包含的消息数
+            model_config: 目标模型配置，指定时按其分词器计数，否则使用写入时估算的 token 数
+            reserved_tokens: 为输出、当前问题和搜索结果等预留的 token 数
+
+        Returns:
+            List[Dict[str, str]]: 按时间正序排列的 litellm 消息列表
+        """
+        if max_tokens is None:
+            max_tokens = Config.HISTORY_MAX_TOKENS
+            # 上下文长度只是上限，历史预算仍受 HISTORY_MAX_TOKENS 限制，避免长上下文模型每轮发送大量历史
+            if model_config is not None and model_config.context_window:
+                max_tokens = min(max_tokens, max(model_config.context_window - reserved_tokens, 0))
+        max_messages = max_messages or Config.HISTORY_MAX_MESSAGES
+        cursor = self._connection().execute(
+            'SELECT role, content, token_count FROM messages WHERE conversation_id = ? ORDER BY id DESC',
+            (conversation_id,)
+        )
+
+        messages = []
+        counts = []
+        used = 0
+        for row in cursor:
+            message = {'role': row['role'], 'content': row['content']}
+            tokens = (token_counter.count_message(message, model_config) if model_config is not None
+                      else row['token_count'])
+            if used + tokens > max_tokens or len(messages) >= max_messages:
+                break
+            messages.append(message)
+            counts.append(tokens)
+            used += tokens
+        cursor.close()
+
+        # 上下文不能以助手消息开头
+        while messages and messages[-1]['role'] != 'user':
+            messages.pop()
+            used -= counts.pop()
+
+        logger.debug(f"会话 {conversation_id[:8]} 上下文: {len(messages)} 条消息, {used} tokens")
+        return messages[::-1]
+
+    def reset_after_fork(self):
+        """在 fork 出的 worker 进程中调用，丢弃继承的连接，SQLite 连接不能跨进程使用"""
+        self._local = threading.local()
+
+    def close(self):
+        """关闭当前线程的数据库连接"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+# 全局实例
+conversation_store = ConversationStore()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求截止时间模块
+为一次 /chat 请求设置统一的截止时间，各阶段按剩余时间计算自己的超时
+"""
+
+import math
+import time
+from typing import Optional
+from config import Config
+
+
+class DeadlineExceeded(TimeoutError):
+    """请求已超过截止时间"""
+
+
+class Deadline:
+    """
+    请求截止时间
+    基于单调时钟，不受系统时间调整影响
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_request(cls, seconds: Optional[float] = None) -> 'Deadline':
+        """
+        按客户端指定的秒数创建截止时间，未指定或无效（非数字、NaN、无穷大、非正数）时使用配置的默认值，
+        并限制在配置的上限内
+        """
+        try:
+            seconds = float(seconds) if seconds is not None else Config.REQUEST_DEADLINE
+        except (TypeError, ValueError):
+            seconds = Config.REQUEST_DEADLINE
+        if not math.isfinite(seconds) or seconds <= 0:
+            seconds = Config.REQUEST_DEADLINE
+        return cls(min(seconds, Config.MAX_REQUEST_DEADLINE))
+
+    def remaining(self) -> float:
+        """剩余秒数，已过期时为 0"""
+        return max(0.0, self._expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: float = None) -> float:
+        """
+        计算某个阶段可用的超时时间
+
+        Args:
+            cap: 该阶段自身的超时上限
+
+        Returns:
+            float: min(剩余时间, cap)
+
+        Raises:
+            DeadlineExceeded: 已经没有剩余时间
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"请求超过截止时间 {self.seconds:.0f}s")
+        return min(remaining, cap) if cap else remaining
+
+    def child(self, share: float = 1.0, cap: float = None) -> 'Deadline':
+        """
+        划出剩余时间的一部分作为子阶段的截止时间
+
+        Args:
+            share: 占剩余时间的比例
+            cap: 子阶段自身的时间上限
+        """
+        seconds = self.remaining() * share
+        return Deadline(min(seconds, cap) if cap else seconds)
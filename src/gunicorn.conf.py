@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gunicorn 生产部署配置
+用法：cd src && gunicorn -c gunicorn.conf.py wsgi:app
+
+- 预加载应用：模型配置、静态资源等在主进程中只初始化一次，worker 通过 fork 共享
+- fork 后在每个 worker 中重建连接池、数据库连接、日志句柄和线程池
+- 使用 gthread worker：模型调用以等待上游为主，一个进程内的多个线程可以同时保持多个流式连接
+- worker 处理一定数量的请求后平滑重启，释放长期运行积累的内存
+"""
+
+import multiprocessing
+from config import Config
+
+
+def default_workers(cpu_count: int = None) -> int:
+    """按 CPU 核数计算默认 worker 数：2 * 核数 + 1，上限 8（每个 worker 各自持有连接池和缓存）"""
+    cpu_count = cpu_count or multiprocessing.cpu_count()
+    return min(cpu_count * 2 + 1, 8)
+
+
+bind = f"{Config.HOST}:{Config.PORT}"
+workers = Config.WEB_CONCURRENCY or default_workers()
+worker_class = 'gthread'
+threads = Config.GUNICORN_THREADS
+preload_app = True
+
+# 平滑回收 worker，抖动避免所有 worker 同时重启
+max_requests = Config.GUNICORN_MAX_REQUESTS
+max_requests_jitter = Config.GUNICORN_MAX_REQUESTS_JITTER
+# 重启或退出时给进行中的流式回答留出完成的时间
+graceful_timeout = int(Config.REQUEST_DEADLINE) + 10
+# gthread worker 的心跳由主线程维护，长时间的流式请求不会触发该超时
+timeout = 60
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    """主进程就绪后启动 Ollama 预加载，只运行一份，不随 worker 数量重复；预加载结果经共享缓存供各 worker 的状态查询读取"""
+    from app import ollama_manager
+    ollama_manager.start()
+
+
+def post_fork(server, worker):
+    """worker 启动后重建不能跨进程共用的资源，并启动用量落盘"""
+    from app import reinit_after_fork, start_background_tasks
+    reinit_after_fork()
+    start_background_tasks(warm_up_models=False)
+
+
+def worker_exit(server, worker):
+    """worker 退出前写入尚未落盘的用量"""
+    from app import shutdown
+    shutdown()
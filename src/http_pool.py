@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP 连接池模块
+按上游服务地址维护共享的 httpx 连接池（支持时启用 HTTP/2），注入到 litellm 调用中，并统计连接池使用情况
+"""
+
+import os
+import threading
+from typing import Dict, Any, Optional, Tuple
+from urllib.parse import urlsplit
+import httpx
+from config import Config, ModelConfig
+from logger import logger
+
+# HTTP/2 依赖 h2，未安装时使用 HTTP/1.1
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import openai
+    from litellm.llms.custom_httpx.http_handler import HTTPHandler
+    LITELLM_CLIENTS_AVAILABLE = True
+except ImportError:
+    LITELLM_CLIENTS_AVAILABLE = False
+
+
+# 未配置 base_url 的模型使用供应商的默认地址
+DEFAULT_BASE_URLS = {
+    'openai': 'https://api.openai.com/v1',
+    'anthropic': 'https://api.anthropic.com',
+    'huggingface': 'https://router.huggingface.co',
+    'ollama': 'http://localhost:11434',
+}
+
+
+def pool_key(url: str) -> str:
+    """连接池按 scheme://host:port 区分，同一主机下的不同路径共用连接"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class ConnectionPoolManager:
+    """
+    连接池管理器
+    每个上游主机一个 httpx.Client；OpenAI 兼容和 Azure 模型注入 openai 客户端，其余供应商注入 litellm 的 HTTPHandler，
+    两者底层共用同一个连接池
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.Client] = {}
+        self._sdk_clients: Dict[Tuple, Any] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self.http2 = Config.HTTP2_ENABLED and HTTP2_AVAILABLE
+        if Config.HTTP2_ENABLED and not HTTP2_AVAILABLE:
+            logger.warning("h2 未安装，上游连接将使用 HTTP/1.1")
+
+    def _event_hooks(self, key: str) -> Dict[str, list]:
+        """统计请求总数和上游 5xx 错误数"""
+        stats = self._stats.setdefault(key, {'requests': 0, 'server_errors': 0})
+
+        def on_request(request):
+            with self._lock:
+                stats['requests'] += 1
+
+        def on_response(response):
+            if response.status_code >= 500:
+                with self._lock:
+                    stats['server_errors'] += 1
+
+        return {'request': [on_request], 'response': [on_response]}
+
+    def get_client(self, url: str) -> httpx.Client:
+        """获取上游地址对应的共享连接池"""
+        key = pool_key(url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+        # HTTP/2 需要 TLS ALPN 协商，明文地址（如本地 Ollama）只使用 HTTP/1.1
+        http2 = self.http2 and key.startswith('https://')
+        client = httpx.Client(
+            http2=http2,
+            timeout=httpx.Timeout(Config.HTTP_READ_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=Config.HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=Config.HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+            ),
+            event_hooks=self._event_hooks(key)
+        )
+        with self._lock:
+            # 并发创建时保留先创建的连接池
+            existing = self._clients.setdefault(key, client)
+        if existing is not client:
+            client.close()
+        else:
+            logger.info(f"创建上游连接池: {key} (HTTP/2: {http2})")
+        return existing
+
+    def get_http_handler(self, url: str):
+        """获取包装了共享连接池的 litellm HTTPHandler"""
+        if not LITELLM_CLIENTS_AVAILABLE:
+            return None
+        return self._get_sdk_client(('handler', pool_key(url)), lambda: HTTPHandler(client=self.get_client(url)))
+
+    def _get_sdk_client(self, cache_key: Tuple, factory):
+        with self._lock:
+            sdk_client = self._sdk_clients.get(cache_key)
+        if sdk_client is None:
+            sdk_client = factory()
+            with self._lock:
+                sdk_client = self._sdk_clients.setdefault(cache_key, sdk_client)
+        return sdk_client
+
+    def get_litellm_client(self, model_config: ModelConfig, api_key: Optional[str] = None):
+        """
+        获取注入 litellm.completion 的 client 参数
+        不支持注入的供应商返回 None，由 litellm 自行管理连接
+
+        Args:
+            model_config: 模型配置
+            api_key: 调用使用的 API 密钥，openai 客户端与密钥绑定
+        """
+        if not Config.HTTP_POOL_ENABLED or not LITELLM_CLIENTS_AVAILABLE:
+            return None
+
+        base_url = model_config.base_url or DEFAULT_BASE_URLS.get(model_config.provider)
+        if model_config.provider == 'azure':
+            if not base_url:
+                return None
+            api_version = os.getenv('AZURE_API_VERSION', '2024-02-15-preview')
+            return self._get_sdk_client(
+                ('azure', base_url, api_key, api_version),
+                lambda: openai.AzureOpenAI(api_key=api_key, azure_endpoint=base_url, api_version=api_version,
+                                           http_client=self.get_client(base_url))
+            )
+        if model_config.provider == 'openai':
+            return self._get_sdk_client(
+                ('openai', base_url, api_key),
+                lambda: openai.OpenAI(api_key=api_key, base_url=base_url, http_client=self.get_client(base_url))
+            )
+        if base_url and model_config.provider in ('anthropic', 'huggingface', 'ollama'):
+            return self.get_http_handler(base_url)
+        return None
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """各连接池的连接数、空闲连接数、HTTP/2 连接数和请求统计"""
+        with self._lock:
+            clients = dict(self._clients)
+            stats = {key: dict(value) for key, value in self._stats.items()}
+
+        metrics = {}
+        for key, client in clients.items():
+            # httpcore 没有公开连接池对象，取不到时只报告请求统计
+            pool = getattr(getattr(client, '_transport', None), '_pool', None)
+            connections = list(getattr(pool, 'connections', []))
+            requests = list(getattr(pool, '_requests', []))
+            active = sum(1 for connection in connections if not connection.is_idle())
+            metrics[key] = {
+                'connections': len(connections),
+                'active': active,
+                'idle': len(connections) - active,
+                'http2': sum(1 for connection in connections if 'HTTP/2' in connection.info()),
+                # 进行中的请求（含未读完的流式响应）和等待空闲连接的请求
+                'in_flight': len(requests),
+                'queued': sum(1 for request in requests if getattr(request, 'connection', None) is None),
+                'max_connections': Config.HTTP_POOL_MAX_CONNECTIONS,
+                'utilisation': round(active / Config.HTTP_POOL_MAX_CONNECTIONS, 3),
+                **stats.get(key, {}),
+            }
+        return metrics
+
+    def reset_after_fork(self):
+        """
+        在 fork 出的 worker 进程中调用
+        丢弃从主进程继承的连接池而不关闭（底层 socket 仍属于主进程），之后按需重新建立连接
+        """
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._sdk_clients = {}
+        self._stats = {}
+
+    def close(self):
+        """关闭所有连接池"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._sdk_clients.clear()
+        for client in clients:
+            client.close()
+
+
+# 全局实例
+connection_pools = ConnectionPoolManager()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片处理模块
+在服务端按模型可用分辨率缩放并重新编码上传的图片，已在目标尺寸之内的图片原样发送，结果按内容哈希缓存
+"""
+
+import io
+import base64
+import hashlib
+from typing import BinaryIO, Optional
+from config import Config
+from logger import logger
+from utils import LRUCache
+
+# 缩放依赖 Pillow，未安装时图片按原样发送
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logger.warning("Pillow 未安装，上传的图片将不做缩放")
+
+
+ALLOWED_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+# 按文件头识别图片类型，不信任客户端声明的类型
+_MAGIC_NUMBERS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+
+# EXIF 中的方向标签，值为 1 时不需要旋转
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageTooLargeError(ValueError):
+    """图片超过大小限制"""
+
+
+def detect_mime_type(header: bytes) -> Optional[str]:
+    """根据文件头识别图片 MIME 类型"""
+    for magic, mime_type in _MAGIC_NUMBERS:
+        if header.startswith(magic):
+            return mime_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class ImageProcessor:
+    """
+    图片处理器
+    流式计算上传内容的哈希，命中缓存时不再解码；未命中时缩放到模型的有效分辨率并重新编码为 data URL
+    """
+
+    def __init__(self, max_bytes: int = None, max_pixels: int = None, cache_size: int = None):
+        self.max_bytes = max_bytes or Config.MAX_IMAGE_BYTES
+        self.max_pixels = max_pixels or Config.MAX_IMAGE_PIXELS
+        self._cache = LRUCache(cache_size or Config.IMAGE_CACHE_SIZE)
+
+    def _hash_stream(self, stream: BinaryIO) -> tuple[str, bytes]:
+        """
+        分块读取上传流并计算哈希，超过大小限制立即终止
+        返回 (内容哈希, 文件头)
+        """
+        digest = hashlib.sha256()
+        header = b''
+        received = 0
+        while True:
+            chunk = stream.read(64 * 1024)
+            if not chunk:
+                break
+            if not header:
+                header = chunk[:16]
+            received += len(chunk)
+            if received > self.max_bytes:
+                raise ImageTooLargeError(f"图片超过大小限制 {self.max_bytes // (1024 * 1024)}MB")
+            digest.update(chunk)
+        return digest.hexdigest(), header
+
+    def _encode(self, stream: BinaryIO, mime_type: str, max_side: int) -> str:
+        """缩放并重新编码图片，返回 data URL"""
+        if not PIL_AVAILABLE:
+            return f"data:{mime_type};base64,{base64.b64encode(stream.read()).decode('utf-8')}"
+
+        with Image.open(stream) as image:
+            if image.width * image.height > self.max_pixels:
+                raise ImageTooLargeError(f"图片像素数超过限制: {image.width}x{image.height}")
+
+            # 已在目标尺寸之内且不需要按 EXIF 旋转的图片原样发送，省去解码和重新编码（打开图片只读取文件头）
+            if max(image.size) <= max_side and image.getexif().get(EXIF_ORIENTATION, 1) == 1:
+                stream.seek(0)
+                return f"data:{mime_type};base64,{base64.b64encode(stream.read()).decode('utf-8')}"
+
+            # JPEG 可以在解码阶段直接按比例缩小，省去大部分解码开销
+            if image.format == 'JPEG':
+                image.draft('RGB', (max_side, max_side))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            output = io.BytesIO()
+            has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+            if has_alpha:
+                image.save(output, format='PNG', optimize=True)
+                mime_type = 'image/png'
+            else:
+                image.convert('RGB').save(output, format='JPEG', quality=Config.IMAGE_JPEG_QUALITY, optimize=True)
+                mime_type = 'image/jpeg'
+
+        return f"data:{mime_type};base64,{base64.b64encode(output.getvalue()).decode('utf-8')}"
+
+    def process(self, stream: BinaryIO, max_side: int) -> str:
+        """
+        处理一张上传的图片
+
+        Args:
+            stream: 可 seek 的图片数据流（上传文件或 BytesIO）
+            max_side: 目标模型的最长边像素数
+
+        Returns:
+            str: 缩放后图片的 data URL
+        """
+        content_hash, header = self._hash_stream(stream)
+        mime_type = detect_mime_type(header)
+        if mime_type not in ALLOWED_MIME_TYPES:
+            raise ValueError("不支持的图片格式，仅支持 JPEG、PNG、GIF 和 WebP")
+
+        cache_key = (content_hash, max_side)
+        data_url = self._cache.get(cache_key)
+        if data_url:
+            logger.debug(f"图片缓存命中: {content_hash[:12]}")
+            return data_url
+
+        stream.seek(0)
+        data_url = self._encode(stream, mime_type, max_side)
+        self._cache.set(cache_key, data_url)
+        return data_url
+
+    def process_data_url(self, data_url: str, max_side: int) -> str:
+        """处理 JSON 请求中以 data URL 形式提交的图片"""
+        if not data_url.startswith('data:') or ',' not in data_url:
+            raise ValueError("图片必须是 base64 编码的 data URL")
+        start = data_url.index(',') + 1
+        # base64 解码后约为原长度的 3/4，先按长度拒绝超大图片，不复制也不解码图片内容
+        if (len(data_url) - start) * 3 // 4 > self.max_bytes:
+            raise ImageTooLargeError(f"图片超过大小限制 {self.max_bytes // (1024 * 1024)}MB")
+        return self.process(io.BytesIO(base64.b64decode(data_url[start:])), max_side)
+
+
+# 全局实例
+image_processor = ImageProcessor()
@@ -8,7 +8,7 @@
 import logging
 import os
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
 
 
 class Logger:
@@ -22,21 +22,25 @@ class Logger:
         if not self.logger.handlers:
             self._setup_handlers()
     
-    def _setup_handlers(self):
+    def _setup_handlers(self, multiprocess: bool = False):
         """设置日志处理器"""
         # 创建日志目录
         log_dir = "logs"
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
         
-        # 文件处理器 - 轮转日志
         log_file = os.path.join(log_dir, "app.log")
-        file_handler = RotatingFileHandler(
-            log_file, 
-            maxBytes=10*1024*1024,  # 10MB
-            backupCount=5,
-            encoding='utf-8'
-        )
+        if multiprocess:
+            # 多个 worker 同时轮转同一个文件会互相覆盖，改为追加写入，由 logrotate 等外部工具轮转
+            file_handler = WatchedFileHandler(log_file, encoding='utf-8')
+        else:
+            # 文件处理器 - 轮转日志
+            file_handler = RotatingFileHandler(
+                log_file, 
+                maxBytes=10*1024*1024,  # 10MB
+                backupCount=5,
+                encoding='utf-8'
+            )
         file_handler.setLevel(logging.INFO)
         
         # 控制台处理器
@@ -56,6 +60,12 @@ class Logger:
         self.logger.addHandler(file_handler)
         self.logger.addHandler(console_handler)
     
+    def reset_after_fork(self):
+        """在 fork 出的 worker 进程中重建处理器，不与主进程共用文件句柄和处理器锁"""
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        self._setup_handlers(multiprocess=True)
+    
     def info(self, message: str, **kwargs):
         """记录信息日志"""
         self.logger.info(message, **kwargs)
@@ -6,10 +6,302 @@ LLM 统一调用工具类
 """
 
 import os
+import json
+import queue
+import threading
 import litellm
-from typing import List, Dict, Any, Optional
-from config import Config
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Callable, Iterator, Union, Tuple
+from config import Config, ModelConfig
 from logger import logger
+from deadline import Deadline, DeadlineExceeded
+from ollama_manager import ollama_manager
+from http_pool import connection_pools
+from shared_cache import shared_cache, make_key
+from timing import RequestTimer, timed
+from token_counter import token_counter
+
+# 支持以助手消息作为回答前缀直接续写的供应商
+PREFILL_PROVIDERS = ('anthropic', 'ollama')
+
+# 需要在消息中显式标记缓存断点的供应商；OpenAI、通义千问等 OpenAI 兼容接口和 Ollama 自动缓存相同的提示词前缀
+CACHE_CONTROL_PROVIDERS = ('anthropic',)
+
+CONTINUE_PROMPT = "你上一条回答因故中断。请从中断处直接继续，不要重复已经输出的内容，也不要添加任何说明。"
+
+
+@dataclass
+class ModelSwitch:
+    """流式回退时的模型切换事件"""
+    from_model: ModelConfig
+    to_model: ModelConfig
+    error: str
+    partial_text: str  # 切换前该模型已生成的内容
+
+
+@dataclass
+class ToolRound:
+    """工具调用事件：模型在本轮回答中请求调用工具，在工具执行之前产出"""
+    model: ModelConfig
+    calls: List[Dict[str, Any]]  # [{'id', 'name', 'arguments'}]，arguments 为模型给出的 JSON 字符串
+    partial_text: str  # 本轮调用工具之前模型输出的文本
+    messages: List[Dict]  # 本轮请求的消息，用于估算用量
+
+
+@dataclass
+class ToolResult:
+    """工具执行完成事件"""
+    name: str
+    arguments: Dict[str, Any]
+    summary: Dict[str, Any]  # 发给前端展示的摘要
+
+
+def merge_tool_call_deltas(calls: List[Dict[str, Any]], chunk):
+    """
+    合并流式分块中的工具调用片段
+    同一个调用的 id 和函数名只出现在第一个片段中，参数 JSON 分散在多个片段中，按 index 归并
+    """
+    if not chunk.choices:
+        return
+    for delta in getattr(chunk.choices[0].delta, 'tool_calls', None) or []:
+        index = getattr(delta, 'index', None)
+        if index is None:
+            index = len(calls)
+        while len(calls) <= index:
+            calls.append({'id': None, 'name': '', 'arguments': ''})
+        call = calls[index]
+        call['id'] = call['id'] or getattr(delta, 'id', None)
+        function = getattr(delta, 'function', None)
+        if function is not None:
+            call['name'] = call['name'] or getattr(function, 'name', None) or ''
+            call['arguments'] += getattr(function, 'arguments', None) or ''
+
+
+def chunk_text(chunk) -> str:
+    """取出流式分块中的文本内容"""
+    if chunk.choices and len(chunk.choices) > 0:
+        return getattr(chunk.choices[0].delta, 'content', None) or ''
+    return ''
+
+
+class FallbackStream:
+    """
+    带模型回退的流式响应
+    首个 token 之前失败时在备用模型上重试；生成中途失败时把已生成的内容作为助手前缀交给备用模型续写，
+    迭代时在两段输出之间产出一个 ModelSwitch 事件
+    """
+
+    def __init__(self, llm: 'MyLLM', chain: List[ModelConfig], messages: List[Dict],
+                 deadline: Deadline = None, should_stop: Callable[[], bool] = None, **kwargs):
+        self.llm = llm
+        self.chain = chain
+        self.messages = messages
+        self.deadline = deadline
+        self.should_stop = should_stop or (lambda: False)
+        self.kwargs = kwargs
+        self.model_config = chain[0]
+        self._response = None
+        self._closed = False
+
+    def __iter__(self) -> Iterator[Union[Any, ModelSwitch]]:
+        generated = []
+        for index, model_config in enumerate(self.chain):
+            self.model_config = model_config
+            segment = []
+            messages = self.messages
+            if generated:
+                messages = self.llm.continuation_messages(self.messages, ''.join(generated), model_config)
+            try:
+                self._response = self.llm.completion(
+                    model_key=model_config.name, messages=messages, stream=True,
+                    deadline=self.deadline, **self.kwargs
+                )
+                if self._closed:
+                    self.llm.close_stream(self._response)
+                    return
+                for chunk in self._response:
+                    text = chunk_text(chunk)
+                    if text:
+                        segment.append(text)
+                        generated.append(text)
+                    yield chunk
+                return
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                stopped = self._closed or self.should_stop() or (self.deadline is not None and self.deadline.expired)
+                if stopped or index == len(self.chain) - 1:
+                    raise
+                next_model = self.chain[index + 1]
+                logger.warning(
+                    f"模型 {model_config.display_name} 调用失败（已生成 {len(''.join(segment))} 字），"
+                    f"切换到 {next_model.display_name}: {e}"
+                )
+                self.llm.close_stream(self._response)
+                yield ModelSwitch(model_config, next_model, str(e), ''.join(segment))
+
+    def close(self):
+        """关闭当前正在使用的上游流"""
+        self._closed = True
+        self.llm.close_stream(self._response)
+
+
+class ToolStream:
+    """
+    带工具调用的流式响应
+    每一轮是一次带回退的流式调用：模型直接回答时原样产出分块；模型请求调用工具时产出 ToolRound，
+    执行工具后把结果追加到消息中产出 ToolResult，再由同一个模型继续回答。最后一轮禁止调用工具，保证一定有回答
+    """
+
+    def __init__(self, llm: 'MyLLM', chain: List[ModelConfig], messages: List[Dict], tools: List[Dict],
+                 tool_handler: Callable[[str, Dict[str, Any]], Tuple[str, Dict[str, Any]]],
+                 tool_choice: Any = 'auto', max_rounds: int = None, deadline: Deadline = None,
+                 should_stop: Callable[[], bool] = None, **kwargs):
+        self.llm = llm
+        self.chain = chain
+        self.messages = list(messages)
+        self.tools = tools
+        self.tool_handler = tool_handler
+        self.tool_choice = tool_choice
+        self.max_rounds = max_rounds if max_rounds is not None else Config.MAX_TOOL_ROUNDS
+        self.deadline = deadline
+        self.should_stop = should_stop or (lambda: False)
+        self.kwargs = kwargs
+        self.model_config = chain[0]
+        self._stream: Optional[FallbackStream] = None
+        self._closed = False
+
+    def _stopped(self) -> bool:
+        return self._closed or self.should_stop() or (self.deadline is not None and self.deadline.expired)
+
+    def __iter__(self) -> Iterator[Union[Any, ModelSwitch, ToolRound, ToolResult]]:
+        chain = self.chain
+        for round_index in range(self.max_rounds + 1):
+            # 指定的工具只在第一轮强制调用，最后一轮不再允许调用工具
+            if round_index == self.max_rounds:
+                tool_choice = 'none'
+            elif round_index == 0:
+                tool_choice = self.tool_choice
+            else:
+                tool_choice = 'auto'
+            self._stream = FallbackStream(
+                self.llm, chain, self.messages, self.deadline, self.should_stop,
+                tools=self.tools, tool_choice=tool_choice, **self.kwargs
+            )
+            calls = []
+            text = []
+            for chunk in self._stream:
+                if isinstance(chunk, ModelSwitch):
+                    # 备用模型重新生成工具调用
+                    calls = []
+                    text = [chunk.partial_text] if chunk.partial_text else []
+                    yield chunk
+                    continue
+                merge_tool_call_deltas(calls, chunk)
+                text.append(chunk_text(chunk))
+                yield chunk
+            self.model_config = self._stream.model_config
+            calls = [call for call in calls if call['name']]
+            if not calls or self._stopped():
+                return
+
+            partial_text = ''.join(text)
+            round_messages = self.messages
+            for call in calls:
+                call['id'] = call['id'] or f"call_{round_index}_{calls.index(call)}"
+            self.messages = self.messages + [{
+                'role': 'assistant',
+                'content': partial_text or None,
+                'tool_calls': [{
+                    'id': call['id'], 'type': 'function',
+                    'function': {'name': call['name'], 'arguments': call['arguments'] or '{}'}
+                } for call in calls]
+            }]
+            yield ToolRound(self.model_config, calls, partial_text, round_messages)
+
+            for call in calls:
+                if self._stopped():
+                    return
+                try:
+                    arguments = json.loads(call['arguments'] or '{}')
+                    content, summary = self.tool_handler(call['name'], arguments)
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.warning(f"工具 {call['name']} 执行失败: {e}")
+                    arguments = {}
+                    content, summary = f"工具调用失败: {e}", {'error': str(e)}
+                self.messages = self.messages + [{'role': 'tool', 'tool_call_id': call['id'], 'content': content}]
+                yield ToolResult(call['name'], arguments, summary)
+
+            # 后续轮次从当前模型开始，不再回到已经失败的模型
+            chain = chain[chain.index(self.model_config):]
+
+    def close(self):
+        """关闭当前正在使用的上游流"""
+        self._closed = True
+        if self._stream is not None:
+            self._stream.close()
+
+
+class MultiStream:
+    """
+    多模型并发流式响应
+    每个模型在独立线程中流式调用，各模型的分块按到达顺序合并为一个迭代器，产出 (模型键名, 分块)；
+    模型正常结束时产出 (模型键名, None)，出错时产出 (模型键名, 异常)。对比模式下不做模型回退
+    """
+
+    def __init__(self, llm: 'MyLLM', model_keys: List[str], messages: List[Dict],
+                 deadline: Deadline = None, should_stop: Callable[[], bool] = None, **kwargs):
+        self.llm = llm
+        self.model_keys = list(model_keys)
+        self.messages = messages
+        self.deadline = deadline
+        self.should_stop = should_stop or (lambda: False)
+        self.kwargs = kwargs
+        self._events: queue.Queue = queue.Queue()
+        self._responses: Dict[str, Any] = {}
+        self._closed = False
+
+    def _run(self, model_key: str):
+        try:
+            response = self.llm.completion(
+                model_key=model_key, messages=self.messages, stream=True, deadline=self.deadline, **self.kwargs
+            )
+            self._responses[model_key] = response
+            if self._closed:
+                self.llm.close_stream(response)
+            else:
+                for chunk in response:
+                    if self._closed or self.should_stop():
+                        break
+                    self._events.put((model_key, chunk))
+            self._events.put((model_key, None))
+        except Exception as e:
+            self._events.put((model_key, e))
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        for model_key in self.model_keys:
+            threading.Thread(target=self._run, args=(model_key,), daemon=True,
+                             name=f'compare-{model_key}').start()
+        remaining = len(self.model_keys)
+        while remaining:
+            try:
+                timeout = self.deadline.remaining() if self.deadline is not None else None
+                model_key, item = self._events.get(timeout=timeout)
+            except queue.Empty:
+                # 到达截止时间，仍在生成的模型由调用方关闭
+                return
+            if item is None or isinstance(item, Exception):
+                remaining -= 1
+            yield model_key, item
+
+    def close(self):
+        """关闭所有模型的上游流"""
+        self._closed = True
+        for response in list(self._responses.values()):
+            self.llm.close_stream(response)
+
 
 class MyLLM:
     """
@@ -17,8 +309,9 @@ class MyLLM:
     负责模型配置管理和统一调用接口
     """
     
-    def __init__(self):
+    def __init__(self, cache=None):
         self.available_models = Config.get_enabled_models()
+        self.cache = cache or shared_cache
         self._setup_environment()
     
     def _setup_environment(self):
@@ -59,16 +352,71 @@ class MyLLM:
         
         return True, "", model_config
     
+    @staticmethod
+    def attach_images(messages: List[Dict], images: List[str]) -> List[Dict]:
+        """
+        将图片附加到最后一条用户消息，返回新的消息列表
+        
+        Args:
+            messages: 原始消息列表
+            images: 图片 data URL 列表
+        """
+        messages = list(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].get('role') == 'user':
+                text = messages[i].get('content', '')
+                content = [{'type': 'text', 'text': text}] if isinstance(text, str) else list(text)
+                content.extend({'type': 'image_url', 'image_url': {'url': url}} for url in images)
+                messages[i] = {**messages[i], 'content': content}
+                break
+        return messages
+    
+    @staticmethod
+    def mark_cache_breakpoints(messages: List[Dict]) -> List[Dict]:
+        """
+        为系统消息和最后一条用户消息之前的会话历史添加缓存断点，返回新的消息列表
+        断点之前的内容在多次请求间不变，供应商只需处理断点之后的搜索结果和新问题
+        """
+        messages = list(messages)
+        last_user = next((i for i in range(len(messages) - 1, -1, -1) if messages[i].get('role') == 'user'), None)
+        breakpoints = {i for i, message in enumerate(messages) if message.get('role') == 'system'}
+        if breakpoints:
+            breakpoints = {max(breakpoints)}
+        if last_user:
+            breakpoints.add(last_user - 1)
+        for i in breakpoints:
+            content = messages[i].get('content')
+            if not content or messages[i].get('role') == 'tool':
+                continue
+            blocks = [{'type': 'text', 'text': content}] if isinstance(content, str) else [dict(block) for block in content]
+            blocks[-1]['cache_control'] = {'type': 'ephemeral'}
+            messages[i] = {**messages[i], 'content': blocks}
+        return messages
+    
     def build_completion_params(self, model_config, messages: List[Dict], 
                               max_tokens: int = None, temperature: float = None, 
-                              stream: bool = False, **kwargs) -> Dict[str, Any]:
+                              stream: bool = False, images: List[str] = None,
+                              **kwargs) -> Dict[str, Any]:
         """
         构建 litellm.completion 参数
+        超过模型上下文长度时裁剪早期历史并限制 max_tokens，裁剪后仍放不下时抛出 ContextLengthError；
+        需要显式标记的供应商在系统消息和会话历史末尾添加缓存断点，其余供应商自动缓存相同前缀
         """
+        if images:
+            if not model_config.supports_vision:
+                raise ValueError(f"模型 {model_config.display_name} 不支持图片输入")
+            messages = self.attach_images(messages, images)
+        # 按模型的上下文长度在本地校验，放不下时裁剪早期历史，超出时不发出请求
+        fit = token_counter.fit(model_config, messages, max_tokens or Config.MAX_TOKENS,
+                                token_counter.count_tools(kwargs.get('tools'), model_config))
+        messages = fit.messages
+        if Config.PROMPT_CACHE_ENABLED and model_config.provider in CACHE_CONTROL_PROVIDERS:
+            messages = self.mark_cache_breakpoints(messages)
+        
         completion_params = {
             'model': model_config.model_name,
             'messages': messages,
-            'max_tokens': max_tokens or Config.MAX_TOKENS,
+            'max_tokens': fit.max_tokens,
             'temperature': temperature or Config.TEMPERATURE,
             'stream': stream
         }
@@ -82,6 +430,21 @@ class MyLLM:
         if model_config.custom_llm_provider:
             completion_params['custom_llm_provider'] = model_config.custom_llm_provider
         
+        # 流式调用时要求 OpenAI 兼容接口在最后一个分块返回用量
+        if stream and model_config.provider in ('openai', 'azure'):
+            completion_params['stream_options'] = {'include_usage': True}
+        
+        # Ollama 模型在调用后继续驻留内存
+        if model_config.provider == 'ollama':
+            completion_params['keep_alive'] = ollama_manager.keep_alive
+        
+        # 复用该上游地址的共享连接池
+        client = connection_pools.get_litellm_client(
+            model_config, completion_params.get('api_key') or os.getenv(model_config.api_key_env)
+        )
+        if client is not None:
+            completion_params['client'] = client
+        
         # 对于某些模型，设置较低的温度
         if 'azure' in model_config.model_name or 'qwen' in model_config.model_name:
             completion_params['temperature'] = 0.1
@@ -99,9 +462,12 @@ class MyLLM:
     
     def completion(self, model_key: str, messages: List[Dict], 
                   max_tokens: int = None, temperature: float = None, 
-                  stream: bool = False, **kwargs):
+                  stream: bool = False, images: List[str] = None,
+                  deadline: Deadline = None, timer: RequestTimer = None, **kwargs):
         """
         统一的模型调用接口
+        指定 deadline 时按剩余时间设置调用超时；指定 timer 时记录调用耗时，
+        流式调用只计到上游返回响应头为止（排队和建连），首 token 和生成耗时由调用方在迭代时记录
         """
         # 验证模型
         is_valid, error_msg, model_config = self.validate_model(model_key)
@@ -110,18 +476,143 @@ class MyLLM:
         
         # 构建参数
         completion_params = self.build_completion_params(
-            model_config, messages, max_tokens, temperature, stream, **kwargs
+            model_config, messages, max_tokens, temperature, stream, images, **kwargs
         )
+        if deadline is not None:
+            completion_params['timeout'] = deadline.timeout(completion_params.get('timeout'))
         
         # 调用模型
         try:
             logger.info(f"调用模型: {model_config.display_name}, 参数: {completion_params.keys()}")
-            response = litellm.completion(**completion_params)
+            with timed(timer, 'queue' if stream else 'llm', model_config.name):
+                response = litellm.completion(**completion_params)
             return response
+        except litellm.Timeout as e:
+            logger.error(f"模型调用超时 - {model_config.display_name}: {e}")
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded(f"模型 {model_config.display_name} 未在截止时间内完成") from e
+            raise
         except Exception as e:
             logger.error(f"模型调用失败 - {model_config.display_name}: {e}")
             raise
-    
+
+    def get_fallback_chain(self, model_key: str, needs_vision: bool = False,
+                           needs_tools: bool = False) -> List[ModelConfig]:
+        """
+        获取模型回退链：主模型在前，其后是可用的备用模型
+        需要图片输入或工具调用时跳过不支持的备用模型
+        """
+        is_valid, error_msg, model_config = self.validate_model(model_key)
+        if not is_valid:
+            raise ValueError(error_msg)
+        chain = [model_config]
+        if not Config.MODEL_FALLBACK_ENABLED:
+            return chain
+        for fallback_key in model_config.fallbacks:
+            is_valid, _, fallback = self.validate_model(fallback_key)
+            if not is_valid or not fallback.enabled or fallback in chain:
+                continue
+            if needs_vision and not fallback.supports_vision:
+                continue
+            if needs_tools and not fallback.supports_tools:
+                continue
+            chain.append(fallback)
+        return chain
+
+    @staticmethod
+    def continuation_messages(messages: List[Dict], partial_text: str, model_config: ModelConfig) -> List[Dict]:
+        """
+        构建续写请求的消息：已生成的内容作为助手前缀
+        不支持前缀续写的供应商额外附加一条续写指令
+        """
+        messages = messages + [{'role': 'assistant', 'content': partial_text.rstrip()}]
+        if model_config.provider not in PREFILL_PROVIDERS:
+            messages.append({'role': 'user', 'content': CONTINUE_PROMPT})
+        return messages
+
+    def completion_with_fallback(self, model_key: str, messages: List[Dict],
+                                 deadline: Deadline = None, **kwargs) -> tuple[Any, ModelConfig]:
+        """
+        非流式调用，失败时依次尝试备用模型
+
+        Returns:
+            tuple: (模型响应, 实际使用的模型配置)
+        """
+        chain = self.get_fallback_chain(model_key, bool(kwargs.get('images')))
+        for index, model_config in enumerate(chain):
+            try:
+                response = self.completion(model_config.name, messages, deadline=deadline, **kwargs)
+                return response, model_config
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if index == len(chain) - 1 or (deadline is not None and deadline.expired):
+                    raise
+                logger.warning(f"模型 {model_config.display_name} 调用失败，切换到 {chain[index + 1].display_name}: {e}")
+
+    def stream_with_fallback(self, model_key: str, messages: List[Dict], deadline: Deadline = None,
+                             should_stop: Callable[[], bool] = None, **kwargs) -> FallbackStream:
+        """
+        流式调用，失败时切换备用模型继续输出
+
+        Args:
+            model_key: 主模型键名
+            messages: 消息列表
+            deadline: 请求截止时间
+            should_stop: 返回 True 时不再回退（用户取消等）
+        """
+        kwargs.pop('stream', None)
+        chain = self.get_fallback_chain(model_key, bool(kwargs.get('images')))
+        return FallbackStream(self, chain, messages, deadline, should_stop, **kwargs)
+
+    def stream_with_tools(self, model_key: str, messages: List[Dict], tools: List[Dict],
+                          tool_handler: Callable[[str, Dict[str, Any]], Tuple[str, Dict[str, Any]]],
+                          tool_choice: Any = 'auto', deadline: Deadline = None,
+                          should_stop: Callable[[], bool] = None, **kwargs) -> ToolStream:
+        """
+        带工具调用的流式调用，失败时切换支持工具调用的备用模型
+
+        Args:
+            tools: OpenAI function calling 格式的工具列表
+            tool_handler: 执行工具的函数，参数为 (工具名, 参数字典)，返回 (交给模型的结果文本, 前端摘要)
+            tool_choice: 第一轮的工具选择策略，auto 或指定工具
+        """
+        kwargs.pop('stream', None)
+        chain = self.get_fallback_chain(model_key, bool(kwargs.get('images')), needs_tools=True)
+        return ToolStream(self, chain, messages, tools, tool_handler, tool_choice,
+                          deadline=deadline, should_stop=should_stop, **kwargs)
+
+    def stream_many(self, model_keys: List[str], messages: List[Dict], deadline: Deadline = None,
+                    should_stop: Callable[[], bool] = None, **kwargs) -> MultiStream:
+        """
+        同一组消息并发发给多个模型流式生成，用于模型对比
+
+        Args:
+            model_keys: 模型键名列表
+            messages: 消息列表
+            deadline: 请求截止时间
+            should_stop: 返回 True 时各模型停止读取（用户取消等）
+        """
+        kwargs.pop('stream', None)
+        return MultiStream(self, model_keys, messages, deadline, should_stop, **kwargs)
+
+    @staticmethod
+    def close_stream(response):
+        """
+        关闭流式响应，释放上游连接，供应商随之停止生成
+        litellm 的流包装器没有同步 close，直接关闭其内部的供应商流
+        """
+        if response is None:
+            return
+        stream = getattr(response, 'completion_stream', response)
+        close = getattr(stream, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except Exception as e:
+            logger.debug(f"关闭上游流失败: {e}")
+
     def get_default_model_key(self) -> str:
         """
         获取默认模型键名
@@ -155,27 +646,43 @@ class MyLLM:
         return self.get_default_model_key()
     
     def simple_completion(self, prompt: str, model_key: str = None, 
-                         max_tokens: int = 100, temperature: float = 0.3) -> str:
+                         max_tokens: int = 100, temperature: float = 0.3,
+                         deadline: Deadline = None, cache_ttl: float = None) -> str:
         """
         简单的文本补全接口
-        用于意图分析等简单任务
+        用于意图分析等简单任务，相同的请求在缓存有效期内直接返回共享缓存中的结果
+
+        Args:
+            cache_ttl: 结果缓存时间（秒），未指定时使用 LLM_CACHE_TTL，0 表示不缓存
         """
         if model_key is None:
             model_key = self.get_lightweight_model_key()
         
         messages = [{"role": "user", "content": prompt}]
         
+        cache_ttl = Config.LLM_CACHE_TTL if cache_ttl is None else cache_ttl
+        cache_key = make_key('completion', model_key, prompt, max_tokens, temperature)
+        if cache_ttl > 0:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"简单补全命中缓存: {model_key}")
+                return cached
+        
         try:
             response = self.completion(
                 model_key=model_key,
                 messages=messages,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                stream=False
+                stream=False,
+                deadline=deadline
             )
             
             if response.choices and len(response.choices) > 0:
-                return response.choices[0].message.content.strip()
+                content = response.choices[0].message.content.strip()
+                if cache_ttl > 0 and content:
+                    self.cache.set(cache_key, content, cache_ttl)
+                return content
             else:
                 raise ValueError("模型返回空响应")
                 
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ollama 本地模型管理模块
+启动时和定期预加载本地模型并设置 keep_alive，复用连接池，查询模型加载状态
+
+多进程部署时预加载只在主进程中运行，预加载结果写入共享缓存，任一 worker 的状态查询都能看到
+"""
+
+import time
+import threading
+from typing import Dict, List, Any, Optional, Union
+from config import Config, ModelConfig
+from logger import logger
+from http_pool import connection_pools, DEFAULT_BASE_URLS
+from shared_cache import shared_cache, make_key
+
+
+DEFAULT_BASE_URL = DEFAULT_BASE_URLS['ollama']
+# 预加载结果在共享缓存中的保留时间，预加载线程停止后状态查询仍能看到最后一次结果
+WARMUP_STATE_TTL = 24 * 3600
+
+
+def parse_keep_alive(value: str) -> Union[int, str]:
+    """
+    解析 keep_alive 配置
+    纯数字按秒处理（-1 表示常驻内存），其余按 Ollama 的时长字符串（如 30m）原样传递
+    """
+    value = (value or '').strip()
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return value or '5m'
+
+
+def ollama_model_name(model_config: ModelConfig) -> str:
+    """从 litellm 模型名（ollama_chat/qwq）中取出 Ollama 的模型名"""
+    return model_config.model_name.split('/', 1)[-1]
+
+
+class OllamaManager:
+    """
+    Ollama 模型管理器
+    预加载和状态查询与模型调用共用 connection_pools 中该 Ollama 服务地址的连接池
+    """
+
+    def __init__(self, keep_alive: str = None, warmup_interval: float = None, cache=None):
+        self.keep_alive = parse_keep_alive(keep_alive if keep_alive is not None else Config.OLLAMA_KEEP_ALIVE)
+        self.warmup_interval = warmup_interval if warmup_interval is not None else Config.OLLAMA_WARMUP_INTERVAL
+        self.cache = cache or shared_cache
+        self._warmups: Dict[str, Dict[str, Any]] = {}
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def local_models() -> List[ModelConfig]:
+        """已启用的 Ollama 模型"""
+        return [model for model in Config.get_enabled_models() if model.provider == 'ollama']
+
+    @staticmethod
+    def _url(model_config: ModelConfig, path: str) -> str:
+        return (model_config.base_url or DEFAULT_BASE_URL).rstrip('/') + path
+
+    def _record_warmup(self, model_config: ModelConfig, result: Dict[str, Any]):
+        """记录预加载结果，同时写入共享缓存供其他进程查询"""
+        self._warmups[model_config.name] = result
+        self.cache.set(make_key('ollama_warmup', model_config.name), result, WARMUP_STATE_TTL)
+
+    def _last_warmup(self, model_config: ModelConfig) -> Dict[str, Any]:
+        """最近一次预加载结果，优先读取共享缓存（预加载可能运行在其他进程中）"""
+        return self.cache.get(make_key('ollama_warmup', model_config.name)) or self._warmups.get(model_config.name, {})
+
+    def warm_up(self, model_config: ModelConfig) -> bool:
+        """
+        预加载模型
+        发送不带 prompt 的生成请求，Ollama 只加载模型并按 keep_alive 重置驻留时间
+
+        Returns:
+            bool: 是否加载成功
+        """
+        name = ollama_model_name(model_config)
+        started = time.time()
+        try:
+            url = self._url(model_config, '/api/generate')
+            response = connection_pools.get_client(url).post(
+                url, json={'model': name, 'keep_alive': self.keep_alive}, timeout=Config.OLLAMA_WARMUP_TIMEOUT
+            )
+            response.raise_for_status()
+            elapsed = time.time() - started
+            self._record_warmup(model_config, {'last_warmup': time.time(), 'warmup_seconds': round(elapsed, 2), 'error': None})
+            logger.info(f"Ollama 模型已预加载: {name} (耗时: {elapsed:.2f}s, keep_alive: {self.keep_alive})")
+            return True
+        except Exception as e:
+            self._record_warmup(model_config, {'last_warmup': time.time(), 'warmup_seconds': None, 'error': str(e)})
+            logger.warning(f"Ollama 模型预加载失败: {name}: {e}")
+            return False
+
+    def warm_up_all(self):
+        """预加载所有已启用的 Ollama 模型"""
+        for model_config in self.local_models():
+            self.warm_up(model_config)
+
+    def _loaded_models(self, base_url: str) -> Dict[str, Dict[str, Any]]:
+        """查询 Ollama 当前已加载到内存的模型"""
+        url = base_url.rstrip('/') + '/api/ps'
+        response = connection_pools.get_client(url).get(url, timeout=5)
+        response.raise_for_status()
+        loaded = {}
+        for item in response.json().get('models', []):
+            name = item.get('name') or item.get('model') or ''
+            loaded[name] = item
+            # qwq 与 qwq:latest 视为同一个模型
+            loaded.setdefault(name.split(':', 1)[0], item)
+        return loaded
+
+    def status(self) -> List[Dict[str, Any]]:
+        """各本地模型的加载状态"""
+        loaded_by_url: Dict[str, Any] = {}
+        statuses = []
+        for model_config in self.local_models():
+            base_url = model_config.base_url or DEFAULT_BASE_URL
+            if base_url not in loaded_by_url:
+                try:
+                    loaded_by_url[base_url] = self._loaded_models(base_url)
+                except Exception as e:
+                    loaded_by_url[base_url] = e
+
+            loaded = loaded_by_url[base_url]
+            name = ollama_model_name(model_config)
+            status = {'model': model_config.name, 'ollama_model': name, 'base_url': base_url,
+                      **self._last_warmup(model_config)}
+            if isinstance(loaded, Exception):
+                status.update({'reachable': False, 'loaded': False, 'error': str(loaded)})
+            else:
+                item = loaded.get(name)
+                status.update({
+                    'reachable': True,
+                    'loaded': item is not None,
+                    'expires_at': item.get('expires_at') if item else None,
+                    'size_vram': item.get('size_vram') if item else None,
+                })
+            statuses.append(status)
+        return statuses
+
+    def start(self):
+        """启动后台预加载线程：启动时预加载一次，之后按间隔刷新驻留时间"""
+        if self._thread and self._thread.is_alive():
+            return
+        if not Config.OLLAMA_WARMUP or not self.local_models():
+            return
+
+        def run():
+            self.warm_up_all()
+            while self.warmup_interval > 0 and not self._stop_event.wait(self.warmup_interval):
+                self.warm_up_all()
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=run, name='ollama-warmup', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止预加载线程"""
+        self._stop_event.set()
+
+
+# 全局实例
+ollama_manager = OllamaManager()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+网页正文抓取模块
+并发抓取排名靠前的搜索结果页面，流式解析 HTML 并提取正文
+"""
+
+import time
+import codecs
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from typing import List, Dict, Any, Optional, Tuple
+import requests
+from config import Config
+from logger import logger
+from shared_cache import shared_cache, make_key
+from simhash import simhash
+
+
+# 不包含正文的标签，其中的文本全部丢弃
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'nav', 'header', 'footer', 'aside', 'form', 'iframe'}
+# 块级标签，结束时插入换行
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'section', 'article', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre'}
+# 空元素没有结束标签，不能计入跳过深度
+VOID_TAGS = {'br', 'img', 'hr', 'input', 'meta', 'link', 'source', 'wbr', 'area', 'base', 'col', 'embed', 'param', 'track'}
+
+
+class TextExtractor(HTMLParser):
+    """
+    增量式 HTML 正文提取器
+    可以分块 feed，提取到足够的文本后即可停止
+    """
+
+    def __init__(self, max_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self._parts = []
+        self._length = 0
+        self._skip_depth = 0
+
+    @property
+    def is_full(self) -> bool:
+        return self._length >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS and tag not in VOID_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS and not self._skip_depth:
+            self._parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag in BLOCK_TAGS and not self._skip_depth:
+            self._parts.append('\n')
+
+    def handle_data(self, data):
+        if self._skip_depth or self.is_full:
+            return
+        text = ' '.join(data.split())
+        if text:
+            self._parts.append(text)
+            self._length += len(text)
+
+    def get_text(self) -> str:
+        lines = (line.strip() for line in ''.join(self._parts).split('\n'))
+        text = '\n'.join(line for line in lines if len(line) > 1)
+        return text[:self.max_chars]
+
+
+class PageFetcher:
+    """
+    网页正文抓取器
+    每个页面有字节数和时间上限，正文及其 SimHash 指纹按内容哈希存入共享缓存，镜像页面只提取一次，
+    任一 worker 抓取过的页面其他 worker 都能命中
+    """
+
+    def __init__(self, max_workers: int = None, max_bytes: int = None,
+                 page_timeout: float = None, max_chars: int = None, cache=None, cache_ttl: float = None):
+        self.max_workers = max_workers or Config.PAGE_FETCH_WORKERS
+        self.max_bytes = max_bytes or Config.PAGE_FETCH_MAX_BYTES
+        self.page_timeout = page_timeout or Config.PAGE_FETCH_TIMEOUT
+        self.max_chars = max_chars or Config.PAGE_MAX_CHARS
+        self._create_workers()
+        self.cache = cache or shared_cache
+        self.cache_ttl = Config.PAGE_CACHE_TTL if cache_ttl is None else cache_ttl
+
+    def _create_workers(self):
+        """创建下载会话和抓取线程池"""
+        self._session = requests.Session()
+        self._session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='page-fetch')
+
+    def reset_after_fork(self):
+        """在 fork 出的 worker 进程中调用，线程池的线程和会话的连接不会随 fork 复制，需要重新创建"""
+        self._create_workers()
+
+    def _download_and_extract(self, url: str) -> Tuple[str, str]:
+        """
+        流式下载页面并边下载边解析
+        返回 (内容哈希, 正文)
+        """
+        started = time.monotonic()
+        extractor = TextExtractor(self.max_chars)
+        digest = hashlib.sha256()
+        received = 0
+
+        with self._session.get(url, stream=True, timeout=(3, self.page_timeout)) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if 'html' not in content_type and 'text' not in content_type:
+                raise ValueError(f"不支持的内容类型: {content_type}")
+
+            # 没有声明字符集时 requests 默认 ISO-8859-1，中文页面按 UTF-8 解码更可靠
+            encoding = response.encoding if 'charset' in content_type.lower() else 'utf-8'
+            decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+            for chunk in response.iter_content(chunk_size=16 * 1024):
+                received += len(chunk)
+                digest.update(chunk)
+                extractor.feed(decoder.decode(chunk))
+                if received >= self.max_bytes or extractor.is_full:
+                    break
+                if time.monotonic() - started > self.page_timeout:
+                    logger.debug(f"页面抓取超时，使用已下载部分: {url}")
+                    break
+
+        extractor.close()
+        return digest.hexdigest(), extractor.get_text()
+
+    def fetch_text(self, url: str) -> Tuple[Optional[str], str, Optional[int]]:
+        """
+        抓取单个页面的正文
+        返回 (内容哈希, 正文, 正文指纹)，失败时正文为空字符串
+        """
+        caching = self.cache_ttl > 0
+        url_key = make_key('page_url', url, self.max_chars)
+        content_hash = self.cache.get(url_key) if caching else None
+        if content_hash:
+            cached = self.cache.get(make_key('page_text', content_hash, self.max_chars))
+            if cached is not None:
+                return (content_hash, *cached)
+
+        try:
+            content_hash, text = self._download_and_extract(url)
+        except Exception as e:
+            logger.warning(f"抓取页面失败 {url}: {e}")
+            return None, '', None
+
+        if not caching:
+            return content_hash, text, simhash(text)
+        text_key = make_key('page_text', content_hash, self.max_chars)
+        cached = self.cache.get(text_key)
+        if cached is None:
+            cached = [text, simhash(text)]
+            self.cache.set(text_key, cached, self.cache_ttl)
+        self.cache.set(url_key, content_hash, self.cache_ttl)
+        return (content_hash, *cached)
+
+    def enrich_results(self, search_results: List[Dict[str, Any]], top_k: int = None,
+                       timeout: float = None) -> List[Dict[str, Any]]:
+        """
+        并发抓取前 top_k 条结果的正文，写入结果的 content 字段
+        超过总时间上限仍未完成的页面保持只有摘要
+
+        Args:
+            search_results: 已排序的搜索结果
+            top_k: 抓取正文的结果数量
+            timeout: 整个抓取阶段的时间上限（秒）
+
+        Returns:
+            List[Dict[str, Any]]: 原结果列表（就地补充正文）
+        """
+        top_k = Config.SEARCH_FETCH_TOP_K if top_k is None else top_k
+        timeout = timeout or self.page_timeout + 1
+        targets = [result for result in search_results[:top_k] if result.get('url') and not result.get('content')]
+        if not targets:
+            return search_results
+
+        futures = {self._executor.submit(self.fetch_text, result['url']): result for result in targets}
+        done, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+
+        fetched = 0
+        for future in done:
+            content_hash, text, fingerprint = future.result()
+            if text:
+                result = futures[future]
+                result['content'] = text
+                result['content_hash'] = content_hash
+                result['content_simhash'] = fingerprint
+                fetched += 1
+
+        logger.info(f"抓取页面正文: 成功 {fetched}/{len(targets)}，超时 {len(not_done)}")
+        return search_results
+
+
+# 全局实例
+page_fetcher = PageFetcher()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+在线性能分析模块
+无需重启服务即可对接下来的 N 个请求或一段时间内的请求启用 cProfile、对比 tracemalloc 内存快照、导出所有线程的调用栈
+未启用时只在 WSGI 入口检查一个布尔标记，tracemalloc 也处于关闭状态
+"""
+
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import tempfile
+import threading
+import traceback
+import tracemalloc
+from typing import Any, Dict, Optional
+from logger import logger
+
+
+# 内存快照对比时忽略分析工具自身的分配
+_MEMORY_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+]
+
+
+class _ProfiledBody:
+    """
+    包装 WSGI 响应体
+    流式响应的生成器在视图函数返回之后才被迭代，每次取下一个分块时同样开启分析
+    """
+
+    def __init__(self, body, profile: cProfile.Profile, on_close):
+        self.body = body
+        self.profile = profile
+        self.on_close = on_close
+
+    def __iter__(self):
+        iterator = iter(self.body)
+        while True:
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Python 3.12 起同一时刻只能有一个分析器处于开启状态
+                pass
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.profile.disable()
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.on_close(self.profile)
+
+
+class Profiler:
+    """
+    性能分析器
+    分析结果只包含当前进程处理的请求，多进程部署时状态和报告中带有进程号
+    """
+
+    def __init__(self):
+        # 唯一在每个请求上检查的标记
+        self.armed = False
+        self._lock = threading.Lock()
+        self._remaining: Optional[int] = None
+        self._until: Optional[float] = None
+        self._stats: Optional[pstats.Stats] = None
+        self._profiled = 0
+        self._in_flight = 0
+        self._started_at: Optional[float] = None
+        self._memory_baseline: Optional[tracemalloc.Snapshot] = None
+
+    # ---------- CPU ----------
+
+    def start_cpu(self, requests: int = None, seconds: float = None) -> Dict[str, Any]:
+        """
+        对接下来的 requests 个请求或 seconds 秒内开始的请求启用 cProfile，两者都指定时先到者为准
+        重新开始会清空上一次的结果
+        """
+        if not requests and not seconds:
+            requests = 10
+        with self._lock:
+            self._remaining = int(requests) if requests else None
+            self._until = time.time() + float(seconds) if seconds else None
+            self._stats = None
+            self._profiled = 0
+            self._started_at = time.time()
+            self.armed = True
+        logger.info(f"已启用 CPU 分析: 请求数 {requests or '不限'}, 时长 {seconds or '不限'}s")
+        return self.cpu_status()
+
+    def stop_cpu(self) -> Dict[str, Any]:
+        """停止接受新的分析请求，已经在分析中的请求完成后仍会计入结果"""
+        with self._lock:
+            self.armed = False
+        return self.cpu_status()
+
+    def _claim(self) -> bool:
+        """为当前请求占用一个分析名额"""
+        with self._lock:
+            if not self.armed:
+                return False
+            if self._until is not None and time.time() > self._until:
+                self.armed = False
+                return False
+            if self._remaining is not None:
+                self._remaining -= 1
+                if self._remaining <= 0:
+                    self.armed = False
+            self._in_flight += 1
+            return True
+
+    def _collect(self, profile: cProfile.Profile):
+        """合并一个请求的分析结果"""
+        with self._lock:
+            self._in_flight -= 1
+            try:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self._profiled += 1
+            except TypeError:
+                # 请求期间没有采集到任何调用
+                pass
+
+    def profile_request(self, wsgi_app, environ, start_response):
+        """分析一个 WSGI 请求，包括流式响应体的迭代"""
+        if not self._claim():
+            return wsgi_app(environ, start_response)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 其他线程的分析器正在运行（Python 3.12+），跳过本次请求
+            with self._lock:
+                self._in_flight -= 1
+            return wsgi_app(environ, start_response)
+        try:
+            body = wsgi_app(environ, start_response)
+        except Exception:
+            profile.disable()
+            self._collect(profile)
+            raise
+        profile.disable()
+        return _ProfiledBody(body, profile, self._collect)
+
+    def cpu_status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'armed': self.armed,
+                'remaining_requests': self._remaining,
+                'until': self._until,
+                'started_at': self._started_at,
+                'profiled_requests': self._profiled,
+                'in_flight': self._in_flight,
+            }
+
+    def cpu_report(self, fmt: str = 'text', sort: str = 'cumulative', limit: int = 50) -> Optional[bytes]:
+        """
+        导出 CPU 分析结果
+
+        Args:
+            fmt: text 为文本报告，prof 为可用 snakeviz / pstats 打开的二进制文件
+            sort: 文本报告的排序字段（cumulative、tottime、calls 等）
+            limit: 文本报告的行数
+
+        Returns:
+            bytes: 报告内容，还没有分析结果时返回 None
+        """
+        with self._lock:
+            stats = self._stats
+            if stats is None:
+                return None
+            if fmt == 'prof':
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    path = os.path.join(tmp_dir, 'profile.prof')
+                    stats.dump_stats(path)
+                    with open(path, 'rb') as f:
+                        return f.read()
+            stream = io.StringIO()
+            stats.stream = stream
+            stream.write(f"进程 {os.getpid()}，分析请求数 {self._profiled}\n\n")
+            stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue().encode('utf-8')
+
+    # ---------- 内存 ----------
+
+    def start_memory(self, frames: int = 10) -> Dict[str, Any]:
+        """开始跟踪内存分配并记录基准快照"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._memory_baseline = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+        logger.info("已启用内存跟踪")
+        return self.memory_status()
+
+    def stop_memory(self) -> Dict[str, Any]:
+        """停止跟踪内存分配，释放跟踪数据"""
+        tracemalloc.stop()
+        self._memory_baseline = None
+        return self.memory_status()
+
+    def memory_status(self) -> Dict[str, Any]:
+        status = {'pid': os.getpid(), 'tracing': tracemalloc.is_tracing()}
+        if status['tracing']:
+            current, peak = tracemalloc.get_traced_memory()
+            status.update({'traced_bytes': current, 'peak_bytes': peak})
+        return status
+
+    def memory_diff(self, limit: int = 30, key_type: str = 'lineno') -> Optional[bytes]:
+        """
+        与基准快照对比，按增长量列出分配最多的位置
+
+        Args:
+            limit: 输出的条目数
+            key_type: 分组方式（lineno、filename 或 traceback）
+
+        Returns:
+            bytes: 文本报告，未开始跟踪时返回 None
+        """
+        if not tracemalloc.is_tracing() or self._memory_baseline is None:
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces(_MEMORY_FILTERS)
+        differences = snapshot.compare_to(self._memory_baseline, key_type)
+        lines = [f"进程 {os.getpid()}，与基准快照相比增长最多的 {limit} 个位置\n"]
+        for difference in differences[:limit]:
+            lines.append(str(difference))
+            if key_type == 'traceback':
+                lines.extend(f"    {line}" for line in difference.traceback.format())
+        return '\n'.join(lines).encode('utf-8')
+
+    # ---------- 线程 ----------
+
+    @staticmethod
+    def thread_stacks() -> bytes:
+        """导出所有线程当前的调用栈，用于排查卡住的流式请求"""
+        names = {thread.ident: thread for thread in threading.enumerate()}
+        lines = [f"进程 {os.getpid()}，共 {len(names)} 个线程\n"]
+        for ident, frame in sys._current_frames().items():
+            thread = names.get(ident)
+            name = thread.name if thread else '未知线程'
+            daemon = '，守护线程' if thread is not None and thread.daemon else ''
+            lines.append(f"线程 {name} ({ident}{daemon}):")
+            lines.extend(line.rstrip('\n') for line in traceback.format_stack(frame))
+            lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+
+class ProfilingMiddleware:
+    """
+    WSGI 中间件
+    未启用分析时直接调用应用，只多一次属性检查；管理接口自身的请求不参与分析
+    """
+
+    def __init__(self, wsgi_app, profiler: Profiler, exclude_prefix: str = '/admin/'):
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+        self.exclude_prefix = exclude_prefix
+
+    def __call__(self, environ, start_response):
+        if not self.profiler.armed or environ.get('PATH_INFO', '').startswith(self.exclude_prefix):
+            return self.wsgi_app(environ, start_response)
+        return self.profiler.profile_request(self.wsgi_app, environ, start_response)
+
+
+# 全局实例
+profiler = Profiler()
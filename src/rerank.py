@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+搜索结果重排序模块
+在本地用 BM25（可选叠加向量相似度）对多个关键词的合并结果按原始问题重新打分
+"""
+
+import re
+import math
+from collections import Counter
+from typing import List, Dict, Any, Optional
+from config import Config
+from logger import logger
+from deadline import Deadline
+from simhash import SimHashIndex, result_fingerprint
+
+# BM25 批量计算和向量相似度依赖 NumPy，未安装时逐词计算 BM25，且只使用 BM25
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+_WORD_PATTERN = re.compile(r'[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff]+')
+_CJK_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]')
+
+# 参与打分的正文长度上限，避免长网页稀释得分
+_CONTENT_CHARS = 2000
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词：英文和数字按单词切分，中文按字二元组切分
+    """
+    tokens = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def _bm25_python(query_terms: List[str], doc_terms: List[Counter], k1: float, b: float) -> List[float]:
+    """逐词计算 BM25 得分，未安装 NumPy 时使用"""
+    doc_count = len(doc_terms)
+    avg_length = sum(sum(terms.values()) for terms in doc_terms) / doc_count or 1.0
+    doc_freq = {term: sum(1 for terms in doc_terms if term in terms) for term in query_terms}
+
+    scores = []
+    for terms in doc_terms:
+        length = sum(terms.values())
+        score = 0.0
+        for term in query_terms:
+            freq = terms.get(term)
+            if not freq:
+                continue
+            idf = math.log(1 + (doc_count - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * length / avg_length))
+        scores.append(score)
+    return scores
+
+
+def _bm25_numpy(query_terms: List[str], doc_terms: List[Counter], k1: float, b: float) -> List[float]:
+    """把查询词在各文档中的词频组成矩阵，一次性计算所有文档的 BM25 得分"""
+    freqs = np.array([[terms.get(term, 0) for term in query_terms] for terms in doc_terms], dtype=np.float64)
+    lengths = np.array([sum(terms.values()) for terms in doc_terms], dtype=np.float64)
+    avg_length = lengths.mean() or 1.0
+    doc_freq = np.count_nonzero(freqs, axis=0)
+    idf = np.log(1 + (len(doc_terms) - doc_freq + 0.5) / (doc_freq + 0.5))
+    norms = k1 * (1 - b + b * lengths / avg_length)
+    return (freqs * (k1 + 1) / (freqs + norms[:, None]) @ idf).tolist()
+
+
+def bm25_scores(query: str, documents: List[str], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """
+    计算每个文档相对于查询的 BM25 得分
+    安装了 NumPy 时按矩阵批量计算，否则逐词计算
+
+    Args:
+        query: 查询文本
+        documents: 文档文本列表
+        k1: 词频饱和参数
+        b: 文档长度归一化参数
+
+    Returns:
+        List[float]: 与 documents 一一对应的得分
+    """
+    query_terms = list(dict.fromkeys(tokenize(query)))
+    doc_terms = [Counter(tokenize(document)) for document in documents]
+    if not query_terms or not doc_terms:
+        return [0.0] * len(documents)
+    if NUMPY_AVAILABLE:
+        return _bm25_numpy(query_terms, doc_terms, k1, b)
+    return _bm25_python(query_terms, doc_terms, k1, b)
+
+
+class SearchReranker:
+    """
+    搜索结果重排序器
+    先按 BM25 打分，配置了向量模型时再与余弦相似度加权融合
+    """
+
+    def __init__(self, embedding_model: str = None, embedding_weight: float = None):
+        self.embedding_model = embedding_model if embedding_model is not None else Config.RERANK_EMBEDDING_MODEL
+        self.embedding_weight = embedding_weight if embedding_weight is not None else Config.RERANK_EMBEDDING_WEIGHT
+        if self.embedding_model and not NUMPY_AVAILABLE:
+            logger.warning("NumPy 未安装，重排序将仅使用 BM25")
+            self.embedding_model = ''
+
+    @staticmethod
+    def _document_text(result: Dict[str, Any]) -> str:
+        content = (result.get('content') or '')[:_CONTENT_CHARS]
+        return f"{result.get('title', '')} {result.get('snippet', '')} {content}"
+
+    def _embedding_scores(self, query: str, documents: List[str], timeout: float = None) -> Optional[List[float]]:
+        """计算查询与各文档的余弦相似度，失败或超时时返回 None"""
+        try:
+            import litellm
+            response = litellm.embedding(model=self.embedding_model, input=[query] + documents, timeout=timeout)
+            vectors = np.array([item['embedding'] for item in response.data], dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+            return (vectors[1:] @ vectors[0]).tolist()
+        except Exception as e:
+            logger.warning(f"向量相似度计算失败，仅使用 BM25: {e}")
+            return None
+
+    def score(self, query: str, search_results: List[Dict[str, Any]], deadline: Deadline = None) -> List[float]:
+        """计算每条结果的相关性得分（0~1），没有剩余时间时跳过向量相似度"""
+        documents = [self._document_text(result) for result in search_results]
+        scores = bm25_scores(query, documents)
+        max_score = max(scores, default=0.0)
+        if max_score > 0:
+            scores = [score / max_score for score in scores]
+
+        if self.embedding_model and not (deadline and deadline.expired):
+            similarities = self._embedding_scores(query, documents, deadline.timeout() if deadline else None)
+            if similarities:
+                weight = self.embedding_weight
+                scores = [(1 - weight) * score + weight * similarity
+                          for score, similarity in zip(scores, similarities)]
+        return scores
+
+    def rerank(self, query: str, search_results: List[Dict[str, Any]], top_n: int = None,
+               deadline: Deadline = None) -> List[Dict[str, Any]]:
+        """
+        按与原始问题的相关性重新排序，只保留前 top_n 条
+        摘要近似重复（转载、镜像）的结果每组只保留得分最高的一条
+
+        Args:
+            query: 用户原始问题
+            search_results: 多个关键词的合并搜索结果
+            top_n: 保留的结果数量
+            deadline: 截止时间，用于限制向量相似度计算的耗时
+
+        Returns:
+            List[Dict[str, Any]]: 排序后的结果，每条结果写入 relevance_score
+        """
+        top_n = top_n or Config.SEARCH_TOP_K
+        if not search_results:
+            return []
+
+        for result, score in zip(search_results, self.score(query, search_results, deadline)):
+            result['relevance_score'] = round(score, 4)
+
+        ranked = sorted(search_results, key=lambda result: result['relevance_score'], reverse=True)
+        index = SimHashIndex()
+        selected = []
+        duplicates = 0
+        for position, result in enumerate(ranked):
+            if len(selected) >= top_n:
+                break
+            fingerprint = result_fingerprint(result)
+            if index.find(fingerprint) is not None:
+                duplicates += 1
+                continue
+            index.add(fingerprint, position)
+            selected.append(result)
+        logger.info(f"重排序: {len(search_results)} 条候选结果，去除近似重复 {duplicates} 条，保留 {len(selected)} 条")
+        return selected
+
+
+# 全局实例
+search_reranker = SearchReranker()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+联网需求分类模块
+在自动联网模式下判断用户问题是否需要联网检索：规则加朴素贝叶斯模型，全部在本地计算，不调用大模型
+"""
+
+import re
+import json
+import math
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import Config
+from logger import logger
+
+
+# 规则：(正则, 对数几率调整, 说明)，正值倾向联网，负值倾向不联网
+RULES: List[Tuple[re.Pattern, float, str]] = [(re.compile(pattern, re.IGNORECASE), weight, reason) for pattern, weight, reason in [
+    (r'最新|最近|目前|现在|当前|今天|今日|昨天|明天|本周|这周|本月|今年|刚刚|实时', 2.0, '时效性词语'),
+    (r'20[2-9]\d\s*年?', 1.2, '包含年份'),
+    (r'新闻|消息|动态|热搜|发布会|公告|财报|股价|汇率|油价|金价|价格多少|天气|比分|赛程|票房|排名', 2.5, '时效性主题'),
+    (r'搜索|搜一下|查一下|查查|上网|联网|网上|官网|链接|网址', 3.0, '明确要求检索'),
+    (r'\b(latest|today|current|news|price|weather|score|release[sd]?|stock|search|look up)\b', 2.0, '时效性词语'),
+    (r'https?://', 1.5, '包含网址'),
+    (r'翻译|译成|译为|translate', -3.5, '翻译任务'),
+    (r'润色|改写|重写|扩写|缩写|续写|校对|改错|纠正语法|proofread|rewrite|paraphrase', -3.0, '文本改写任务'),
+    (r'写一首|写一篇|写一段|作文|诗歌|小说|故事|文案|起名|取名', -2.0, '创作任务'),
+    (r'总结(一下)?(这|以下|下面)|概括(这|以下|下面)|summari[sz]e (this|the following)', -2.5, '对给定内容的处理'),
+    (r'```|def |class |function |import |#include|SELECT .* FROM', -2.5, '包含代码'),
+    (r'^[\s\d\.\+\-\*/\^\(\)=xX×÷]+$|计算|求解|解方程|证明|化简', -2.0, '计算或推导'),
+    (r'^(你好|您好|hi|hello|hey|谢谢|感谢|thanks?)[\s!！。.,，]*$', -4.0, '寒暄'),
+]]
+
+# 内置的少量标注样本：1 需要联网，0 不需要
+SEED_EXAMPLES: List[Tuple[str, int]] = [
+    ('今天北京天气怎么样', 1), ('最新的 iPhone 多少钱', 1), ('英伟达最新财报数据', 1),
+    ('2024年诺贝尔文学奖得主是谁', 1), ('现在美元兑人民币汇率是多少', 1), ('最近有什么科技新闻', 1),
+    ('昨晚湖人比赛比分', 1), ('OpenAI 最近发布了什么模型', 1), ('特斯拉股价今天涨了吗', 1),
+    ('这周上映的电影有哪些', 1), ('Python 3.13 有哪些新特性', 1), ('某某公司的官网地址', 1),
+    ('上海到杭州的高铁时刻表', 1), ('今年的高考分数线', 1), ('华为新手机发布会时间', 1),
+    ('当前比特币价格', 1), ('世界杯最新赛程', 1), ('帮我查一下这个产品的评价', 1),
+    ('附近好吃的餐厅推荐', 1), ('最新的 litellm 版本号', 1), ('现任美国总统是谁', 1),
+    ('今年春节是哪一天', 1), ('最近的地震消息', 1), ('新冠疫苗最新研究进展', 1),
+    ("what's the weather in London today", 1), ('latest news about AI regulation', 1),
+    ('current price of gold', 1), ('who won the game last night', 1), ('apple stock price', 1),
+    ('when is the next SpaceX launch', 1),
+    ('把这句话翻译成英文', 0), ('帮我润色一下这段文字', 0), ('写一首关于秋天的诗', 0),
+    ('解释一下什么是递归', 0), ('用 Python 实现快速排序', 0), ('这段代码为什么报错', 0),
+    ('1+1等于几', 0), ('帮我起一个公司名字', 0), ('总结一下下面这段话', 0),
+    ('什么是量子力学的基本原理', 0), ('如何提高写作能力', 0), ('给我讲一个笑话', 0),
+    ('你好', 0), ('谢谢你的帮助', 0), ('解这个方程 x^2 - 4 = 0', 0),
+    ('帮我写一封请假邮件', 0), ('二分查找的时间复杂度是多少', 0), ('把下面的 JSON 转成表格', 0),
+    ('光合作用的过程是什么', 0), ('如何学习一门新语言', 0), ('TCP 和 UDP 有什么区别', 0),
+    ('把这段文字改写得更正式', 0), ('勾股定理是什么', 0), ('写一个冒泡排序', 0),
+    ('translate this sentence into Chinese', 0), ('write a poem about the sea', 0),
+    ('explain how a hash map works', 0), ('fix the grammar in this paragraph', 0),
+    ('what is the derivative of x squared', 0), ('tell me a joke', 0),
+]
+
+
+def tokenize(text: str) -> List[str]:
+    """中文按单字和相邻两字切分，英文和数字按单词切分"""
+    tokens = []
+    for segment in re.findall(r'[一-鿿]+|[a-zA-Z]+|\d+', text.lower()):
+        if segment[0] >= '一':
+            tokens.extend(segment)
+            tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        elif segment.isdigit():
+            tokens.append('<num>' if len(segment) < 4 else '<year>')
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+class NaiveBayes:
+    """二分类多项式朴素贝叶斯，拉普拉斯平滑"""
+
+    def __init__(self):
+        self.counts: Dict[int, Dict[str, int]] = {0: {}, 1: {}}
+        self.totals = {0: 0, 1: 0}
+        self.docs = {0: 0, 1: 0}
+        self.vocabulary = set()
+
+    def fit(self, examples: Iterable[Tuple[str, int]]) -> 'NaiveBayes':
+        for text, label in examples:
+            label = 1 if label else 0
+            self.docs[label] += 1
+            for token in tokenize(text):
+                self.counts[label][token] = self.counts[label].get(token, 0) + 1
+                self.totals[label] += 1
+                self.vocabulary.add(token)
+        return self
+
+    def log_odds(self, text: str) -> float:
+        """需要联网相对于不需要联网的对数几率"""
+        vocabulary_size = len(self.vocabulary) or 1
+        score = math.log((self.docs[1] + 1) / (self.docs[0] + 1))
+        for token in tokenize(text):
+            # 训练中未出现过的词对两类的影响相同，直接跳过
+            if token not in self.vocabulary:
+                continue
+            positive = (self.counts[1].get(token, 0) + 1) / (self.totals[1] + vocabulary_size)
+            negative = (self.counts[0].get(token, 0) + 1) / (self.totals[0] + vocabulary_size)
+            score += math.log(positive / negative)
+        return score
+
+
+@dataclass
+class SearchDecision:
+    """联网判断结果"""
+    needs_web: bool
+    confidence: float  # 判断结果本身的置信度，0.5 ~ 1
+    probability: float  # 需要联网的概率
+    reason: str
+
+
+class SearchClassifier:
+    """
+    联网需求分类器
+    模型在首次使用时用内置样本（以及 SEARCH_CLASSIFIER_DATA 中的补充样本）训练，训练只需几毫秒
+    """
+
+    def __init__(self, threshold: float = None, data_path: str = None):
+        self.threshold = threshold if threshold is not None else Config.AUTO_SEARCH_THRESHOLD
+        self.data_path = data_path if data_path is not None else Config.SEARCH_CLASSIFIER_DATA
+        self._model: Optional[NaiveBayes] = None
+        self._lock = threading.Lock()
+
+    def _load_examples(self) -> List[Tuple[str, int]]:
+        """读取补充样本，JSONL 格式，每行 {"text": ..., "label": 0 或 1}"""
+        examples = list(SEED_EXAMPLES)
+        if not self.data_path:
+            return examples
+        try:
+            with open(self.data_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        examples.append((item['text'], int(item['label'])))
+        except Exception as e:
+            logger.warning(f"加载联网分类样本失败: {e}")
+        return examples
+
+    @property
+    def model(self) -> NaiveBayes:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    examples = self._load_examples()
+                    self._model = NaiveBayes().fit(examples)
+                    logger.info(f"联网需求分类器已训练: {len(examples)} 条样本")
+        return self._model
+
+    def classify(self, query: str) -> SearchDecision:
+        """判断问题是否需要联网"""
+        query = (query or '').strip()
+        model_score = self.model.log_odds(query)
+        rule_score = 0.0
+        matched = []
+        for pattern, weight, reason in RULES:
+            if pattern.search(query):
+                rule_score += weight
+                matched.append((weight, reason))
+
+        logit = max(-20.0, min(20.0, model_score + rule_score))
+        probability = 1 / (1 + math.exp(-logit))
+        needs_web = probability >= self.threshold
+        confidence = probability if needs_web else 1 - probability
+        # 说明取与判断方向一致、影响最大的规则
+        agreeing = [(abs(weight), reason) for weight, reason in matched if (weight > 0) == needs_web]
+        reason = max(agreeing)[1] if agreeing else '模型判断'
+        return SearchDecision(needs_web, round(confidence, 3), round(probability, 3), reason)
+
+
+# 全局实例
+search_classifier = SearchClassifier()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+搜索上下文构建模块
+按目标模型的 token 预算组装联网查询上下文，去除近似重复的摘要和正文并按句子截断
+token 数用目标模型的分词器计算，与请求发出前校验上下文长度时的计数一致
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+from config import Config, ModelConfig
+from token_counter import token_counter
+from simhash import SimHashIndex, result_fingerprint
+
+
+# 句子边界：中英文句末标点及换行
+_SENTENCE_PATTERN = re.compile(r'(?:[^。！？!?；;.\n]|\.(?!\s|$))*(?:[。！？!?；;.\n]|$)')
+# 句子内部可以断开的位置：空白及逗号、顿号、冒号
+_BREAK_PATTERN = re.compile(r'[\s,，、:：]')
+
+CONTEXT_HEADER = "以下是相关的网络搜索结果：\n\n"
+EMPTY_CONTEXT = "未找到相关的网络搜索结果。"
+
+
+@dataclass
+class SearchContext:
+    """构建好的搜索上下文"""
+    text: str
+    tokens: int
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    dropped: int = 0
+
+
+def split_sentences(text: str) -> List[str]:
+    """将文本切分为句子，保留句末标点"""
+    return [sentence for sentence in _SENTENCE_PATTERN.findall(text) if sentence.strip()]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model_config: Optional[ModelConfig] = None) -> str:
+    """
+    在句子边界处截断文本，使其不超过 max_tokens（按 model_config 的分词器计数，未指定时按字符估算）
+    第一句就超出预算时截断到预算内最后一个空白或逗号处，找不到合适的断点时才在字符中间截断
+    """
+    if token_counter.count_text(text, model_config) <= max_tokens:
+        return text
+
+    parts = []
+    used = 0
+    for sentence in split_sentences(text):
+        sentence_tokens = token_counter.count_text(sentence, model_config)
+        if used + sentence_tokens > max_tokens:
+            break
+        parts.append(sentence)
+        used += sentence_tokens
+
+    if parts:
+        return ''.join(parts).strip() + '…'
+
+    # 没有完整句子可用时，二分查找 token 数不超过预算的最长前缀（token 数随长度基本单调不减）
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if token_counter.count_text(text[:middle], model_config) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    truncated = text[:low]
+    # 断点太靠前时宁可在词中间截断，也不浪费大半预算
+    boundary = max((match.start() for match in _BREAK_PATTERN.finditer(truncated)), default=0)
+    if boundary > len(truncated) // 2:
+        truncated = truncated[:boundary]
+    return truncated.strip() + '…'
+
+
+class SearchContextBuilder:
+    """
+    搜索上下文构建器
+    按相关性排序、按 SimHash 指纹去除近似重复结果（每组保留最相关的一条），并在 token 预算内一次性拼接上下文
+    """
+
+    def __init__(self, default_budget: int = None, snippet_max_tokens: int = None,
+                 max_distance: int = None):
+        self.default_budget = default_budget or Config.SEARCH_CONTEXT_TOKENS
+        self.snippet_max_tokens = snippet_max_tokens or Config.SEARCH_SNIPPET_TOKENS
+        self.page_max_tokens = Config.SEARCH_PAGE_TOKENS
+        self.max_distance = max_distance
+
+    def get_budget(self, model_config: Optional[ModelConfig] = None) -> int:
+        """获取目标模型的上下文 token 预算"""
+        if model_config and model_config.search_context_tokens:
+            return model_config.search_context_tokens
+        return self.default_budget
+
+    @staticmethod
+    def _relevance(result: Dict[str, Any]) -> Optional[float]:
+        """本地重排序得分优先，其次是搜索引擎返回的得分"""
+        score = result.get('relevance_score')
+        return score if score is not None else result.get('rerank_score')
+
+    @classmethod
+    def sort_by_relevance(cls, search_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """按相关性分数降序排序，没有分数的结果保持原有顺序排在后面"""
+        return sorted(
+            search_results,
+            key=lambda result: (cls._relevance(result) is None, -(cls._relevance(result) or 0))
+        )
+
+    def build(self, search_results: List[Dict[str, Any]], model_config: Optional[ModelConfig] = None,
+              budget: int = None) -> SearchContext:
+        """
+        构建搜索上下文
+
+        Args:
+            search_results: 搜索结果列表
+            model_config: 目标模型配置，用于确定 token 预算和分词器
+            budget: 显式指定的 token 预算，优先于模型配置
+
+        Returns:
+            SearchContext: 上下文文本、使用的 token 数和实际采用的结果
+        """
+        def count(text: str) -> int:
+            return token_counter.count_text(text, model_config)
+
+        if not search_results:
+            return SearchContext(text=EMPTY_CONTEXT, tokens=count(EMPTY_CONTEXT))
+
+        budget = budget or self.get_budget(model_config)
+        parts = [CONTEXT_HEADER]
+        used = count(CONTEXT_HEADER)
+        included = []
+        index = SimHashIndex(self.max_distance)
+        dropped = 0
+
+        for result in self.sort_by_relevance(search_results):
+            # 抓取到正文时优先使用正文
+            content = (result.get('content') or '').strip()
+            snippet = content or (result.get('snippet') or '').strip()
+            label, max_tokens = ('正文', self.page_max_tokens) if content else ('摘要', self.snippet_max_tokens)
+            fingerprint = result_fingerprint(result)
+            if index.find(fingerprint) is not None:
+                dropped += 1
+                continue
+
+            head = f"【搜索结果 {len(included) + 1}】\n标题：{result.get('title', '')}\n"
+            tail = f"来源：{result.get('url', '')}\n\n"
+            overhead = count(head) + count(tail) + 3
+            remaining = budget - used - overhead
+            if remaining <= 0:
+                dropped += 1
+                continue
+
+            snippet = truncate_to_tokens(snippet, min(remaining, max_tokens), model_config)
+            block = f"{head}{label}：{snippet}\n{tail}"
+            parts.append(block)
+            used += overhead + count(snippet)
+            index.add(fingerprint, len(included))
+            included.append(result)
+
+        if not included:
+            return SearchContext(text=EMPTY_CONTEXT, tokens=count(EMPTY_CONTEXT), dropped=dropped)
+
+        return SearchContext(text=''.join(parts), tokens=used, results=included, dropped=dropped)
+
+
+# 全局实例
+search_context_builder = SearchContextBuilder()
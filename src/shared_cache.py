@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享缓存模块
+为多进程部署提供跨 worker 共享的缓存：默认使用 SQLite（WAL 模式），任一 worker 写入的结果其他 worker 都能命中
+所有后端提供相同的 get/set 接口，支持过期时间和按条数、字节数淘汰
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+from config import Config
+from logger import logger
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache(accessed_at);
+CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache(expires_at);
+"""
+
+# 命中时最多每隔这么多秒更新一次访问时间，避免每次读取都产生一次写入
+TOUCH_INTERVAL = 60
+# 每写入这么多次触发一次后台过期清理和淘汰，条数和字节数上限因此是近似值
+EVICT_EVERY = 64
+# 后台清理等待写锁的最长秒数，其他进程正在写入时跳过本次清理，不阻塞写入
+EVICT_BUSY_TIMEOUT = 0.1
+# 连接等待写锁的默认秒数
+BUSY_TIMEOUT = 5
+
+
+def make_key(namespace: str, *parts: Any) -> str:
+    """
+    生成缓存键
+    各部分序列化后取哈希，键长度固定，不会把提示词等长文本写进索引
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class CacheBackend(ABC):
+    """
+    缓存接口
+    值需要能被 JSON 序列化；读写失败时只记录日志并按未命中处理，缓存不可用不影响请求
+    子类必须实现 get/set/delete/clear，缺少任一方法时在创建实例时即报错
+    """
+
+    def __init__(self, default_ttl: float = 3600):
+        self.default_ttl = default_ttl
+        self._hits = 0
+        self._misses = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回 None"""
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float = None):
+        """写入缓存，ttl 为秒数，未指定时使用默认过期时间"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """删除缓存条目"""
+
+    @abstractmethod
+    def clear(self):
+        """清空缓存"""
+
+    def _count(self, hit: bool):
+        # 统计只用于监控，不加锁
+        if hit:
+            self._hits += 1
+        else:
+            self._misses += 1
+
+    def stats(self) -> dict:
+        """本进程的命中统计"""
+        lookups = self._hits + self._misses
+        return {
+            'backend': type(self).__name__,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': round(self._hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def reset_after_fork(self):
+        """在 fork 出的 worker 进程中调用"""
+
+
+class NullCache(CacheBackend):
+    """不缓存"""
+
+    def get(self, key: str) -> Optional[Any]:
+        self._count(False)
+        return None
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """
+    进程内缓存
+    按最近访问淘汰，适合单进程运行；多进程部署时每个 worker 各有一份
+    """
+
+    def __init__(self, max_entries: int = None, default_ttl: float = 3600):
+        super().__init__(default_ttl)
+        self.max_entries = max_entries or Config.CACHE_MAX_ENTRIES
+        self._data: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        self._count(entry is not None)
+        # 存储序列化后的值，调用方修改返回值不会影响缓存
+        return json.loads(entry[1]) if entry is not None else None
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        expires_at = time.time() + (ttl if ttl is not None else self.default_ttl)
+        value = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+
+
+class SQLiteCache(CacheBackend):
+    """
+    SQLite 共享缓存
+    数据库以 WAL 模式运行，所有 worker 共用同一个文件，读取互不阻塞；单条语句的读写是原子的
+    过期条目在读取时忽略，并在定期清理时删除；超出条数或字节数上限时删除最久未访问的条目
+    清理在后台线程中进行，写入请求不等待清理
+    """
+
+    def __init__(self, db_path: str = None, max_entries: int = None, max_bytes: int = None,
+                 default_ttl: float = 3600):
+        super().__init__(default_ttl)
+        self.db_path = db_path or Config.CACHE_DB
+        self.max_entries = max_entries or Config.CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or Config.CACHE_MAX_BYTES
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sets = 0
+        self._evict_event = threading.Event()
+        self._evictor: Optional[threading.Thread] = None
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                'SELECT value, expires_at, accessed_at FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                self._count(False)
+                return None
+            if now - row[2] > TOUCH_INTERVAL:
+                connection.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+            self._count(True)
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"读取共享缓存失败: {e}")
+            self._count(False)
+            return None
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        now = time.time()
+        try:
+            value = json.dumps(value, ensure_ascii=False)
+            size = len(value.encode('utf-8'))
+            # 单个值超过总上限时不缓存，避免一次写入淘汰掉所有条目
+            if size > self.max_bytes:
+                return
+            self._connection().execute(
+                'INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, value, size, now + (ttl if ttl is not None else self.default_ttl), now)
+            )
+            self._sets += 1
+            if self._sets % EVICT_EVERY == 0:
+                self._request_evict()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"写入共享缓存失败: {e}")
+
+    def _request_evict(self):
+        """通知后台线程清理，线程不存在时启动"""
+        self._evict_event.set()
+        with self._lock:
+            if self._evictor is None:
+                self._evictor = threading.Thread(target=self._evict_loop, name='cache-evict', daemon=True)
+                self._evictor.start()
+
+    def _evict_loop(self):
+        """后台清理线程，其他进程持有写锁时跳过，由之后的写入再次触发"""
+        while True:
+            self._evict_event.wait()
+            self._evict_event.clear()
+            try:
+                self.evict(busy_timeout=EVICT_BUSY_TIMEOUT)
+            except sqlite3.Error as e:
+                logger.warning(f"共享缓存清理失败: {e}")
+
+    def delete(self, key: str):
+        try:
+            self._connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"删除共享缓存失败: {e}")
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def evict(self, busy_timeout: float = None) -> int:
+        """
+        删除过期条目，并按最近访问时间淘汰超出上限的条目
+
+        Args:
+            busy_timeout: 等待写锁的最长秒数，超时后跳过本次清理；未指定时按连接的默认超时等待，超时抛出异常
+
+        Returns:
+            int: 删除的条目数
+        """
+        connection = self._connection()
+        # 写事务内完成统计和删除，多个 worker 同时清理时不会重复淘汰
+        if busy_timeout is None:
+            connection.execute('BEGIN IMMEDIATE')
+        else:
+            connection.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}')
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError as e:
+                logger.debug(f"共享缓存正在被其他进程写入，跳过本次清理: {e}")
+                return 0
+            finally:
+                connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}')
+        try:
+            removed = connection.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),)).rowcount
+            count, total = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                victims = []
+                for key, size in connection.execute('SELECT key, size FROM cache ORDER BY accessed_at'):
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    victims.append((key,))
+                    count -= 1
+                    total -= size
+                connection.executemany('DELETE FROM cache WHERE key = ?', victims)
+                removed += len(victims)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        if removed:
+            logger.debug(f"共享缓存清理 {removed} 个条目")
+        return removed
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        try:
+            count, total = self._connection().execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+            ).fetchone()
+            stats.update({'entries': count, 'bytes': total,
+                          'max_entries': self.max_entries, 'max_bytes': self.max_bytes})
+        except sqlite3.Error as e:
+            stats['error'] = str(e)
+        return stats
+
+    def reset_after_fork(self):
+        """丢弃从主进程继承的连接和清理线程状态，SQLite 连接不能跨进程使用"""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._evict_event = threading.Event()
+        self._evictor = None
+
+
+def create_cache(backend: str = None) -> CacheBackend:
+    """
+    按配置创建缓存后端
+
+    Args:
+        backend: sqlite（多进程共享）、memory（进程内）或 none
+    """
+    backend = (backend or Config.CACHE_BACKEND).lower()
+    if backend == 'none':
+        return NullCache()
+    if backend == 'memory':
+        return MemoryCache()
+    try:
+        return SQLiteCache()
+    except sqlite3.Error as e:
+        logger.warning(f"共享缓存数据库不可用，改用进程内缓存: {e}")
+        return MemoryCache()
+
+
+# 全局实例
+shared_cache = create_cache()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SimHash 近似重复检测模块
+为搜索摘要和网页正文计算 64 位指纹，转载新闻、镜像页面等 URL 不同但内容几乎相同的结果指纹只差几位；
+指纹索引按分段分桶，查找和插入只比较落在同一桶中的少量指纹，整体为线性时间
+"""
+
+import re
+import hashlib
+from collections import Counter
+from typing import Any, Dict, Hashable, List, Optional
+from config import Config
+
+
+FINGERPRINT_BITS = 64
+_MASK = (1 << FINGERPRINT_BITS) - 1
+_NORMALIZE_PATTERN = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text: str, size: int = 3, max_chars: int = None) -> Optional[int]:
+    """
+    计算文本的 SimHash 指纹
+    去掉标点和空白后按 size 个字符切分为特征，特征按出现次数加权；长文本只取前 max_chars 个字符，
+    镜像和转载页面的开头部分同样相同
+
+    Returns:
+        int: 64 位指纹，文本为空时返回 None
+    """
+    max_chars = max_chars or Config.SIMHASH_MAX_CHARS
+    normalized = _NORMALIZE_PATTERN.sub('', (text or '')[:max_chars].lower())
+    if not normalized:
+        return None
+    if len(normalized) <= size:
+        features = Counter([normalized])
+    else:
+        features = Counter(normalized[i:i + size] for i in range(len(normalized) - size + 1))
+
+    # 只累加置位的位，某一位的权重为 置位次数 - 未置位次数
+    positive = [0] * FINGERPRINT_BITS
+    for feature, count in features.items():
+        value = _feature_hash(feature)
+        while value:
+            lowest = value & -value
+            positive[lowest.bit_length() - 1] += count
+            value ^= lowest
+    total = sum(features.values())
+    fingerprint = 0
+    for bit, weight in enumerate(positive):
+        if 2 * weight > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个指纹不同的位数"""
+    return bin((a ^ b) & _MASK).count('1')
+
+
+class SimHashIndex:
+    """
+    指纹索引
+    把 64 位指纹分为 max_distance + 1 段，按各段的值分桶；两个指纹相差不超过 max_distance 位时
+    至少有一段完全相同（抽屉原理），因此只需比较同桶中的指纹
+    """
+
+    def __init__(self, max_distance: int = None):
+        self.max_distance = Config.SIMHASH_MAX_DISTANCE if max_distance is None else max_distance
+        self.bands = self.max_distance + 1
+        self._width = -(-FINGERPRINT_BITS // self.bands)
+        self._buckets: List[Dict[int, List[tuple]]] = [{} for _ in range(self.bands)]
+
+    def _band_values(self, fingerprint: int):
+        band_mask = (1 << self._width) - 1
+        for band in range(self.bands):
+            yield band, fingerprint >> (band * self._width) & band_mask
+
+    def find(self, fingerprint: Optional[int]) -> Optional[Hashable]:
+        """查找近似重复的已有条目，返回其键，没有时返回 None"""
+        if fingerprint is None:
+            return None
+        for band, value in self._band_values(fingerprint):
+            for other, key in self._buckets[band].get(value, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, fingerprint: Optional[int], key: Hashable):
+        """加入一个指纹，空指纹不加入"""
+        if fingerprint is None:
+            return
+        for band, value in self._band_values(fingerprint):
+            self._buckets[band].setdefault(value, []).append((fingerprint, key))
+
+
+def result_fingerprint(result: Dict[str, Any]) -> Optional[int]:
+    """
+    搜索结果的指纹：有正文时使用正文指纹，否则使用摘要指纹
+    指纹在搜索和抓取阶段计算并随结果一起缓存，缺失时在此补算
+    """
+    if result.get('content'):
+        if result.get('content_simhash') is None:
+            result['content_simhash'] = simhash(result['content'])
+        return result['content_simhash']
+    if result.get('simhash') is None:
+        result['simhash'] = simhash(result.get('snippet') or '')
+    return result['simhash']
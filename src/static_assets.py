@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源模块
+本地托管前端依赖，生成带指纹的资源 URL，并对可压缩的响应做 gzip/brotli 压缩
+
+固定版本的前端依赖下载到 static/vendor 目录后页面不再依赖外网 CDN：首次部署时执行 `python static_assets.py fetch`，
+或由服务启动时在后台自动下载；本地缺失的资源回退到 CDN。
+"""
+
+import io
+import os
+import sys
+import gzip
+import hashlib
+import tarfile
+import functools
+import threading
+from typing import Dict, List, Optional, Tuple
+import requests
+from config import Config
+from logger import logger
+
+# brotli 为可选依赖，未安装时只使用 gzip
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# 固定版本的前端依赖：(npm 包名, 版本, {包内路径: static 下的本地路径})，以 / 结尾表示整个目录
+VENDOR_PACKAGES = (
+    ('marked', '9.1.6', {'marked.min.js': 'vendor/marked/marked.min.js'}),
+    ('@highlightjs/cdn-assets', '11.9.0', {
+        'highlight.min.js': 'vendor/highlight/highlight.min.js',
+        'styles/github.min.css': 'vendor/highlight/github.min.css',
+    }),
+    # MathJax 运行时会按自身路径加载字体和扩展，需要完整的 es5 目录
+    ('mathjax', '3.2.2', {'es5/': 'vendor/mathjax/'}),
+)
+
+# 本地资源缺失时回退的 CDN 地址
+CDN_FALLBACKS = {
+    'vendor/marked/marked.min.js': 'https://cdn.jsdelivr.net/npm/marked@9.1.6/marked.min.js',
+    'vendor/highlight/highlight.min.js': 'https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js',
+    'vendor/highlight/github.min.css': 'https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github.min.css',
+    'vendor/mathjax/tex-mml-chtml.js': 'https://cdn.jsdelivr.net/npm/mathjax@3.2.2/es5/tex-mml-chtml.js',
+}
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'application/json',
+    'application/javascript', 'text/javascript', 'image/svg+xml',
+}
+# 小于该字节数的响应不值得压缩
+MIN_COMPRESS_SIZE = 1024
+# 带指纹的资源缓存一年
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """根据 Accept-Encoding 选择压缩算法，优先 brotli"""
+    accept_encoding = (accept_encoding or '').lower()
+    if BROTLI_AVAILABLE and 'br' in accept_encoding:
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    """按指定算法压缩数据"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+class CompressedPayload:
+    """
+    预先渲染好的响应体
+    各压缩算法的结果按需生成一次并缓存
+    """
+
+    def __init__(self, data: bytes, mimetype: str):
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(data).hexdigest()[:16]
+        self._variants: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def get(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """返回 (响应体, Content-Encoding)"""
+        encoding = choose_encoding(accept_encoding)
+        if not encoding or len(self.data) < MIN_COMPRESS_SIZE or self.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return self.data, None
+        with self._lock:
+            if encoding not in self._variants:
+                self._variants[encoding] = compress_bytes(self.data, encoding)
+            return self._variants[encoding], encoding
+
+
+def compress_response(response, accept_encoding: str):
+    """
+    压缩非流式的文本类响应（HTML、JSON、JS、CSS）
+    流式响应（SSE）和文件直传响应保持原样
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = choose_encoding(accept_encoding)
+    response.vary.add('Accept-Encoding')
+    if not encoding:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.set_data(compress_bytes(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class StaticAssets:
+    """
+    静态资源管理器
+    vendor 目录下的资源以包版本作为指纹（同一个包内的文件共享指纹，MathJax 的相对路径加载也能命中），
+    其余资源以文件内容哈希作为指纹
+    """
+
+    def __init__(self, static_folder: str = STATIC_FOLDER):
+        self.static_folder = static_folder
+        self._vendor_fingerprints = {}
+        for package, version, files in VENDOR_PACKAGES:
+            fingerprint = hashlib.sha256(f"{package}@{version}".encode('utf-8')).hexdigest()[:10]
+            for local_path in files.values():
+                prefix = local_path if local_path.endswith('/') else os.path.dirname(local_path) + '/'
+                self._vendor_fingerprints[prefix] = fingerprint
+        self._payloads: Dict[str, CompressedPayload] = {}
+        self._lock = threading.Lock()
+
+    def _full_path(self, path: str) -> Optional[str]:
+        full_path = os.path.normpath(os.path.join(self.static_folder, path))
+        if not full_path.startswith(os.path.normpath(self.static_folder) + os.sep):
+            return None
+        return full_path if os.path.isfile(full_path) else None
+
+    @functools.lru_cache(maxsize=1024)
+    def fingerprint(self, path: str) -> Optional[str]:
+        """获取资源指纹，资源不存在时返回 None"""
+        for prefix, fingerprint in self._vendor_fingerprints.items():
+            if path.startswith(prefix):
+                return fingerprint
+        full_path = self._full_path(path)
+        if not full_path:
+            return None
+        with open(full_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()[:10]
+
+    def url(self, path: str) -> str:
+        """
+        获取资源 URL
+        本地存在时返回带指纹的地址，否则回退到 CDN
+        """
+        if self._full_path(path):
+            return f"/assets/{self.fingerprint(path)}/{path}"
+        if path in CDN_FALLBACKS:
+            return CDN_FALLBACKS[path]
+        logger.warning(f"静态资源不存在: {path}")
+        return f"/static/{path}"
+
+    def check(self, auto_fetch: bool = None) -> List[str]:
+        """
+        检查页面引用的前端依赖是否已下载到本地
+        缺失时警告一次，并按配置在后台下载：下载完成之前页面从 CDN 加载，完成后新请求的页面改用本地资源
+
+        Returns:
+            List[str]: 缺失的资源路径
+        """
+        auto_fetch = Config.STATIC_AUTO_FETCH if auto_fetch is None else auto_fetch
+        missing = [path for path in CDN_FALLBACKS if not self._full_path(path)]
+        if missing and auto_fetch:
+            logger.warning(f"前端依赖未下载到本地，正在后台下载，完成之前页面从 CDN 加载: {', '.join(missing)}")
+            threading.Thread(target=self._fetch_in_background, name='static-fetch', daemon=True).start()
+        elif missing:
+            logger.warning(f"前端依赖未下载到本地，页面将从 CDN 加载: {', '.join(missing)}；"
+                           f"请在能访问 npm 的机器上执行 `cd src && python static_assets.py fetch`")
+        return missing
+
+    def _fetch_in_background(self):
+        try:
+            self.fetch()
+        except Exception as e:
+            logger.warning(f"自动下载前端依赖失败，页面继续从 CDN 加载；"
+                           f"可以在能访问 npm 的机器上执行 `cd src && python static_assets.py fetch`: {e}")
+
+    def load(self, path: str, mimetype: str) -> Optional[CompressedPayload]:
+        """读取资源内容，连同压缩结果缓存在内存中"""
+        payload = self._payloads.get(path)
+        if payload is not None:
+            return payload
+        full_path = self._full_path(path)
+        if not full_path:
+            return None
+        with open(full_path, 'rb') as f:
+            payload = CompressedPayload(f.read(), mimetype)
+        with self._lock:
+            self._payloads[path] = payload
+        return payload
+
+    def fetch(self):
+        """从 npm 下载固定版本的前端依赖到 static/vendor"""
+        for package, version, files in VENDOR_PACKAGES:
+            tarball_name = package.split('/')[-1]
+            url = f"https://registry.npmjs.org/{package}/-/{tarball_name}-{version}.tgz"
+            logger.info(f"下载 {package}@{version}: {url}")
+            response = requests.get(url, timeout=60)
+            response.raise_for_status()
+
+            with tarfile.open(fileobj=io.BytesIO(response.content), mode='r:gz') as archive:
+                for member in archive.getmembers():
+                    if not member.isfile() or not member.name.startswith('package/'):
+                        continue
+                    inner_path = member.name[len('package/'):]
+                    for source, target in files.items():
+                        if source.endswith('/') and inner_path.startswith(source):
+                            local_path = target + inner_path[len(source):]
+                        elif inner_path == source:
+                            local_path = target
+                        else:
+                            continue
+                        full_path = os.path.join(self.static_folder, local_path)
+                        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                        # 先写临时文件再替换，服务运行中下载时不会读到写了一半的文件
+                        temp_path = f"{full_path}.{os.getpid()}.tmp"
+                        with open(temp_path, 'wb') as f:
+                            f.write(archive.extractfile(member).read())
+                        os.replace(temp_path, full_path)
+        self.fingerprint.cache_clear()
+        logger.info(f"前端依赖已下载到 {os.path.join(self.static_folder, 'vendor')}")
+
+
+# 全局实例
+static_assets = StaticAssets()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'fetch':
+        static_assets.fetch()
+    else:
+        print("用法: python static_assets.py fetch")
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式生成登记模块
+记录进行中的流式生成，支持客户端通过 stream_id 主动取消
+
+多进程部署时取消请求通常落在另一个 worker 上，因此生成同时登记在 SQLite 中（与会话存储共用数据库文件）：
+本进程内的生成直接取消；其他进程的生成写入取消标记，由其所在 worker 的轮询线程发现后取消
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional, Tuple
+from config import Config
+from logger import logger
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    stream_id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    cancelled INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class StreamRegistry:
+    """
+    进行中的流式生成登记表
+    取消时设置取消标记并立即关闭上游流，生成循环在下一次迭代时退出
+    """
+
+    def __init__(self, db_path: str = None, poll_interval: float = None):
+        self.db_path = db_path or Config.CONVERSATION_DB
+        self.poll_interval = poll_interval or Config.STREAM_CANCEL_POLL_INTERVAL
+        self._streams: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._poller: Optional[threading.Thread] = None
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def register(self) -> Tuple[str, threading.Event]:
+        """登记一个新的流式生成，返回 (stream_id, 取消标记)"""
+        stream_id = uuid.uuid4().hex
+        cancel_event = threading.Event()
+        now = time.time()
+        try:
+            connection = self._connection()
+            # 顺带清理异常退出的 worker 留下的登记
+            connection.execute('DELETE FROM streams WHERE started_at < ?', (now - 2 * Config.MAX_REQUEST_DEADLINE,))
+            connection.execute('INSERT INTO streams (stream_id, pid, started_at) VALUES (?, ?, ?)',
+                               (stream_id, os.getpid(), now))
+        except sqlite3.Error as e:
+            logger.warning(f"登记流式生成失败，只能在本进程内取消: {e}")
+        with self._lock:
+            self._streams[stream_id] = {'event': cancel_event, 'closer': None}
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='stream-cancel-poll', daemon=True)
+                self._poller.start()
+        return stream_id, cancel_event
+
+    def attach(self, stream_id: str, closer: Callable[[], None]):
+        """关联关闭上游流的回调"""
+        with self._lock:
+            entry = self._streams.get(stream_id)
+            if entry is not None:
+                entry['closer'] = closer
+
+    def _cancel_local(self, stream_id: str, entry: dict):
+        entry['event'].set()
+        closer: Optional[Callable[[], None]] = entry['closer']
+        if closer is not None:
+            closer()
+        logger.info(f"流式生成已取消: {stream_id[:8]}")
+
+    def cancel(self, stream_id: str) -> bool:
+        """
+        取消流式生成
+        生成不在本进程时写入取消标记，由所在 worker 在 poll_interval 秒内取消
+
+        Returns:
+            bool: 生成存在且已发出取消时返回 True
+        """
+        with self._lock:
+            entry = self._streams.get(stream_id)
+        if entry is not None:
+            self._cancel_local(stream_id, entry)
+            return True
+        try:
+            cursor = self._connection().execute('UPDATE streams SET cancelled = 1 WHERE stream_id = ?', (stream_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"写入取消标记失败: {e}")
+            return False
+        if cursor.rowcount:
+            logger.info(f"流式生成不在本进程，已写入取消标记: {stream_id[:8]}")
+        return cursor.rowcount > 0
+
+    def _poll(self):
+        """轮询本进程的生成是否被其他 worker 标记取消，没有进行中的生成时退出"""
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                stream_ids = list(self._streams)
+                if not stream_ids:
+                    self._poller = None
+                    return
+            try:
+                placeholders = ','.join('?' * len(stream_ids))
+                rows = self._connection().execute(
+                    f'SELECT stream_id FROM streams WHERE cancelled = 1 AND stream_id IN ({placeholders})', stream_ids
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"读取取消标记失败: {e}")
+                continue
+            for (stream_id,) in rows:
+                with self._lock:
+                    entry = self._streams.get(stream_id)
+                if entry is not None and not entry['event'].is_set():
+                    self._cancel_local(stream_id, entry)
+
+    def unregister(self, stream_id: str):
+        """生成结束后移除登记"""
+        with self._lock:
+            self._streams.pop(stream_id, None)
+        try:
+            self._connection().execute('DELETE FROM streams WHERE stream_id = ?', (stream_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"移除流式生成登记失败: {e}")
+
+    def active_count(self) -> int:
+        """本进程中进行中的流式生成数量"""
+        with self._lock:
+            return len(self._streams)
+
+    def reset_after_fork(self):
+        """丢弃从主进程继承的连接、锁和轮询线程状态"""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._poller = None
+
+
+# 全局实例
+stream_registry = StreamRegistry()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求耗时分解模块
+记录一次 /chat 请求各阶段（关键词提取、搜索、模型排队、首 token、生成等）的耗时，
+以 Server-Timing 响应头或流式结束时的 timing 事件返回给浏览器，并写入日志
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional, Tuple
+
+
+class RequestTimer:
+    """
+    单次请求的阶段计时器
+    同名阶段可以出现多次（如模型回退时的多次调用），按发生顺序保留
+    """
+
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self.spans: List[Tuple[str, float, str]] = []
+
+    @contextmanager
+    def span(self, name: str, desc: str = ''):
+        """记录代码块的耗时，代码块抛出异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, desc)
+
+    def add(self, name: str, seconds: float, desc: str = ''):
+        """直接记录一个阶段的耗时（秒）"""
+        self.spans.append((name, seconds * 1000, desc))
+
+    def elapsed(self) -> float:
+        """从请求开始到现在的秒数"""
+        return time.perf_counter() - self._origin
+
+    def server_timing(self, include_total: bool = True) -> str:
+        """
+        生成 Server-Timing 响应头，浏览器开发者工具的 Timing 面板会按阶段展示
+
+        Args:
+            include_total: 是否附加从请求开始到现在的总耗时
+        """
+        entries = []
+        for name, ms, desc in self.spans:
+            entry = f"{name};dur={ms:.1f}"
+            # 响应头只能包含 ASCII 字符
+            if desc and desc.isascii():
+                escaped = desc.replace('\\', '\\\\').replace('"', '\\"')
+                entry += f';desc="{escaped}"'
+            entries.append(entry)
+        if include_total:
+            entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(entries)
+
+    def to_dict(self) -> Dict:
+        """流式响应 timing 事件的内容"""
+        spans = [{'name': name, 'ms': round(ms, 1), **({'desc': desc} if desc else {})}
+                 for name, ms, desc in self.spans]
+        return {'total_ms': round(self.elapsed() * 1000, 1), 'spans': spans}
+
+    def summary(self) -> str:
+        """日志中的单行摘要"""
+        parts = [f"{name}={ms:.0f}ms" for name, ms, _ in self.spans]
+        parts.append(f"total={self.elapsed() * 1000:.0f}ms")
+        return ' '.join(parts)
+
+
+def timed(timer: Optional[RequestTimer], name: str, desc: str = ''):
+    """未传入计时器时不计时，调用方不需要判断"""
+    return timer.span(name, desc) if timer is not None else nullcontext()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地 token 计数模块
+按模型系列选择分词器（OpenAI 模型用 tiktoken，Claude 用 litellm 附带的分词器，其余模型用 Hugging Face tokenizers），
+分词器文件都从本地读取，运行时不访问网络：tiktoken 编码优先使用 litellm 附带的编码文件，
+其余编码和 Hugging Face 分词器在首次部署时执行 `python token_counter.py fetch` 下载到 tokenizers 目录；
+分词器在启动时或首次使用时在后台加载并缓存，加载完成之前或无法加载时按字符估算；
+文本的计数按 (分词器, 文本) 缓存，每次请求重新计数会话历史时只有新的消息需要分词；
+请求发出之前在本地校验上下文长度，裁剪放不下的早期会话历史，并把 max_tokens 限制在剩余的上下文之内
+"""
+
+import os
+import sys
+import json
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import requests
+from config import Config, ModelConfig
+from logger import logger
+from utils import estimate_tokens, LRUCache
+
+# OpenAI 模型的分词器，未安装时按字符估算
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Claude、通义千问等模型的分词器，未安装时按字符估算
+try:
+    from tokenizers import Tokenizer
+    TOKENIZERS_AVAILABLE = True
+except ImportError:
+    TOKENIZERS_AVAILABLE = False
+
+
+TOKENIZER_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tokenizers')
+# tiktoken 编码文件的文件名为 tiktoken 按下载地址计算的缓存键（地址的 SHA-1），加载时校验文件的 SHA-256
+TIKTOKEN_URL = 'https://openaipublic.blob.core.windows.net/encodings/{name}.tiktoken'
+HUGGINGFACE_URL = 'https://huggingface.co/{repo}/resolve/main/tokenizer.json'
+
+# 每条消息的角色和分隔符开销，以及回答开头的固定开销（与 OpenAI 的计数规则一致）
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+# 每张图片按缩放后最大尺寸的开销计数
+IMAGE_TOKENS = 1600
+# 缓存计数的文本条数，足够覆盖进行中会话的全部历史消息
+COUNT_CACHE_SIZE = 8192
+
+
+def _litellm_tiktoken_dir() -> Optional[str]:
+    """litellm 附带的 tiktoken 编码文件目录（包含 o200k_base 和 cl100k_base）"""
+    try:
+        from importlib import resources
+        return str(resources.files('litellm.litellm_core_utils.tokenizers'))
+    except Exception:
+        return None
+
+
+class ContextLengthError(ValueError):
+    """请求超过模型的上下文长度"""
+
+
+@dataclass
+class ContextFit:
+    """上下文校验结果"""
+    messages: List[Dict]  # 裁剪后的消息列表
+    prompt_tokens: int  # 输入 token 数（本地计数）
+    max_tokens: int  # 限制在剩余上下文之内的最大输出 token 数
+    trimmed: int = 0  # 被裁剪的早期历史消息数
+
+
+class TokenCounter:
+    """
+    本地 token 计数器
+    分词器由模型配置的 tokenizer 指定：tiktoken:<编码名>、anthropic 或
+    huggingface:<tokenizers 目录下的 tokenizer.json 相对路径>（路径的目录部分为 Hugging Face 仓库名）
+    """
+
+    def __init__(self, tokenizer_folder: str = TOKENIZER_FOLDER):
+        self.tokenizer_folder = tokenizer_folder
+        self._tokenizers: Dict[str, Any] = {}
+        self._loading = set()
+        self._lock = threading.Lock()
+        self._tiktoken_lock = threading.Lock()
+        self._counts = LRUCache(COUNT_CACHE_SIZE)
+
+    def _tiktoken_dirs(self) -> List[str]:
+        return [directory for directory in (os.path.join(self.tokenizer_folder, 'tiktoken'), _litellm_tiktoken_dir())
+                if directory]
+
+    def _get_tiktoken(self, name: str, cache_dir: str):
+        # 导入 litellm 时会把 TIKTOKEN_CACHE_DIR 指向其自身目录，这里临时指向选定的目录
+        with self._tiktoken_lock:
+            previous = os.environ.get('TIKTOKEN_CACHE_DIR')
+            os.environ['TIKTOKEN_CACHE_DIR'] = cache_dir
+            try:
+                return tiktoken.get_encoding(name)
+            finally:
+                if previous is None:
+                    os.environ.pop('TIKTOKEN_CACHE_DIR', None)
+                else:
+                    os.environ['TIKTOKEN_CACHE_DIR'] = previous
+
+    def _load_tiktoken(self, name: str):
+        # 只从已有编码文件的目录加载，缺少文件时 tiktoken 会尝试下载
+        cache_key = hashlib.sha1(TIKTOKEN_URL.format(name=name).encode()).hexdigest()
+        for directory in self._tiktoken_dirs():
+            if os.path.isfile(os.path.join(directory, cache_key)):
+                return self._get_tiktoken(name, directory).encode
+        raise FileNotFoundError(f"未找到 tiktoken 编码 {name}，请先执行 `python token_counter.py fetch`")
+
+    def _load(self, spec: str):
+        kind, _, name = spec.partition(':')
+        if kind == 'tiktoken':
+            if not TIKTOKEN_AVAILABLE:
+                raise RuntimeError('未安装 tiktoken')
+            return self._load_tiktoken(name)
+        if kind in ('anthropic', 'huggingface') and not TOKENIZERS_AVAILABLE:
+            raise RuntimeError('未安装 tokenizers')
+        if kind == 'anthropic':
+            from importlib import resources
+            path = resources.files('litellm.litellm_core_utils.tokenizers').joinpath('anthropic_tokenizer.json')
+            tokenizer = Tokenizer.from_str(path.read_text(encoding='utf-8'))
+        elif kind == 'huggingface':
+            path = os.path.join(self.tokenizer_folder, name)
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"{path} 不存在，请先执行 `python token_counter.py fetch`")
+            tokenizer = Tokenizer.from_file(path)
+        else:
+            raise ValueError(f"未知的分词器类型: {spec}")
+        return lambda text: tokenizer.encode(text, add_special_tokens=False).ids
+
+    def get_encoder(self, spec: Optional[str]):
+        """
+        获取已加载的分词函数
+        尚未加载时在后台开始加载，本次按字符估算：请求从不等待分词器加载（较大的分词器文件需要数百毫秒）
+        """
+        if not spec:
+            return None
+        with self._lock:
+            if spec in self._tokenizers:
+                return self._tokenizers[spec]
+            if spec in self._loading:
+                return None
+            self._loading.add(spec)
+        threading.Thread(target=self.load, args=(spec,), name='tokenizer-load', daemon=True).start()
+        return None
+
+    def load(self, spec: str):
+        """加载分词器并缓存，加载失败时记住失败，之后一直按字符估算"""
+        try:
+            encoder = self._load(spec)
+            logger.info(f"已加载分词器: {spec}")
+        except Exception as e:
+            # 每个分词器只在加载失败时警告一次，之后使用该分词器的模型都按字符估算
+            logger.warning(f"加载分词器 {spec} 失败，使用该分词器的模型按字符估算 token 数，"
+                           f"上下文裁剪和 max_tokens 限制可能不准确: {e}")
+            encoder = None
+        with self._lock:
+            self._tokenizers[spec] = encoder
+            self._loading.discard(spec)
+        return encoder
+
+    def preload(self, model_configs: List[ModelConfig]):
+        """在后台加载各模型的分词器，使首批请求也能准确计数"""
+        if not Config.TOKENIZER_PRELOAD:
+            return
+        for spec in dict.fromkeys(model.tokenizer for model in model_configs if model.tokenizer):
+            self.get_encoder(spec)
+
+    def count_text(self, text: str, model_config: Optional[ModelConfig] = None) -> int:
+        """计算文本的 token 数，按 (分词器, 文本) 缓存计数"""
+        if not text:
+            return 0
+        spec = model_config.tokenizer if model_config else None
+        encoder = self.get_encoder(spec)
+        if encoder is None:
+            return estimate_tokens(text)
+        key = (spec, len(text), hash(text))
+        count = self._counts.get(key)
+        if count is None:
+            count = len(encoder(text))
+            self._counts.set(key, count)
+        return count
+
+    def count_message(self, message: Dict, model_config: Optional[ModelConfig] = None) -> int:
+        """计算单条消息的 token 数，包含文本、图片、工具调用和消息开销"""
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        content = message.get('content')
+        if isinstance(content, str):
+            tokens += self.count_text(content, model_config)
+        elif content:
+            for block in content:
+                if block.get('type') == 'image_url':
+                    tokens += IMAGE_TOKENS
+                else:
+                    tokens += self.count_text(block.get('text', ''), model_config)
+        for call in message.get('tool_calls') or ():
+            function = call.get('function', {})
+            tokens += self.count_text(f"{function.get('name', '')}{function.get('arguments', '')}", model_config)
+        return tokens
+
+    def count_messages(self, messages: List[Dict], model_config: Optional[ModelConfig] = None) -> int:
+        """计算消息列表的输入 token 数"""
+        return sum(self.count_message(message, model_config) for message in messages) + REPLY_OVERHEAD_TOKENS
+
+    def count_tools(self, tools: Optional[List[Dict]], model_config: Optional[ModelConfig] = None) -> int:
+        """计算工具定义的 token 数（按 JSON 文本计）"""
+        if not tools:
+            return 0
+        return self.count_text(json.dumps(tools, ensure_ascii=False), model_config)
+
+    def fit(self, model_config: ModelConfig, messages: List[Dict], max_tokens: int,
+            extra_tokens: int = 0) -> ContextFit:
+        """
+        按模型的上下文长度校验请求
+        放不下时从最早的会话历史开始裁剪（系统消息和最后一条用户消息及其后的消息始终保留），
+        裁剪后仍放不下时抛出 ContextLengthError；max_tokens 限制在剩余的上下文之内
+
+        Args:
+            model_config: 目标模型配置
+            messages: 消息列表
+            max_tokens: 请求的最大输出 token 数
+            extra_tokens: 消息以外的输入开销，例如工具定义和尚未附加的图片
+        """
+        counts = [self.count_message(message, model_config) for message in messages]
+        prompt_tokens = sum(counts) + REPLY_OVERHEAD_TOKENS + extra_tokens
+        window = model_config.context_window
+        if not window or not Config.CONTEXT_CHECK_ENABLED:
+            return ContextFit(messages, prompt_tokens, max_tokens)
+
+        min_completion = min(max_tokens, Config.MIN_COMPLETION_TOKENS)
+        last_user = max((i for i, message in enumerate(messages) if message.get('role') == 'user'), default=0)
+        removable = [i for i in range(last_user) if messages[i].get('role') != 'system']
+        removed = set()
+        if prompt_tokens + min_completion > window and Config.CONTEXT_AUTO_TRIM:
+            for i in removable:
+                if prompt_tokens + min_completion <= window:
+                    # 保留下来的历史不能以助手消息开头
+                    if messages[i].get('role') == 'user':
+                        break
+                removed.add(i)
+                prompt_tokens -= counts[i]
+
+        if prompt_tokens + min_completion > window:
+            raise ContextLengthError(
+                f"消息过长：约 {prompt_tokens} tokens，模型 {model_config.display_name} 的上下文长度为 {window} tokens"
+            )
+
+        if removed:
+            messages = [message for i, message in enumerate(messages) if i not in removed]
+            logger.info(f"上下文超过 {model_config.display_name} 的长度限制，裁剪了 {len(removed)} 条早期历史消息")
+        clamped = min(max_tokens, window - prompt_tokens)
+        if clamped < max_tokens:
+            logger.debug(f"max_tokens 按剩余上下文限制为 {clamped}（模型 {model_config.display_name}）")
+        return ContextFit(messages, prompt_tokens, clamped, len(removed))
+
+    def fetch(self):
+        """下载已配置模型的分词器：tiktoken 编码下载到 tokenizers/tiktoken，Hugging Face 的 tokenizer.json 下载到 tokenizers 目录"""
+        specs = dict.fromkeys(model.tokenizer for model in Config.MODELS if model.tokenizer)
+        for spec in specs:
+            kind, _, name = spec.partition(':')
+            if kind == 'tiktoken' and TIKTOKEN_AVAILABLE:
+                cache_dir = os.path.join(self.tokenizer_folder, 'tiktoken')
+                os.makedirs(cache_dir, exist_ok=True)
+                logger.info(f"下载分词器 {spec}: {TIKTOKEN_URL.format(name=name)}")
+                self._get_tiktoken(name, cache_dir)
+            elif kind == 'huggingface':
+                url = HUGGINGFACE_URL.format(repo=os.path.dirname(name))
+                logger.info(f"下载分词器 {spec}: {url}")
+                response = requests.get(url, timeout=60)
+                response.raise_for_status()
+                path = os.path.join(self.tokenizer_folder, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(response.content)
+        logger.info(f"分词器已下载到 {self.tokenizer_folder}")
+
+
+# 全局实例
+token_counter = TokenCounter()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'fetch':
+        token_counter.fetch()
+    else:
+        print("用法: python token_counter.py fetch")
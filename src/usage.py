@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用量统计模块
+按模型和客户端聚合 token 用量与成本，定期写入磁盘
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import Config, ModelConfig
+from logger import logger
+from token_counter import token_counter
+
+# 多进程合并写入时用文件锁互斥，Windows 上没有 fcntl，只支持单进程运行
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+
+# 每条聚合记录包含的计数字段
+USAGE_FIELDS = ('requests', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'cached_tokens', 'cost',
+                'estimated_requests')
+
+
+def estimate_usage(model_config: ModelConfig, messages: List[Dict], completion_text: str) -> dict:
+    """
+    在供应商没有返回用量时，使用模型对应的分词器在本地计数 token 用量
+
+    Args:
+        model_config: 模型配置
+        messages: 请求消息列表
+        completion_text: 模型输出的完整文本
+
+    Returns:
+        dict: 估算的用量信息
+    """
+    prompt_tokens = token_counter.count_messages(messages, model_config)
+    completion_tokens = token_counter.count_text(completion_text, model_config)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens
+    }
+
+
+class UsageTracker:
+    """
+    用量聚合器
+    计数器按键分片，每个分片一把锁，避免所有请求争用同一把全局锁
+    多进程部署时每个 worker 只累计增量，落盘时在文件锁内与磁盘上的总量合并
+    """
+
+    def __init__(self, file_path: str = None, flush_interval: float = None, shard_count: int = 16):
+        self.file_path = file_path or Config.USAGE_FILE
+        self.flush_interval = flush_interval if flush_interval is not None else Config.USAGE_FLUSH_INTERVAL
+        self._shards = [({}, threading.Lock()) for _ in range(shard_count)]
+        self._started_at = time.time()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flush_thread = None
+        self._merge = False
+        self._load()
+
+    def _shard_for(self, key: Tuple[str, str]):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _add(self, key: Tuple[str, str], values: Dict[str, float]):
+        counters, lock = self._shard_for(key)
+        with lock:
+            record = counters.get(key)
+            if record is None:
+                record = counters[key] = dict.fromkeys(USAGE_FIELDS, 0)
+            for field, value in values.items():
+                record[field] += value
+
+    def record(self, model: str, client: str, usage: dict, cost: float = 0.0, estimated: bool = False):
+        """
+        记录一次模型调用的用量
+
+        Args:
+            model: 模型键名
+            client: 客户端标识
+            usage: 用量信息
+            cost: 本次调用成本（美元）
+            estimated: 用量是否为本地估算
+        """
+        values = {
+            'requests': 1,
+            'prompt_tokens': usage.get('prompt_tokens', 0),
+            'completion_tokens': usage.get('completion_tokens', 0),
+            'total_tokens': usage.get('total_tokens', 0),
+            'cached_tokens': usage.get('cached_tokens', 0),
+            'cost': cost,
+            'estimated_requests': 1 if estimated else 0
+        }
+        self._add(('model', model), values)
+        self._add(('client', client or 'unknown'), values)
+
+    def _collect(self, take: bool = False) -> dict:
+        """
+        汇总各分片的计数
+
+        Args:
+            take: 是否在汇总的同时清空分片（多进程模式下取出待合并的增量）
+        """
+        result = {'since': self._started_at, 'models': {}, 'clients': {}}
+        for counters, lock in self._shards:
+            with lock:
+                items = [(key, dict(record)) for key, record in counters.items()]
+                if take:
+                    counters.clear()
+            for (scope, name), record in items:
+                result['models' if scope == 'model' else 'clients'][name] = record
+        return result
+
+    @staticmethod
+    def _merge_into(target: dict, delta: dict):
+        """把 delta 中的计数累加到 target"""
+        for group in ('models', 'clients'):
+            records = target.setdefault(group, {})
+            for name, values in delta.get(group, {}).items():
+                record = records.setdefault(name, dict.fromkeys(USAGE_FIELDS, 0))
+                for field in USAGE_FIELDS:
+                    record[field] = record.get(field, 0) + values.get(field, 0)
+
+    def snapshot(self) -> dict:
+        """获取当前聚合结果，多进程模式下为磁盘上的总量加上本进程尚未落盘的增量"""
+        if not self._merge:
+            return self._collect()
+        result = self._read_file() or {'since': self._started_at, 'models': {}, 'clients': {}}
+        self._merge_into(result, self._collect())
+        return result
+
+    def _read_file(self) -> Optional[dict]:
+        if not os.path.exists(self.file_path):
+            return None
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _load(self):
+        """从磁盘恢复上次的聚合结果"""
+        try:
+            data = self._read_file()
+            if data is None:
+                return
+            self._started_at = data.get('since', self._started_at)
+            for scope, group in (('model', 'models'), ('client', 'clients')):
+                for name, record in data.get(group, {}).items():
+                    self._add((scope, name), {field: record.get(field, 0) for field in USAGE_FIELDS})
+        except Exception as e:
+            logger.warning(f"加载用量统计文件失败: {e}")
+
+    def _write_file(self, data: dict):
+        """先写临时文件再替换，读者不会看到写了一半的文件"""
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.file_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.file_path)
+
+    def _merge_flush(self):
+        """取出本进程的增量，在文件锁内与磁盘上的总量合并后写回"""
+        delta = self._collect(take=True)
+        if not delta['models'] and not delta['clients']:
+            return
+        lock_file = None
+        try:
+            if FCNTL_AVAILABLE:
+                directory = os.path.dirname(self.file_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                lock_file = open(f"{self.file_path}.lock", 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            data = self._read_file() or {'since': self._started_at, 'models': {}, 'clients': {}}
+            self._merge_into(data, delta)
+            self._write_file(data)
+        except Exception:
+            # 写入失败时把增量放回计数器，下次落盘重试
+            for scope, group in (('model', 'models'), ('client', 'clients')):
+                for name, record in delta[group].items():
+                    self._add((scope, name), record)
+            raise
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+    def flush(self):
+        """将聚合结果原子地写入磁盘"""
+        with self._flush_lock:
+            try:
+                if self._merge:
+                    self._merge_flush()
+                else:
+                    self._write_file(self._collect())
+            except Exception as e:
+                logger.error(f"写入用量统计文件失败: {e}")
+
+    def reset_after_fork(self):
+        """
+        在 fork 出的 worker 进程中调用
+        清空从主进程继承的计数（总量已在磁盘上），切换为增量合并模式，重建锁和落盘线程状态
+        """
+        self._shards = [({}, threading.Lock()) for _ in range(len(self._shards))]
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flush_thread = None
+        self._merge = True
+
+    def start(self):
+        """启动后台定期落盘线程"""
+        if self._flush_thread and self._flush_thread.is_alive():
+            return
+        if self.flush_interval <= 0:
+            return
+
+        def run():
+            while not self._stop_event.wait(self.flush_interval):
+                self.flush()
+
+        self._stop_event.clear()
+        self._flush_thread = threading.Thread(target=run, name='usage-flush', daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.flush)
+
+    def stop(self):
+        """停止落盘线程并立即写入一次"""
+        self._stop_event.set()
+        self.flush()
+
+
+# 全局实例
+usage_tracker = UsageTracker()
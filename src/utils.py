@@ -5,9 +5,13 @@
 提供错误处理、重试机制等通用功能
 """
 
+import re
 import time
 import functools
-from typing import Callable, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Callable, Any, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from logger import logger
 
 
@@ -95,8 +99,6 @@ def sanitize_error_message(error_msg: str) -> str:
         str: 清理后的错误消息
     """
     # 移除可能的 API 密钥
-    import re
-    
     # 匹配常见的 API 密钥模式
     patterns = [
         r'sk-[a-zA-Z0-9]{20,}',  # OpenAI 风格
@@ -127,13 +129,7 @@ def format_model_response(response: Any, model_name: str) -> dict:
             content = response.choices[0].message.content
             
             # 获取使用统计信息
-            usage = {}
-            if hasattr(response, 'usage') and response.usage:
-                usage = {
-                    'prompt_tokens': getattr(response.usage, 'prompt_tokens', 0),
-                    'completion_tokens': getattr(response.usage, 'completion_tokens', 0),
-                    'total_tokens': getattr(response.usage, 'total_tokens', 0)
-                }
+            usage = extract_usage(response)
             
             return {
                 'content': content,
@@ -159,6 +155,121 @@ def format_model_response(response: Any, model_name: str) -> dict:
         }
 
 
+def extract_usage(response: Any) -> dict:
+    """
+    从模型响应（或流式响应的最后一个分块）中提取 token 用量
+    
+    Args:
+        response: 模型响应或流式分块
+    
+    Returns:
+        dict: 用量信息，响应中没有用量时返回空字典
+    """
+    usage = getattr(response, 'usage', None)
+    if not usage:
+        return {}
+    
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    total_tokens = getattr(usage, 'total_tokens', 0) or (prompt_tokens + completion_tokens)
+    if not total_tokens:
+        return {}
+    
+    result = {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': total_tokens
+    }
+    # 命中提示词缓存的输入 token 数：OpenAI 兼容接口在 prompt_tokens_details 中返回，
+    # Anthropic 返回 cache_read_input_tokens，DeepSeek 返回 prompt_cache_hit_tokens
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = (
+        (details.get('cached_tokens') if isinstance(details, dict) else getattr(details, 'cached_tokens', None))
+        or getattr(usage, 'cache_read_input_tokens', None)
+        or getattr(usage, 'prompt_cache_hit_tokens', None)
+    )
+    if isinstance(cached_tokens, int) and cached_tokens > 0:
+        result['cached_tokens'] = min(cached_tokens, prompt_tokens)
+    return result
+
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+# 简化的成本表（美元 / 1K tokens，输入、输出单价，参考各平台标价，实际价格可能不同），仅在 litellm 价格表未收录模型时使用
+# 按顺序匹配模型名，本地 Ollama 模型不计费，需排在按模型系列匹配的条目之前
+_FALLBACK_COST_PER_1K_TOKENS = (
+    ('ollama', 0.0, 0.0),
+    ('gpt-4o', 0.0025, 0.01),
+    ('claude-3-sonnet', 0.003, 0.015),
+    ('deepseek-r1', 0.003, 0.007),
+    ('qwen', 0.0006, 0.0017),
+    ('baichuan', 0.002, 0.002),
+)
+
+
+@functools.lru_cache(maxsize=128)
+def _get_cost_rates(model_name: str) -> Optional[Tuple[float, float]]:
+    """
+    获取模型的输入/输出单价（美元 / 1K tokens），结果按模型名缓存
+    litellm 价格表和成本表都没有收录时返回 None，不按猜测的单价计费
+    """
+    known_rates = None
+    try:
+        import litellm
+        known_rates = litellm.cost_per_token(
+            model=model_name, prompt_tokens=1000, completion_tokens=1000
+        )
+        if any(known_rates):
+            return known_rates
+    except Exception:
+        pass
+    
+    lowered = model_name.lower()
+    for model_key, prompt_rate, completion_rate in _FALLBACK_COST_PER_1K_TOKENS:
+        if model_key in lowered:
+            return prompt_rate, completion_rate
+    if known_rates is None:
+        logger.warning(f"模型 {model_name} 没有价格信息，成本记为 0")
+    return known_rates
+
+
+def has_cost_rates(model_name: str) -> bool:
+    """模型是否有价格信息，没有时计算出的成本为 0，应显示为未知"""
+    return _get_cost_rates(model_name) is not None
+
+
+@functools.lru_cache(maxsize=128)
+def _get_cache_read_rate(model_name: str) -> Optional[float]:
+    """
+    获取模型命中提示词缓存部分的输入单价（美元 / 1K tokens），litellm 价格表未收录时返回 None
+    """
+    try:
+        import litellm
+        rate = litellm.get_model_info(model_name).get('cache_read_input_token_cost')
+        if rate is not None:
+            return rate * 1000
+    except Exception:
+        pass
+    return None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    快速估算文本的 token 数
+    中日韩字符按每字 1 个 token 计，其余字符按每 4 个字符 1 个 token 计
+    
+    Args:
+        text: 文本内容
+    
+    Returns:
+        int: 估算的 token 数
+    """
+    if not text:
+        return 0
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    return cjk_chars + (len(text) - cjk_chars + 3) // 4
+
+
 def calculate_cost(usage: dict, model_name: str) -> float:
     """
     计算 API 调用成本（估算）
@@ -168,26 +279,89 @@ def calculate_cost(usage: dict, model_name: str) -> float:
         model_name: 模型名称
     
     Returns:
-        float: 估算成本（美元）
+        float: 估算成本（美元），没有价格信息的模型为 0
     """
-    if not usage or 'total_tokens' not in usage:
+    rates = _get_cost_rates(model_name)
+    if not usage or 'total_tokens' not in usage or rates is None:
         return 0.0
     
-    # 简化的成本计算（实际价格可能不同）
-    cost_per_1k_tokens = {
-        'gpt-4o': 0.03,
-        'claude-3-sonnet': 0.015,
-        'azure/gpt-4o': 0.03,
-        'qwen': 0.002,
-        'baichuan': 0.005
-    }
+    prompt_rate, completion_rate = rates
+    prompt_tokens = usage.get('prompt_tokens', 0)
+    completion_tokens = usage.get('completion_tokens', 0)
     
-    # 查找匹配的模型
-    rate = 0.01  # 默认费率
-    for model_key, model_rate in cost_per_1k_tokens.items():
-        if model_key.lower() in model_name.lower():
-            rate = model_rate
-            break
+    # 没有输入/输出拆分时按总量和平均单价估算
+    if not (prompt_tokens or completion_tokens):
+        return (usage.get('total_tokens', 0) / 1000) * (prompt_rate + completion_rate) / 2
+    
+    # 命中缓存的输入 token 按缓存单价计费，价格表中没有缓存单价时按普通输入单价估算
+    prompt_cost = (prompt_tokens / 1000) * prompt_rate
+    cached_tokens = usage.get('cached_tokens', 0)
+    cached_rate = _get_cache_read_rate(model_name) if cached_tokens else None
+    if cached_rate is not None:
+        prompt_cost -= (cached_tokens / 1000) * (prompt_rate - cached_rate)
     
-    total_tokens = usage.get('total_tokens', 0)
-    return (total_tokens / 1000) * rate
\ No newline at end of file
+    return prompt_cost + (completion_tokens / 1000) * completion_rate
+
+
+class LRUCache:
+    """线程安全的简单 LRU 缓存"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+# 不影响页面内容的跟踪参数，只列出已知的广告和分享跟踪参数：ref、from、source 等通用参数可能决定页面内容，不能去掉
+_TRACKING_PARAMS = {'fbclid', 'gclid', 'msclkid', 'yclid', 'spm'}
+_TRACKING_PREFIXES = ('utm_', 'share_')
+# 移动版和 www 主机名前缀，与桌面版指向同一内容
+_HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'wap.', '3g.')
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    规范化 URL，用于搜索结果去重
+    统一协议和主机名大小写，去掉移动版主机前缀、默认端口、跟踪参数、片段和末尾斜杠，查询参数排序
+
+    Args:
+        url: 原始 URL
+
+    Returns:
+        str: 规范化后的 URL，无法解析时返回去掉首尾空白的原始值
+    """
+    url = (url or '').strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.netloc:
+        return url
+    host = (parts.hostname or '').rstrip('.')
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix) and host.count('.') > 1:
+            host = host[len(prefix):]
+            break
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(_TRACKING_PREFIXES) and key.lower() not in _TRACKING_PARAMS
+    )
+    path = parts.path.rstrip('/')
+    # http 与 https 视为同一页面
+    return urlunsplit(('https', host, path, urlencode(query), ''))
@@ -7,10 +7,21 @@
 
 import os
 import json
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import List, Dict, Any
 from logger import logger
+from config import Config
 from myllm import myllm
+from page_fetcher import page_fetcher
+from rerank import search_reranker
+from search_context import search_context_builder, SearchContext
+from deadline import Deadline
+from shared_cache import shared_cache, make_key
+from timing import RequestTimer, timed
+from utils import canonicalize_url
+from simhash import simhash
 
 # 阿里云IQS相关导入
 try:
@@ -18,13 +29,56 @@ try:
     from alibabacloud_iqs20241111 import models
     from alibabacloud_iqs20241111.client import Client
     from alibabacloud_tea_openapi import models as open_api_models
+    from alibabacloud_tea_util import models as util_models
     KUAKE_AVAILABLE = True
 except ImportError:
     KUAKE_AVAILABLE = False
     logger.warning("阿里云IQS SDK未安装，将仅支持Bing搜索")
 
+# 提供给支持工具调用的模型的联网搜索工具（OpenAI function calling 格式）
+SEARCH_TOOL = {
+    'type': 'function',
+    'function': {
+        'name': 'web_search',
+        'description': '联网搜索最新信息。问题涉及新闻、价格、天气、近期事件、实时数据或你不确定的事实时调用；'
+                       '翻译、改写、写作、编程、计算等不需要外部信息的问题不要调用。',
+        'parameters': {
+            'type': 'object',
+            'properties': {
+                'queries': {
+                    'type': 'array',
+                    'items': {'type': 'string'},
+                    'description': '2-4 个简洁的搜索关键词或短语，涉及时间的问题请包含时间词'
+                }
+            },
+            'required': ['queries']
+        }
+    }
+}
+
+SEARCH_TOOL_NAME = SEARCH_TOOL['function']['name']
+
+# 联网回答的固定要求，作为系统消息放在消息列表最前面；每次请求内容不变，
+# 供应商可以缓存这一前缀（以及其后的会话历史），只有搜索结果和问题需要重新处理
+SEARCH_SYSTEM_PROMPT = """你是一个专业的AI助手，能够基于最新的网络信息为用户提供准确、全面的回答。
+
+用户消息中会先给出联网搜索结果，然后是用户问题。请基于搜索结果，为用户提供详细、准确的回答。要求：
+
+1. **信息整合**：综合多个搜索结果中的信息，提供全面的回答
+2. **时效性**：优先使用最新的信息，如果涉及时间敏感话题请特别注意
+3. **准确性**：确保信息的准确性，如有不确定的地方请明确说明
+4. **结构化**：使用清晰的结构组织回答，包括要点、详细说明等
+5. **引用来源**：在回答中适当引用搜索结果的来源，增加可信度
+6. **客观性**：保持客观中立的态度，避免主观臆断
+
+如果搜索结果与用户问题不够匹配，请基于你的知识库提供回答，并说明信息来源的局限性。"""
+
+
 class WebSearchTool:
-    def __init__(self):
+    def __init__(self, cache=None):
+        # 各关键词的搜索结果缓存在所有 worker 共享的缓存中
+        self.cache = cache or shared_cache
+        
         # Bing搜索配置
         self.bing_api_key = os.getenv('BING_SEARCH_API_KEY')
         self.bing_search_url = "https://api.bing.microsoft.com/v7.0/search"
@@ -38,6 +92,24 @@ class WebSearchTool:
         
         # 验证配置
         self._validate_config()
+        self._create_workers()
+    
+    def _create_workers(self):
+        """创建并行搜索线程池"""
+        self._executor = ThreadPoolExecutor(max_workers=Config.SEARCH_WORKERS, thread_name_prefix='web-search')
+    
+    def reset_after_fork(self):
+        """在 fork 出的 worker 进程中调用，重新创建线程池"""
+        self._create_workers()
+    
+    def available_engines(self) -> List[str]:
+        """已配置密钥的搜索引擎"""
+        engines = []
+        if self.bing_api_key:
+            engines.append('bing')
+        if KUAKE_AVAILABLE and self.aliyun_access_key_id and self.aliyun_access_key_secret:
+            engines.append('kuake')
+        return engines
         
     def _validate_config(self):
         """验证搜索引擎配置"""
@@ -67,9 +139,10 @@ class WebSearchTool:
         config.endpoint = 'iqs.cn-zhangjiakou.aliyuncs.com'
         return Client(config)
         
-    def extract_search_keywords(self, user_query: str) -> List[str]:
+    def extract_search_keywords(self, user_query: str, deadline: Deadline = None) -> List[str]:
         """
         使用LLM分析用户意图并提取搜索关键词
+        超时或失败时直接使用原始问题作为关键词
         """
         intent_analysis_prompt = f"""
 你是一个专业的搜索意图分析助手。请分析用户的查询意图，并提取出最适合进行网络搜索的关键词。
@@ -94,10 +167,14 @@ class WebSearchTool:
         """
         
         try:
+            keyword_deadline = (deadline or Deadline(Config.KEYWORD_EXTRACTION_TIMEOUT)).child(
+                cap=Config.KEYWORD_EXTRACTION_TIMEOUT
+            )
             keywords_text = myllm.simple_completion(
                 prompt=intent_analysis_prompt,
                 max_tokens=100,
-                temperature=0.3
+                temperature=0.3,
+                deadline=keyword_deadline
             )
             keywords = [kw.strip() for kw in keywords_text.split(',') if kw.strip()]
             
@@ -109,13 +186,67 @@ class WebSearchTool:
             # 回退方案：简单分词
             return [user_query]
     
-    def search_bing(self, keywords: List[str], max_results: int = 5) -> List[Dict[str, Any]]:
+    def _cache_key(self, engine: str, keyword: str) -> str:
+        return make_key('search', engine, keyword, Config.SEARCH_RESULTS_PER_KEYWORD, Config.IQS_MAIN_TEXT)
+    
+    def _cached_results(self, engine: str, keyword: str):
+        """读取关键词的缓存搜索结果，未命中时返回 None"""
+        if Config.SEARCH_CACHE_TTL <= 0:
+            return None
+        results = self.cache.get(self._cache_key(engine, keyword))
+        if results is not None:
+            logger.debug(f"搜索关键词 '{keyword}' 命中缓存")
+        return results
+    
+    def _cache_results(self, engine: str, keyword: str, results: List[Dict[str, Any]]):
+        """缓存关键词的搜索结果，空结果不缓存"""
+        if Config.SEARCH_CACHE_TTL > 0 and results:
+            self.cache.set(self._cache_key(engine, keyword), results, Config.SEARCH_CACHE_TTL)
+    
+    @staticmethod
+    def _merge_results(search_results: List[Dict[str, Any]], max_results: int) -> List[Dict[str, Any]]:
+        """
+        合并多个关键词（及多个引擎）的搜索结果
+        按关键词轮流选取并按规范化后的 URL 去重，使每个关键词都能贡献候选结果
+        """
+        by_keyword = {}
+        for result in search_results:
+            by_keyword.setdefault((result.get('engine'), result.get('keyword')), []).append(result)
+        
+        unique_results = []
+        seen_urls = set()
+        queues = list(by_keyword.values())
+        position = 0
+        while queues and len(unique_results) < max_results:
+            for queue in queues:
+                if position < len(queue):
+                    result = queue[position]
+                    url = canonicalize_url(result['url'])
+                    if url and url not in seen_urls:
+                        unique_results.append(result)
+                        seen_urls.add(url)
+                        if len(unique_results) >= max_results:
+                            break
+            position += 1
+            queues = [queue for queue in queues if position < len(queue)]
+        
+        return unique_results
+    
+    def search_bing(self, keywords: List[str], max_results: int = 5, deadline: Deadline = None) -> List[Dict[str, Any]]:
         """
         使用Bing搜索API获取搜索结果
+        到达截止时间后跳过剩余关键词，返回已获取的部分结果
         """
         search_results = []
         
-        for keyword in keywords:
+        for index, keyword in enumerate(keywords):
+            cached = self._cached_results('bing', keyword)
+            if cached is not None:
+                search_results.extend(cached)
+                continue
+            if deadline is not None and deadline.expired:
+                logger.warning(f"搜索超过截止时间，跳过剩余关键词: {keywords[index:]}")
+                break
             try:
                 headers = {
                     'Ocp-Apim-Subscription-Key': self.bing_api_key,
@@ -124,7 +255,7 @@ class WebSearchTool:
                 
                 params = {
                     'q': keyword,
-                    'count': max_results,
+                    'count': Config.SEARCH_RESULTS_PER_KEYWORD,
                     'offset': 0,
                     'mkt': 'zh-CN',
                     'safesearch': 'Moderate'
@@ -134,19 +265,24 @@ class WebSearchTool:
                     self.bing_search_url,
                     headers=headers,
                     params=params,
-                    timeout=10
+                    timeout=deadline.timeout(Config.SEARCH_REQUEST_TIMEOUT) if deadline else Config.SEARCH_REQUEST_TIMEOUT
                 )
                 
                 if response.status_code == 200:
                     data = response.json()
+                    keyword_results = []
                     if 'webPages' in data and 'value' in data['webPages']:
-                        for item in data['webPages']['value'][:max_results]:
-                            search_results.append({
+                        for item in data['webPages']['value'][:Config.SEARCH_RESULTS_PER_KEYWORD]:
+                            keyword_results.append({
                                 'title': item.get('name', ''),
                                 'url': item.get('url', ''),
                                 'snippet': item.get('snippet', ''),
-                                'keyword': keyword
+                                'keyword': keyword,
+                                # 近似重复检测用的指纹随结果一起缓存
+                                'simhash': simhash(item.get('snippet', ''))
                             })
+                    search_results.extend(keyword_results)
+                    self._cache_results('bing', keyword, keyword_results)
                 else:
                     logger.warning(f"Bing搜索失败，状态码: {response.status_code}")
                     
@@ -155,28 +291,26 @@ class WebSearchTool:
                 continue
         
         # 去重并限制结果数量
-        unique_results = []
-        seen_urls = set()
-        
-        for result in search_results:
-            if result['url'] not in seen_urls:
-                unique_results.append(result)
-                seen_urls.add(result['url'])
-                
-                if len(unique_results) >= max_results:
-                    break
+        unique_results = self._merge_results(search_results, max_results)
         
         logger.info(f"获取到 {len(unique_results)} 条搜索结果")
         return unique_results
     
-    def search_kuake(self, keywords: List[str], max_results: int = 5) -> List[Dict[str, Any]]:
+    def search_kuake(self, keywords: List[str], max_results: int = 5, deadline: Deadline = None) -> List[Dict[str, Any]]:
         """使用阿里云IQS搜索API获取搜索结果"""
         search_results = []
         
         try:
             client = self._create_kuake_client()
             
-            for keyword in keywords:
+            for index, keyword in enumerate(keywords):
+                cached = self._cached_results('kuake', keyword)
+                if cached is not None:
+                    search_results.extend(cached)
+                    continue
+                if deadline is not None and deadline.expired:
+                    logger.warning(f"搜索超过截止时间，跳过剩余关键词: {keywords[index:]}")
+                    break
                 try:
                     request = models.UnifiedSearchRequest(
                         body=models.UnifiedSearchInput(
@@ -184,23 +318,38 @@ class WebSearchTool:
                             time_range='NoLimit',
                             contents=models.RequestContents(
                                 summary=True,
-                                main_text=True,
+                                # 正文由页面抓取阶段按需获取，IQS 返回全文需显式开启
+                                main_text=Config.IQS_MAIN_TEXT,
                             )
                         )
                     )
                     
-                    response = client.unified_search(request)
+                    timeout = deadline.timeout(Config.SEARCH_REQUEST_TIMEOUT) if deadline else Config.SEARCH_REQUEST_TIMEOUT
+                    runtime = util_models.RuntimeOptions(
+                        read_timeout=int(timeout * 1000),
+                        connect_timeout=int(min(timeout, 3) * 1000),
+                        autoretry=False
+                    )
+                    response = client.unified_search_with_options(request, {}, runtime)
                     
+                    keyword_results = []
                     if response.body and response.body.page_items:
-                        for item in response.body.page_items[:max_results]:
-                            search_results.append({
+                        for item in response.body.page_items[:Config.SEARCH_RESULTS_PER_KEYWORD]:
+                            result = {
                                 'title': item.title or '',
                                 'url': item.link or '',
                                 'snippet': item.snippet or item.summary or '',
                                 'keyword': keyword,
                                 'published_time': item.published_time or '',
                                 'rerank_score': getattr(item, 'rerank_score', None)
-                            })
+                            }
+                            result['simhash'] = simhash(result['snippet'])
+                            if Config.IQS_MAIN_TEXT and item.main_text:
+                                result['content'] = item.main_text[:Config.PAGE_MAX_CHARS]
+                                result['content_simhash'] = simhash(result['content'])
+                            keyword_results.append(result)
+                    search_results.extend(keyword_results)
+                    self._cache_results('kuake', keyword, keyword_results)
                             
                 except TeaException as e:
                     logger.error(f"阿里云IQS搜索关键词 '{keyword}' 失败: {e.code} - {e.data.get('message', '')}")
@@ -214,110 +363,190 @@ class WebSearchTool:
             return []
         
         # 去重并限制结果数量
-        unique_results = []
-        seen_urls = set()
-        
-        for result in search_results:
-            if result['url'] and result['url'] not in seen_urls:
-                unique_results.append(result)
-                seen_urls.add(result['url'])
-                
-                if len(unique_results) >= max_results:
-                    break
+        unique_results = self._merge_results(search_results, max_results)
         
         logger.info(f"阿里云IQS获取到 {len(unique_results)} 条搜索结果")
         return unique_results
     
-    def search(self, keywords: List[str], max_results: int = 5, engine: str = None) -> List[Dict[str, Any]]:
-        """统一搜索接口，根据配置选择搜索引擎"""
+    def search_parallel(self, keywords: List[str], max_results: int = 5,
+                        deadline: Deadline = None) -> List[Dict[str, Any]]:
+        """
+        在所有已配置的搜索引擎上并发搜索每个关键词
+        去重后的结果达到 SEARCH_FIRST_K 条、已有结果且等待超过 SEARCH_MERGE_TIMEOUT 秒或到达截止时间时立即返回，
+        未完成的请求在后台继续执行并写入缓存；单个引擎出错或超时不影响其他引擎的结果
+        """
+        engines = self.available_engines()
+        if not engines:
+            logger.error("没有可用的搜索引擎")
+            return []
+        engine_search = {'bing': self.search_bing, 'kuake': self.search_kuake}
+        futures = {}
+        for engine in engines:
+            for keyword in keywords:
+                future = self._executor.submit(
+                    engine_search[engine], [keyword], Config.SEARCH_RESULTS_PER_KEYWORD, deadline
+                )
+                futures[future] = engine
+        
+        started = time.monotonic()
+        search_results = []
+        seen_urls = set()
+        pending = set(futures)
+        while pending:
+            timeout = deadline.remaining() if deadline else Config.SEARCH_REQUEST_TIMEOUT
+            if seen_urls:
+                timeout = min(timeout, Config.SEARCH_MERGE_TIMEOUT - (time.monotonic() - started))
+            if timeout <= 0:
+                break
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.warning(f"{futures[future]} 搜索失败: {e}")
+                    continue
+                for result in results:
+                    url = canonicalize_url(result.get('url'))
+                    if url and result.get('title'):
+                        seen_urls.add(url)
+                    search_results.append({**result, 'engine': futures[future]})
+            if len(seen_urls) >= Config.SEARCH_FIRST_K:
+                break
+        
+        unique_results = self._merge_results(search_results, max_results)
+        logger.info(
+            f"并行搜索 {'/'.join(engines)}: 完成 {len(futures) - len(pending)}/{len(futures)} 个请求，"
+            f"获取到 {len(unique_results)} 条搜索结果"
+        )
+        return unique_results
+    
+    def search(self, keywords: List[str], max_results: int = 5, engine: str = None,
+               deadline: Deadline = None) -> List[Dict[str, Any]]:
+        """统一搜索接口，根据配置选择搜索引擎，parallel 模式下同时查询所有引擎"""
+        if engine is None and Config.SEARCH_ENGINE_MODE == 'parallel':
+            return self.search_parallel(keywords, max_results, deadline)
         search_engine = engine or self.default_search_engine
         
         if search_engine == 'kuake' and KUAKE_AVAILABLE:
-            return self.search_kuake(keywords, max_results)
+            return self.search_kuake(keywords, max_results, deadline)
         elif search_engine == 'bing':
-            return self.search_bing(keywords, max_results)
+            return self.search_bing(keywords, max_results, deadline)
         else:
             # 回退到可用的搜索引擎
             if self.bing_api_key:
                 logger.info("回退到Bing搜索")
-                return self.search_bing(keywords, max_results)
+                return self.search_bing(keywords, max_results, deadline)
             elif KUAKE_AVAILABLE and self.aliyun_access_key_id:
                 logger.info("回退到阿里云IQS搜索")
-                return self.search_kuake(keywords, max_results)
+                return self.search_kuake(keywords, max_results, deadline)
             else:
                 logger.error("没有可用的搜索引擎")
                 return []
      
-    def format_search_context(self, search_results: List[Dict[str, Any]]) -> str:
+    def format_search_context(self, search_results: List[Dict[str, Any]], model_config=None) -> str:
         """
         格式化搜索结果为上下文信息
         """
-        if not search_results:
-            return "未找到相关的网络搜索结果。"
-        
-        context = "以下是相关的网络搜索结果：\n\n"
-        
-        for i, result in enumerate(search_results, 1):
-            context += f"【搜索结果 {i}】\n"
-            context += f"标题：{result['title']}\n"
-            context += f"摘要：{result['snippet']}\n"
-            context += f"来源：{result['url']}\n\n"
-        
-        return context
+        return search_context_builder.build(search_results, model_config).text
     
 
     
     def create_enhanced_prompt(self, user_query: str, search_context: str) -> str:
         """
         创建增强的提示词，结合用户查询和搜索结果
+        固定的回答要求在 SEARCH_SYSTEM_PROMPT 中作为系统消息发送，这里只包含每次请求都不同的部分
         """
-        enhanced_prompt = f"""
-你是一个专业的AI助手，能够基于最新的网络信息为用户提供准确、全面的回答。
-
-用户问题：{user_query}
-
-{search_context}
-
-请基于以上搜索结果，为用户提供详细、准确的回答。要求：
-
-1. **信息整合**：综合多个搜索结果中的信息，提供全面的回答
-2. **时效性**：优先使用最新的信息，如果涉及时间敏感话题请特别注意
-3. **准确性**：确保信息的准确性，如有不确定的地方请明确说明
-4. **结构化**：使用清晰的结构组织回答，包括要点、详细说明等
-5. **引用来源**：在回答中适当引用搜索结果的来源，增加可信度
-6. **客观性**：保持客观中立的态度，避免主观臆断
-
-如果搜索结果与用户问题不够匹配，请基于你的知识库提供回答，并说明信息来源的局限性。
+        return f"{search_context}\n\n用户问题：{user_query}"
+    
+    def retrieve(self, user_query: str, keywords: List[str], model_key: str = None,
+                 search_deadline: Deadline = None, timer: RequestTimer = None) -> SearchContext:
+        """
+        按关键词检索并构建搜索上下文：搜索、按原始问题重排序、抓取正文、按模型 token 预算拼接
+        """
+        search_deadline = search_deadline or Deadline.from_request().child(Config.SEARCH_DEADLINE_SHARE)
+        
+        # 执行搜索，多取一些候选结果
+        with timed(timer, 'search'):
+            search_results = self.search(keywords, max_results=Config.SEARCH_CANDIDATES, deadline=search_deadline)
+        
+        # 按原始问题在本地重排序，只保留最相关的几条
+        with timed(timer, 'rerank'):
+            search_results = search_reranker.rerank(user_query, search_results, Config.SEARCH_TOP_K, search_deadline)
+        
+        # 并发抓取排名靠前结果的正文，没有剩余时间时只使用摘要
+        if search_deadline.expired:
+            logger.warning("联网查询超过截止时间，跳过正文抓取")
+        else:
+            with timed(timer, 'fetch'):
+                page_fetcher.enrich_results(
+                    search_results, timeout=search_deadline.timeout(page_fetcher.page_timeout + 1)
+                )
+        
+        # 按目标模型的 token 预算构建搜索上下文
+        model_config = myllm.get_model_config(model_key) if model_key else None
+        with timed(timer, 'prompt'):
+            search_context = search_context_builder.build(search_results, model_config)
+        logger.info(
+            f"搜索上下文: {len(search_context.results)} 条结果, "
+            f"{search_context.tokens} tokens, 丢弃 {search_context.dropped} 条"
+        )
+        return search_context
+    
+    def run_search_tool(self, name: str, arguments: Dict[str, Any], user_query: str, model_key: str = None,
+                        deadline: Deadline = None, timer: RequestTimer = None) -> tuple[str, Dict[str, Any]]:
+        """
+        执行模型发起的 web_search 工具调用
+        关键词由模型在回答时直接给出，省去单独的意图分析调用
 
-请开始回答：
+        Returns:
+            tuple: (返回给模型的工具结果, 发给前端的摘要)
         """
+        if name != SEARCH_TOOL_NAME:
+            raise ValueError(f"未知工具: {name}")
+        queries = arguments.get('queries') or arguments.get('query') or [user_query]
+        if isinstance(queries, str):
+            queries = [queries]
+        keywords = [str(query).strip() for query in queries if str(query).strip()][:4] or [user_query]
+        logger.info(f"模型调用联网搜索工具，关键词: {keywords}")
         
-        return enhanced_prompt
+        search_deadline = (deadline or Deadline.from_request()).child(Config.SEARCH_DEADLINE_SHARE)
+        search_context = self.retrieve(user_query, keywords, model_key, search_deadline, timer)
+        if not search_context.results:
+            return '没有找到相关的搜索结果，请基于已有知识回答，并说明缺少最新信息。', {'queries': keywords, 'results': 0}
+        content = (f"{search_context.text}\n\n"
+                   "请基于以上搜索结果回答用户问题：综合多个来源，优先使用最新信息，并在回答中注明引用的来源。")
+        return content, {'queries': keywords, 'results': len(search_context.results)}
     
-    def perform_web_search(self, user_query: str) -> tuple[str, List[Dict[str, Any]]]:
+    def perform_web_search(self, user_query: str, model_key: str = None,
+                           deadline: Deadline = None,
+                           timer: RequestTimer = None) -> tuple[str, List[Dict[str, Any]], bool]:
         """
         执行完整的联网查询流程
-        返回增强的提示词和搜索结果
+        返回 (增强的提示词, 实际写入上下文的搜索结果, 是否写入了搜索结果)；
+        写入了搜索结果时增强的提示词需要与系统消息 SEARCH_SYSTEM_PROMPT 一起发送，
+        查询失败或没有结果时不应发送该系统消息（其中说明了后面附有搜索结果）
+        指定 deadline 时整个流程最多占用剩余时间的 SEARCH_DEADLINE_SHARE，
+        超时的阶段被跳过，使用已获得的部分结果（或不使用搜索结果）继续回答
+        指定 timer 时记录各阶段耗时
         """
+        search_deadline = (deadline or Deadline.from_request()).child(Config.SEARCH_DEADLINE_SHARE)
         try:
             # 1. 提取搜索关键词
-            keywords = self.extract_search_keywords(user_query)
-            
-            # 2. 执行搜索
-            search_results = self.search(keywords)
+            with timed(timer, 'keywords'):
+                keywords = self.extract_search_keywords(user_query, search_deadline)
             
-            # 3. 格式化搜索上下文
-            search_context = self.format_search_context(search_results)
+            # 2-5. 搜索、重排序、抓取正文并构建搜索上下文
+            search_context = self.retrieve(user_query, keywords, model_key, search_deadline, timer)
             
-            # 4. 创建增强提示词
-            enhanced_prompt = self.create_enhanced_prompt(user_query, search_context)
+            # 6. 创建增强提示词
+            enhanced_prompt = self.create_enhanced_prompt(user_query, search_context.text)
             
-            return enhanced_prompt, search_results
+            return enhanced_prompt, search_context.results, bool(search_context.results)
             
         except Exception as e:
             logger.error(f"联网查询失败: {e}")
             # 返回原始查询作为回退
-            return user_query, []
+            return user_query, [], False
 
 # 全局实例
 web_search_tool = WebSearchTool()
\ No newline at end of file
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WSGI 入口
+生产环境使用 gunicorn 加载：cd src && gunicorn -c gunicorn.conf.py wsgi:app
+多进程相关的初始化（fork 后重建资源、后台任务、退出时落盘）在 gunicorn.conf.py 的钩子中完成
+"""
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+from config import Config
+from app import app
+
+# 部署在反向代理之后时从 X-Forwarded-* 头恢复真实客户端地址，按客户端统计的用量依赖它
+if Config.PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=Config.PROXY_COUNT, x_proto=Config.PROXY_COUNT,
+                            x_host=Config.PROXY_COUNT)
+
+application = app
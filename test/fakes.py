@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试共用的假对象
+模型配置、流式分块和不访问网络的 MyLLM 子类，供模型回退、对比模式和工具调用等测试使用
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import ModelConfig
+from myllm import MyLLM
+
+
+def make_model(name, provider='openai', **kwargs) -> ModelConfig:
+    """创建测试用模型配置"""
+    return ModelConfig(name=name, display_name=name, provider=provider,
+                       model_name=f'{provider}/{name}', api_key_env='TEST_API_KEY', **kwargs)
+
+
+def make_chunk(text=None, tool_calls=None):
+    """创建与 litellm 流式分块结构相同的对象"""
+    delta = SimpleNamespace(content=text, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+def make_tool_delta(index, arguments, call_id=None, name=None):
+    """创建工具调用片段"""
+    return SimpleNamespace(index=index, id=call_id,
+                           function=SimpleNamespace(name=name, arguments=arguments))
+
+
+class FakeLLM(MyLLM):
+    """
+    不访问网络的 MyLLM
+    跳过连接和缓存的初始化，记录每次调用（model_key、messages、kwargs），由子类的 respond 返回流式分块
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def completion(self, model_key, messages, stream=False, deadline=None, **kwargs):
+        self.requests.append(SimpleNamespace(model_key=model_key, messages=messages, kwargs=kwargs))
+        return self.respond(model_key, messages, **kwargs)
+
+    def respond(self, model_key, messages, **kwargs):
+        raise NotImplementedError
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试会话存储功能
+测试消息分页、按 token 预算和目标模型的剩余上下文裁剪上下文，以及问答成对写入
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import Config, ModelConfig
+from conversation_store import ConversationStore
+from token_counter import token_counter
+
+
+def make_store(tmp_dir):
+    return ConversationStore(db_path=os.path.join(tmp_dir, 'conversations.db'))
+
+
+def test_pagination():
+    """测试从最新消息往前分页"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = make_store(tmp_dir)
+        conversation_id = store.create_conversation('测试')
+        for i in range(5):
+            store.add_message(conversation_id, 'user' if i % 2 == 0 else 'assistant', f"消息{i}")
+
+        page = store.get_messages(conversation_id, limit=2)
+        assert [message['content'] for message in page['messages']] == ['消息3', '消息4']
+        assert page['next_before'] is not None
+
+        page = store.get_messages(conversation_id, limit=10, before_id=page['next_before'])
+        assert [message['content'] for message in page['messages']] == ['消息0', '消息1', '消息2']
+        assert page['next_before'] is None
+        store.close()
+
+
+def test_build_context_trims_to_budget():
+    """测试上下文裁剪只保留预算内最新的消息，且以用户消息开头"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = make_store(tmp_dir)
+        conversation_id = store.create_conversation()
+        for i in range(10):
+            store.add_message(conversation_id, 'user', f"问题{i}" * 10)
+            store.add_message(conversation_id, 'assistant', f"回答{i}" * 10, 'qwq')
+
+        context = store.build_context(conversation_id, max_tokens=90)
+        assert context[0]['role'] == 'user'
+        assert context[-1]['content'] == "回答9" * 10
+        assert len(context) == 2
+
+        assert store.build_context(conversation_id, max_tokens=100000, max_messages=4)[0]['content'] == "问题8" * 10
+        assert store.build_context('missing') == []
+        store.close()
+
+
+def test_build_context_uses_model_budget():
+    """测试按模型上下文长度减去预留部分裁剪历史"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = make_store(tmp_dir)
+        conversation_id = store.create_conversation()
+        for i in range(10):
+            store.add_exchange(conversation_id, f"问题{i}" * 10, f"回答{i}" * 10, 'qwq')
+
+        model_config = ModelConfig(name='test', display_name='test', provider='openai', model_name='openai/test',
+                                   api_key_env='TEST_API_KEY', context_window=1090)
+        context = store.build_context(conversation_id, model_config=model_config, reserved_tokens=1000)
+        assert [message['content'] for message in context] == ["问题9" * 10, "回答9" * 10]
+        model_config.context_window = 100000
+        assert len(store.build_context(conversation_id, model_config=model_config, reserved_tokens=1000)) == 20
+
+        # 长上下文模型的历史预算仍不超过 HISTORY_MAX_TOKENS
+        original = Config.HISTORY_MAX_TOKENS
+        Config.HISTORY_MAX_TOKENS = 100
+        try:
+            context = store.build_context(conversation_id, model_config=model_config, reserved_tokens=1000)
+        finally:
+            Config.HISTORY_MAX_TOKENS = original
+        assert token_counter.count_messages(context, model_config) <= 100 and len(context) == 2
+        store.close()
+
+
+def test_add_exchange_keeps_turns_paired():
+    """测试问答在同一事务中写入，用户消息后紧跟助手回答"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = make_store(tmp_dir)
+        conversation_id = store.create_conversation()
+        store.add_exchange(conversation_id, '你好', '你好！', 'qwq')
+        messages = store.get_messages(conversation_id)['messages']
+        assert [(message['role'], message['model']) for message in messages] == [('user', None), ('assistant', 'qwq')]
+        store.close()
+
+
+if __name__ == "__main__":
+    test_pagination()
+    test_build_context_trims_to_budget()
+    test_build_context_uses_model_budget()
+    test_add_exchange_keeps_turns_paired()
+    print("测试完成!")
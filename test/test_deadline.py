@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试请求截止时间功能
+测试剩余时间计算、子阶段预算和超时后搜索降级
+"""
+
+import os
+import sys
+import time
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import Config
+from deadline import Deadline, DeadlineExceeded
+from web_search import WebSearchTool
+
+
+def test_from_request_clamps_to_max():
+    """测试客户端指定的截止时间不超过配置上限"""
+    assert Deadline.from_request(Config.MAX_REQUEST_DEADLINE * 10).seconds == Config.MAX_REQUEST_DEADLINE
+    assert Deadline.from_request('abc').seconds == Config.REQUEST_DEADLINE
+    assert Deadline.from_request('nan').seconds == Config.REQUEST_DEADLINE
+    assert Deadline.from_request(float('inf')).seconds == Config.REQUEST_DEADLINE
+    assert Deadline.from_request(5).seconds == 5
+
+
+def test_timeout_and_child():
+    """测试阶段超时取剩余时间与阶段上限的较小值"""
+    deadline = Deadline(10)
+    assert deadline.timeout(3) == 3
+    assert 4.9 < deadline.child(0.5).remaining() <= 5
+    assert deadline.child(cap=1).remaining() <= 1
+
+
+def test_expired_deadline_raises():
+    """测试过期后计算超时抛出 DeadlineExceeded"""
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert deadline.expired
+    try:
+        deadline.timeout()
+        assert False, "应抛出 DeadlineExceeded"
+    except DeadlineExceeded:
+        pass
+
+
+def test_search_skips_keywords_after_deadline():
+    """测试截止时间过后不再发起搜索请求"""
+    deadline = Deadline(0.01)
+    time.sleep(0.02)
+    assert WebSearchTool().search_bing(['a', 'b'], deadline=deadline) == []
+
+
+if __name__ == "__main__":
+    test_from_request_clamps_to_max()
+    test_timeout_and_child()
+    test_expired_deadline_raises()
+    test_search_skips_keywords_after_deadline()
+    print("测试完成!")
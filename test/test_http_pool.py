@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试上游 HTTP 连接池功能
+测试按主机共享连接池、注入 litellm 的客户端和连接池统计
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import ModelConfig
+from http_pool import ConnectionPoolManager, pool_key
+
+
+def _model(provider, base_url=None):
+    return ModelConfig(name='test', display_name='Test', provider=provider,
+                       model_name=f'{provider}/test', api_key_env='TEST_API_KEY', base_url=base_url)
+
+
+def test_pool_key():
+    """测试同一主机的不同路径使用同一个连接池"""
+    assert pool_key('https://DashScope.aliyuncs.com/compatible-mode/v1') == 'https://dashscope.aliyuncs.com'
+    assert pool_key('http://localhost:11434/api/chat') == 'http://localhost:11434'
+
+
+def test_clients_share_pool():
+    """测试 openai 客户端和 HTTPHandler 复用同一主机的连接池"""
+    pools = ConnectionPoolManager()
+    base_url = 'https://example.com/v1'
+    openai_client = pools.get_litellm_client(_model('openai', base_url), 'key')
+    assert openai_client is pools.get_litellm_client(_model('openai', base_url), 'key')
+    assert openai_client._client is pools.get_client('https://example.com/other')
+
+    handler = pools.get_litellm_client(_model('ollama', 'http://localhost:11434'))
+    assert handler.client is pools.get_client('http://localhost:11434')
+
+    metrics = pools.metrics()
+    assert set(metrics) == {'https://example.com', 'http://localhost:11434'}
+    assert metrics['https://example.com']['connections'] == 0
+    pools.close()
+
+
+if __name__ == "__main__":
+    test_pool_key()
+    test_clients_share_pool()
+    print("测试完成!")
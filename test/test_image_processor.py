@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试图片处理功能
+测试大小和像素数限制、按文件头识别类型、缩放、按 (内容哈希, 最长边) 缓存以及小图片原样发送
+"""
+
+import io
+import os
+import sys
+import base64
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from PIL import Image
+from image_processor import ImageProcessor, ImageTooLargeError
+
+
+def _image_bytes(size, image_format='PNG'):
+    output = io.BytesIO()
+    Image.new('RGB', size, (200, 100, 50)).save(output, format=image_format)
+    return output.getvalue()
+
+
+def _decode(data_url):
+    header, encoded = data_url.split(',', 1)
+    return header, base64.b64decode(encoded)
+
+
+def _expect_error(error_type, function, *args):
+    try:
+        function(*args)
+    except error_type:
+        return
+    assert False, f'应当抛出 {error_type.__name__}'
+
+
+def test_size_and_pixel_limits():
+    """测试超过字节数或像素数限制的图片被拒绝"""
+    data = _image_bytes((64, 64))
+    _expect_error(ImageTooLargeError, ImageProcessor(max_bytes=len(data) - 1).process, io.BytesIO(data), 1024)
+    _expect_error(ImageTooLargeError, ImageProcessor(max_pixels=64 * 64 - 1).process, io.BytesIO(data), 1024)
+
+
+def test_oversized_data_url_rejected_before_decoding():
+    """测试 data URL 按编码长度拒绝，超大图片不会被解码"""
+    processor = ImageProcessor(max_bytes=1000)
+    data_url = 'data:image/png;base64,' + 'A' * 4000
+    original = base64.b64decode
+    base64.b64decode = lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError('不应解码'))
+    try:
+        _expect_error(ImageTooLargeError, processor.process_data_url, data_url, 1024)
+    finally:
+        base64.b64decode = original
+
+
+def test_spoofed_mime_type_rejected():
+    """测试按文件头识别类型，不信任 data URL 中声明的类型"""
+    data_url = 'data:image/png;base64,' + base64.b64encode(b'<html>not an image</html>').decode()
+    _expect_error(ValueError, ImageProcessor().process_data_url, data_url, 1024)
+
+
+def test_downscale_to_max_side():
+    """测试大图缩放到最长边不超过 max_side，并重新编码为 JPEG"""
+    data_url = ImageProcessor().process(io.BytesIO(_image_bytes((400, 200), 'JPEG')), 100)
+    header, data = _decode(data_url)
+    assert header == 'data:image/jpeg;base64'
+    assert Image.open(io.BytesIO(data)).size == (100, 50)
+
+
+def test_small_image_passed_through():
+    """测试已在目标尺寸之内的图片原样发送，不重新编码"""
+    data = _image_bytes((50, 40))
+    header, output = _decode(ImageProcessor().process(io.BytesIO(data), 100))
+    assert header == 'data:image/png;base64' and output == data
+
+
+def test_cache_keyed_by_hash_and_max_side():
+    """测试同一图片和最长边只处理一次，最长边不同时重新处理"""
+    processor = ImageProcessor()
+    calls = []
+    encode = processor._encode
+    processor._encode = lambda stream, mime_type, max_side: calls.append(max_side) or encode(stream, mime_type, max_side)
+    data = _image_bytes((300, 300))
+
+    first = processor.process(io.BytesIO(data), 100)
+    assert processor.process(io.BytesIO(data), 100) == first
+    assert calls == [100]
+    processor.process(io.BytesIO(data), 200)
+    assert calls == [100, 200]
+
+
+if __name__ == "__main__":
+    test_size_and_pixel_limits()
+    test_oversized_data_url_rejected_before_decoding()
+    test_spoofed_mime_type_rejected()
+    test_downscale_to_max_side()
+    test_small_image_passed_through()
+    test_cache_keyed_by_hash_and_max_side()
+    print("测试完成!")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试模型回退功能
+测试续写消息构建和流式输出中途失败后切换备用模型
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from myllm import MyLLM, FallbackStream, ModelSwitch, chunk_text
+from fakes import FakeLLM, make_model, make_chunk
+
+
+class BreakingLLM(FakeLLM):
+    """第一个模型输出一段后断开，第二个模型正常输出"""
+
+    def respond(self, model_key, messages, **kwargs):
+        if model_key == 'primary':
+            yield make_chunk('前半段')
+            raise ConnectionError('connection reset')
+        yield make_chunk('后半段')
+
+
+def test_continuation_messages():
+    """测试支持前缀续写的供应商不附加续写指令"""
+    messages = [{'role': 'user', 'content': '你好'}]
+    prefill = MyLLM.continuation_messages(messages, '部分回答 ', make_model('local', 'ollama'))
+    assert prefill[-1] == {'role': 'assistant', 'content': '部分回答'}
+
+    instructed = MyLLM.continuation_messages(messages, '部分回答', make_model('remote'))
+    assert [message['role'] for message in instructed] == ['user', 'assistant', 'user']
+
+
+def test_stream_continues_on_fallback():
+    """测试流式输出中途失败时由备用模型续写"""
+    llm = BreakingLLM()
+    stream = FallbackStream(llm, [make_model('primary'), make_model('backup')], [{'role': 'user', 'content': '你好'}])
+    items = list(stream)
+
+    assert chunk_text(items[0]) == '前半段'
+    assert isinstance(items[1], ModelSwitch)
+    assert items[1].partial_text == '前半段' and items[1].to_model.name == 'backup'
+    assert chunk_text(items[2]) == '后半段'
+    assert llm.requests[1].messages[1] == {'role': 'assistant', 'content': '前半段'}
+
+
+def test_stream_stops_without_fallback_when_cancelled():
+    """测试用户取消后不再切换备用模型"""
+    stream = FallbackStream(BreakingLLM(), [make_model('primary'), make_model('backup')],
+                            [{'role': 'user', 'content': '你好'}], should_stop=lambda: True)
+    try:
+        list(stream)
+        assert False, "应抛出异常"
+    except ConnectionError:
+        pass
+
+
+if __name__ == "__main__":
+    test_continuation_messages()
+    test_stream_continues_on_fallback()
+    test_stream_stops_without_fallback_when_cancelled()
+    print("测试完成!")
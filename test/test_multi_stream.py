@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试多模型并发流式响应（对比模式）
+测试各模型的分块带模型键名合并输出，单个模型出错不影响其他模型
+"""
+
+import os
+import sys
+import time
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from myllm import MultiStream, chunk_text
+from fakes import FakeLLM, make_chunk
+
+
+class CompareLLM(FakeLLM):
+    """slow 模型逐字输出，broken 模型调用失败，其余模型立即输出"""
+
+    def respond(self, model_key, messages, **kwargs):
+        if model_key == 'broken':
+            raise ConnectionError('upstream unavailable')
+
+        def generate():
+            for text in ['你', '好']:
+                if model_key == 'slow':
+                    time.sleep(0.05)
+                yield make_chunk(f'{model_key}:{text}')
+        return generate()
+
+
+def test_events_tagged_by_model():
+    """测试并发输出的分块按模型区分，且各模型内部顺序不变"""
+    stream = MultiStream(CompareLLM(), ['fast', 'slow'], [{'role': 'user', 'content': '你好'}])
+    texts = {'fast': [], 'slow': []}
+    finished = []
+    for model_key, item in stream:
+        if item is None:
+            finished.append(model_key)
+        else:
+            texts[model_key].append(chunk_text(item))
+
+    assert texts == {'fast': ['fast:你', 'fast:好'], 'slow': ['slow:你', 'slow:好']}
+    assert finished == ['fast', 'slow']
+
+
+def test_failure_is_isolated():
+    """测试单个模型出错时产出异常，其他模型继续输出"""
+    items = list(MultiStream(CompareLLM(), ['broken', 'fast'], [{'role': 'user', 'content': '你好'}]))
+    errors = [item for model_key, item in items if model_key == 'broken']
+    assert len(errors) == 1 and isinstance(errors[0], ConnectionError)
+    assert [chunk_text(item) for model_key, item in items if model_key == 'fast' and item is not None] == \
+        ['fast:你', 'fast:好']
+
+
+if __name__ == "__main__":
+    test_events_tagged_by_model()
+    test_failure_is_isolated()
+    print("测试完成!")
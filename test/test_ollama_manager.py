@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 Ollama 本地模型管理功能
+测试 keep_alive 解析、服务不可达时的状态报告以及预加载结果跨进程共享
+"""
+
+import os
+import sys
+import tempfile
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import ModelConfig
+from ollama_manager import OllamaManager, parse_keep_alive, ollama_model_name
+from shared_cache import MemoryCache, SQLiteCache
+
+
+def test_parse_keep_alive():
+    """测试数字按秒处理，时长字符串原样传递"""
+    assert parse_keep_alive('-1') == -1
+    assert parse_keep_alive('600') == 600
+    assert parse_keep_alive('30m') == '30m'
+
+
+def test_status_when_unreachable():
+    """测试 Ollama 服务不可达时报告未加载"""
+    model = ModelConfig(name='local', display_name='Local', provider='ollama',
+                        model_name='ollama_chat/qwq', api_key_env='OLLAMA_API_KEY',
+                        base_url='http://127.0.0.1:9')
+    assert ollama_model_name(model) == 'qwq'
+
+    manager = OllamaManager(keep_alive='30m', warmup_interval=0, cache=MemoryCache())
+    manager.local_models = lambda: [model]
+    assert manager.warm_up(model) is False
+    status = manager.status()[0]
+    assert status['reachable'] is False and status['loaded'] is False
+    assert status['error']
+    manager.stop()
+
+
+def test_warmup_visible_to_other_workers():
+    """测试主进程的预加载结果经共享缓存出现在其他 worker 的状态中"""
+    model = ModelConfig(name='local', display_name='Local', provider='ollama',
+                        model_name='ollama_chat/qwq', api_key_env='OLLAMA_API_KEY',
+                        base_url='http://127.0.0.1:9')
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, 'cache.db')
+        master = OllamaManager(warmup_interval=0, cache=SQLiteCache(db_path))
+        worker = OllamaManager(warmup_interval=0, cache=SQLiteCache(db_path))
+        worker.local_models = lambda: [model]
+        assert 'last_warmup' not in worker.status()[0]
+
+        master.warm_up(model)
+        status = worker.status()[0]
+        assert status['last_warmup'] and status['warmup_seconds'] is None
+
+
+if __name__ == "__main__":
+    test_parse_keep_alive()
+    test_status_when_unreachable()
+    test_warmup_visible_to_other_workers()
+    print("测试完成!")
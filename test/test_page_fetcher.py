@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试网页正文抓取功能
+使用替换下载会话传输层的假适配器离线测试：正文提取、字节数和时间上限、按内容哈希缓存以及只抓取前 top_k 条结果
+"""
+
+import os
+import sys
+import time
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from page_fetcher import PageFetcher, TextExtractor
+from shared_cache import MemoryCache
+
+ARTICLE = ('<html><head><script>var tracking = 1;</script><style>.a { color: red }</style></head>'
+           '<body><nav>首页 菜单</nav><article><h1>标题</h1><p>正文第一段</p><div>第二段<br>第三行</div></article>'
+           '<footer>版权所有</footer></body></html>')
+
+
+class FakeBody:
+    """按块返回页面内容的响应体，记录被读取的字节数"""
+
+    def __init__(self, data: bytes, delay: float = 0):
+        self.data = data
+        self.delay = delay
+        self.position = 0
+
+    def read(self, size=-1, **kwargs):
+        if self.delay:
+            time.sleep(self.delay)
+        chunk = self.data[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+    def close(self):
+        pass
+
+
+class FakeAdapter(BaseAdapter):
+    """按 URL 返回预设页面的传输层，不访问网络"""
+
+    def __init__(self, pages, delay: float = 0):
+        super().__init__()
+        self.pages = pages
+        self.delay = delay
+        self.requests = []
+        self.bodies = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request.url)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response.request = request
+        response.headers = CaseInsensitiveDict({'Content-Type': 'text/html; charset=utf-8'})
+        response.encoding = 'utf-8'
+        response.raw = FakeBody(self.pages[request.url].encode('utf-8'), self.delay)
+        self.bodies.append(response.raw)
+        return response
+
+    def close(self):
+        pass
+
+
+def _fetcher(pages, delay: float = 0, **kwargs):
+    fetcher = PageFetcher(cache=MemoryCache(), cache_ttl=60, **kwargs)
+    adapter = FakeAdapter(pages, delay)
+    fetcher._session.mount('https://', adapter)
+    return fetcher, adapter
+
+
+def test_text_extractor_skips_boilerplate():
+    """测试丢弃脚本、样式、导航和页脚，块级标签之间换行"""
+    extractor = TextExtractor(max_chars=1000)
+    extractor.feed(ARTICLE)
+    text = extractor.get_text()
+    assert text.split('\n') == ['标题', '正文第一段', '第二段', '第三行']
+
+
+def test_byte_cap_stops_download():
+    """测试超过字节数上限后停止读取响应体"""
+    page = '<p>' + '正文' * 200000 + '</p>'
+    fetcher, adapter = _fetcher({'https://a.com/big': page}, max_bytes=64 * 1024, max_chars=10 ** 7)
+    _, text, _ = fetcher.fetch_text('https://a.com/big')
+    assert text and adapter.bodies[0].position <= 64 * 1024 + 16 * 1024
+
+
+def test_time_cap_returns_partial_text():
+    """测试超过单页时间上限后使用已下载的部分"""
+    page = ''.join(f'<p>第{i}段</p>' for i in range(50000))
+    fetcher, _ = _fetcher({'https://a.com/slow': page}, delay=0.1, page_timeout=0.3,
+                          max_bytes=10 ** 8, max_chars=10 ** 7)
+    started = time.monotonic()
+    _, text, _ = fetcher.fetch_text('https://a.com/slow')
+    assert time.monotonic() - started < 2
+    assert text.startswith('第0段') and '第49999段' not in text
+
+
+def test_content_hash_cache():
+    """测试同一 URL 只下载一次，正文相同的镜像页面得到相同的内容哈希"""
+    fetcher, adapter = _fetcher({'https://a.com/1': ARTICLE, 'https://mirror.com/1': ARTICLE})
+    first = fetcher.fetch_text('https://a.com/1')
+    assert fetcher.fetch_text('https://a.com/1') == first
+    assert adapter.requests == ['https://a.com/1']
+    assert fetcher.fetch_text('https://mirror.com/1') == first
+
+
+def test_enrich_results_top_k():
+    """测试只抓取前 top_k 条还没有正文的结果"""
+    pages = {f'https://a.com/{i}': ARTICLE for i in range(5)}
+    fetcher, adapter = _fetcher(pages)
+    results = [{'url': url, 'snippet': '摘要'} for url in pages]
+    results[0]['content'] = '已有正文'
+    fetcher.enrich_results(results, top_k=3)
+    assert sorted(adapter.requests) == ['https://a.com/1', 'https://a.com/2']
+    assert results[0]['content'] == '已有正文'
+    assert all('正文第一段' in result['content'] for result in results[1:3])
+    assert all('content' not in result for result in results[3:])
+
+
+if __name__ == "__main__":
+    test_text_extractor_skips_boilerplate()
+    test_byte_cap_stops_download()
+    test_time_cap_returns_partial_text()
+    test_content_hash_cache()
+    test_enrich_results_top_k()
+    print("测试完成!")
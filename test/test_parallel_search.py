@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试多引擎并行搜索
+测试 URL 规范化去重、结果足够时不等待慢引擎以及单个引擎故障时的结果合并
+"""
+
+import os
+import sys
+import time
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import Config
+from shared_cache import NullCache
+from utils import canonicalize_url
+from web_search import WebSearchTool
+
+
+def _results(engine, keyword, count, host='example.com'):
+    return [{'title': f'{engine} {i}', 'url': f'https://{host}/{keyword}/{i}', 'snippet': '', 'keyword': keyword}
+            for i in range(count)]
+
+
+def _tool(bing, kuake):
+    tool = WebSearchTool(cache=NullCache())
+    tool.available_engines = lambda: ['bing', 'kuake']
+    tool.search_bing = bing
+    tool.search_kuake = kuake
+    return tool
+
+
+def test_canonicalize_url():
+    """测试协议、移动版主机、跟踪参数、片段和末尾斜杠的规范化"""
+    assert canonicalize_url('http://m.Example.com/a/?utm_source=x&b=2&a=1#top') == 'https://example.com/a?a=1&b=2'
+    assert canonicalize_url('https://www.example.com:443/a/') == canonicalize_url('https://example.com/a')
+    assert canonicalize_url('https://example.com:8080/a') == 'https://example.com:8080/a'
+    assert canonicalize_url('') == ''
+    assert canonicalize_url('https://example.com/a?gclid=1&share_token=2') == 'https://example.com/a'
+    # ref 等通用参数可能决定页面内容，不能当作跟踪参数去掉
+    assert canonicalize_url('https://example.com/docs?ref=v2') != canonicalize_url('https://example.com/docs?ref=v3')
+
+
+def test_first_k_wins():
+    """测试结果足够时不等待较慢的引擎"""
+    def slow(keywords, max_results=5, deadline=None):
+        time.sleep(2)
+        return _results('kuake', keywords[0], 10, 'slow.com')
+
+    def fast(keywords, max_results=5, deadline=None):
+        return _results('bing', keywords[0], 10)
+
+    original = Config.SEARCH_FIRST_K
+    Config.SEARCH_FIRST_K = 15
+    try:
+        started = time.monotonic()
+        results = _tool(fast, slow).search_parallel(['a', 'b'], max_results=20)
+    finally:
+        Config.SEARCH_FIRST_K = original
+    assert time.monotonic() - started < 1
+    assert len(results) == 20 and all(result['engine'] == 'bing' for result in results)
+
+
+def test_engine_failure_and_dedup():
+    """测试单个引擎出错时使用其余引擎的结果，两个引擎的相同页面只保留一条"""
+    def failing(keywords, max_results=5, deadline=None):
+        raise ConnectionError('engine down')
+
+    def mirrored(keywords, max_results=5, deadline=None):
+        return _results('bing', keywords[0], 3) + _results('bing', keywords[0], 3, 'm.example.com')
+
+    results = _tool(mirrored, failing).search_parallel(['a'], max_results=20)
+    assert [result['url'] for result in results] == [f'https://example.com/a/{i}' for i in range(3)]
+
+
+if __name__ == "__main__":
+    test_canonicalize_url()
+    test_first_k_wins()
+    test_engine_failure_and_dedup()
+    print("测试完成!")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试在线性能分析
+测试按请求数启用 cProfile（包括流式响应体）、未启用时直接透传，以及线程调用栈导出
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from profiler import Profiler, ProfilingMiddleware
+
+
+def busy_chunk(n):
+    return str(sum(i * i for i in range(n))).encode()
+
+
+def streaming_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return (busy_chunk(1000) for _ in range(3))
+
+
+def run(app, path='/chat'):
+    body = app({'PATH_INFO': path}, lambda status, headers: None)
+    data = b''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return body, data
+
+
+def test_profile_next_requests():
+    """测试只分析接下来的 N 个请求，流式响应体的迭代计入结果"""
+    profiler = Profiler()
+    app = ProfilingMiddleware(streaming_app, profiler)
+
+    # 未启用时直接返回应用的响应体
+    body, _ = run(app)
+    assert type(body).__name__ == 'generator'
+    assert profiler.cpu_report() is None
+
+    profiler.start_cpu(requests=1)
+    run(app, '/admin/threads')  # 管理接口不参与分析
+    assert profiler.armed
+    run(app)
+    run(app)
+    status = profiler.cpu_status()
+    assert not status['armed'] and status['profiled_requests'] == 1 and status['in_flight'] == 0
+
+    report = profiler.cpu_report(limit=20).decode('utf-8')
+    assert 'busy_chunk' in report
+    assert profiler.cpu_report('prof')
+
+
+def test_thread_stacks():
+    """测试线程调用栈包含当前线程"""
+    stacks = Profiler.thread_stacks().decode('utf-8')
+    assert 'MainThread' in stacks and 'test_thread_stacks' in stacks
+
+
+if __name__ == "__main__":
+    test_profile_next_requests()
+    test_thread_stacks()
+    print("测试完成!")
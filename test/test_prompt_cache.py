@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试提示词前缀缓存
+测试缓存断点的标记位置、缓存命中 token 数的提取、按缓存单价计算成本以及只在写入搜索结果时发送搜索系统消息
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from myllm import MyLLM
+from utils import extract_usage, calculate_cost
+from search_context import SearchContext
+from web_search import WebSearchTool
+
+EPHEMERAL = {'type': 'ephemeral'}
+
+
+def test_mark_cache_breakpoints():
+    """测试只标记系统消息和最后一条用户消息之前的历史，且不修改原消息列表"""
+    messages = [
+        {'role': 'system', 'content': '回答要求'},
+        {'role': 'user', 'content': '第一个问题'},
+        {'role': 'assistant', 'content': '第一个回答'},
+        {'role': 'user', 'content': '搜索结果和新问题'},
+    ]
+    marked = MyLLM.mark_cache_breakpoints(messages)
+
+    assert marked[0]['content'] == [{'type': 'text', 'text': '回答要求', 'cache_control': EPHEMERAL}]
+    assert marked[1] == messages[1]
+    assert marked[2]['content'][-1]['cache_control'] == EPHEMERAL
+    assert marked[3] == messages[3]
+    assert messages[0]['content'] == '回答要求'
+
+
+def test_extract_cached_tokens():
+    """测试从 OpenAI 兼容接口和 Anthropic 的用量中提取缓存命中的 token 数"""
+    openai_usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=100, total_tokens=2100,
+                                   prompt_tokens_details=SimpleNamespace(cached_tokens=1536))
+    anthropic_usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=100, total_tokens=2100,
+                                      prompt_tokens_details=None, cache_read_input_tokens=1800)
+    plain_usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=100, total_tokens=2100)
+
+    assert extract_usage(SimpleNamespace(usage=openai_usage))['cached_tokens'] == 1536
+    assert extract_usage(SimpleNamespace(usage=anthropic_usage))['cached_tokens'] == 1800
+    assert 'cached_tokens' not in extract_usage(SimpleNamespace(usage=plain_usage))
+
+
+def test_cached_tokens_cost_less():
+    """测试命中缓存的输入 token 按更低的缓存单价计费"""
+    usage = {'prompt_tokens': 2000, 'completion_tokens': 100, 'total_tokens': 2100}
+    full_cost = calculate_cost(usage, 'gpt-4o')
+    cached_cost = calculate_cost({**usage, 'cached_tokens': 1536}, 'gpt-4o')
+    assert 0 < cached_cost < full_cost
+
+
+
+def test_search_flag_only_when_results_injected():
+    """测试只有实际写入了搜索结果时才标记，查询失败或没有结果时不发送说明附有搜索结果的系统消息"""
+    tool = WebSearchTool()
+    tool.extract_search_keywords = lambda query, deadline=None: [query]
+
+    tool.retrieve = lambda *args, **kwargs: SearchContext(text='[1] 标题', tokens=5, results=[{'url': 'https://a.com'}])
+    prompt, results, injected = tool.perform_web_search('问题')
+    assert injected and results and prompt.endswith('用户问题：问题')
+
+    tool.retrieve = lambda *args, **kwargs: SearchContext(text='未找到相关的网络搜索结果。', tokens=5)
+    assert tool.perform_web_search('问题')[2] is False
+
+    def fail(*args, **kwargs):
+        raise TimeoutError('搜索超时')
+    tool.retrieve = fail
+    assert tool.perform_web_search('问题') == ('问题', [], False)
+
+
+if __name__ == "__main__":
+    test_mark_cache_breakpoints()
+    test_extract_cached_tokens()
+    test_cached_tokens_cost_less()
+    test_search_flag_only_when_results_injected()
+    print("测试完成!")
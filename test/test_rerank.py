@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试搜索结果重排序功能
+测试分词、BM25 打分和多关键词结果合并
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from collections import Counter
+from rerank import tokenize, bm25_scores, SearchReranker, NUMPY_AVAILABLE, _bm25_python, _bm25_numpy
+from web_search import WebSearchTool
+
+
+def test_tokenize():
+    """测试中英文混合分词"""
+    assert tokenize("苹果公司 Apple earnings 2024") == ['苹果', '果公', '公司', 'apple', 'earnings', '2024']
+    assert tokenize("AI") == ['ai']
+
+
+def test_bm25_scores():
+    """测试相关文档得分更高"""
+    documents = [
+        "今天的天气很好，适合出门散步。",
+        "苹果公司发布最新季度财报，营收超出预期。",
+        "苹果是一种常见的水果。",
+    ]
+    scores = bm25_scores("苹果公司最新财报", documents)
+    assert scores[1] > scores[2] > scores[0] == 0.0
+
+
+def test_bm25_numpy_matches_python():
+    """测试 NumPy 批量计算与逐词计算的得分一致"""
+    if not NUMPY_AVAILABLE:
+        return
+    query_terms = list(dict.fromkeys(tokenize("苹果公司最新财报 apple")))
+    doc_terms = [Counter(tokenize(text)) for text in ("苹果公司财报 apple apple", "苹果", "", "天气很好")]
+    expected = _bm25_python(query_terms, doc_terms, 1.5, 0.75)
+    actual = _bm25_numpy(query_terms, doc_terms, 1.5, 0.75)
+    assert all(abs(x - y) < 1e-9 for x, y in zip(expected, actual))
+
+
+def test_rerank_keeps_top_n():
+    """测试重排序只保留最相关的结果"""
+    results = [
+        {'title': '天气预报', 'snippet': '明天有雨', 'url': 'https://a.com'},
+        {'title': '苹果财报', 'snippet': '苹果公司最新财报发布', 'url': 'https://b.com'},
+        {'title': '水果', 'snippet': '苹果富含维生素', 'url': 'https://c.com'},
+    ]
+    ranked = SearchReranker(embedding_model='').rerank("苹果公司最新财报", results, top_n=2)
+    assert [result['url'] for result in ranked] == ['https://b.com', 'https://c.com']
+    assert ranked[0]['relevance_score'] == 1.0
+
+
+def test_merge_results_round_robin():
+    """测试合并结果时每个关键词轮流贡献，且按 URL 去重"""
+    results = [
+        {'url': f'https://a.com/{i}', 'keyword': 'a'} for i in range(5)
+    ] + [
+        {'url': 'https://a.com/0', 'keyword': 'b'},
+        {'url': 'https://b.com/1', 'keyword': 'b'},
+    ]
+    merged = WebSearchTool._merge_results(results, 4)
+    assert [result['url'] for result in merged] == [
+        'https://a.com/0', 'https://a.com/1', 'https://b.com/1', 'https://a.com/2'
+    ]
+
+
+if __name__ == "__main__":
+    test_tokenize()
+    test_bm25_scores()
+    test_bm25_numpy_matches_python()
+    test_rerank_keeps_top_n()
+    test_merge_results_round_robin()
+    print("测试完成!")
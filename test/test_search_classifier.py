@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试联网需求分类器
+测试时效性问题需要联网，翻译、改写、代码等问题不需要联网，以及补充样本的加载
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from search_classifier import SearchClassifier, tokenize
+
+
+def test_tokenize():
+    """测试中文按字和两字切分，英文按单词切分"""
+    assert tokenize('天气 today 2025') == ['天', '气', '天气', 'today', '<year>']
+
+
+def test_classify():
+    """测试常见问题的联网判断"""
+    classifier = SearchClassifier(threshold=0.5, data_path='')
+    for query in ['上海明天会下雨吗', '宁德时代股价', '最近有什么 AI 新闻', 'latest iPhone price']:
+        decision = classifier.classify(query)
+        assert decision.needs_web, (query, decision)
+    for query in ['把这段话翻译成日语：今天天气不错', '帮我润色这封邮件', '用 Python 写一个快速排序', '你好']:
+        decision = classifier.classify(query)
+        assert not decision.needs_web, (query, decision)
+        assert 0.5 <= decision.confidence <= 1
+
+    decision = classifier.classify('把这段话翻译成日语：今天天气不错')
+    assert decision.reason == '翻译任务'
+
+
+def test_extra_examples():
+    """测试补充样本参与训练"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = os.path.join(tmp_dir, 'examples.jsonl')
+        with open(data_path, 'w', encoding='utf-8') as f:
+            for _ in range(20):
+                f.write(json.dumps({'text': '内部知识库问答', 'label': 0}, ensure_ascii=False) + '\n')
+        baseline = SearchClassifier(data_path='').classify('知识库问答')
+        trained = SearchClassifier(data_path=data_path).classify('知识库问答')
+        assert trained.probability < baseline.probability
+
+
+if __name__ == "__main__":
+    test_tokenize()
+    test_classify()
+    test_extra_examples()
+    print("测试完成!")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试搜索上下文构建功能
+测试 token 预算、按模型分词器计数、近似重复摘要去除和句子边界截断
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import ModelConfig
+from search_context import SearchContextBuilder, split_sentences, truncate_to_tokens, EMPTY_CONTEXT
+from token_counter import token_counter
+from utils import estimate_tokens
+
+
+def make_result(title, snippet, url, score=None):
+    return {'title': title, 'snippet': snippet, 'url': url, 'keyword': 'test', 'rerank_score': score}
+
+
+def test_split_sentences():
+    """测试中英文句子切分，小数点不应被当作句子边界"""
+    sentences = split_sentences("版本 3.14 发布了。第二句！Third sentence. Last")
+    assert sentences == ['版本 3.14 发布了。', '第二句！', 'Third sentence.', ' Last']
+
+
+def test_truncate_to_tokens():
+    """测试在句子边界截断"""
+    text = "第一句话很短。" + "第二句话比较长" * 20 + "。"
+    truncated = truncate_to_tokens(text, 20)
+    assert truncated == "第一句话很短。…"
+    assert truncate_to_tokens("短文本", 100) == "短文本"
+
+
+def test_truncate_long_sentence_at_word_boundary():
+    """测试第一句就超出预算时按估算的 token 数截断，并在单词边界处断开"""
+    text = ' '.join(f'word{i}' for i in range(200))
+    truncated = truncate_to_tokens(text, 50)
+    assert estimate_tokens(truncated) <= 51
+    assert len(truncated) > 150
+    assert truncated[:-1].split(' ')[-1] in text.split(' ')
+
+
+def test_build_with_budget():
+    """测试上下文不超过 token 预算，并按相关性排序"""
+    results = [
+        make_result(f"标题{i}", f"这是第{i}条搜索结果的摘要内容，包含一些信息。" * 5, f"https://example.com/{i}", score=i / 10)
+        for i in range(10)
+    ]
+    builder = SearchContextBuilder(default_budget=300, snippet_max_tokens=100)
+    context = builder.build(results)
+
+    assert context.tokens <= 300
+    assert estimate_tokens(context.text) <= 300 + len(context.results) * 2
+    assert 0 < len(context.results) < len(results)
+    assert context.results[0]['url'] == "https://example.com/9"
+    assert "【搜索结果 1】\n标题：标题9" in context.text
+
+
+def test_build_counts_with_model_tokenizer():
+    """测试按目标模型的分词器计数，上下文的 token 数与请求校验时的计数一致"""
+    model = ModelConfig(name='test', display_name='test', provider='openai', model_name='openai/test',
+                        api_key_env='TEST_API_KEY', tokenizer='per-char')
+    # 每个字符一个 token，与按字符估算的结果明显不同
+    token_counter._tokenizers['per-char'] = list
+    try:
+        text = "第一句话很短。" + "第二句话比较长" * 20 + "。"
+        assert truncate_to_tokens(text, 10, model) == "第一句话很短。…"
+        assert len(truncate_to_tokens('很长的句子' * 50, 30, model)) <= 31
+
+        results = [
+            make_result(f"标题{i}", f"这是第{i}条搜索结果的摘要内容，包含一些信息。" * 5, f"https://example.com/{i}")
+            for i in range(10)
+        ]
+        context = SearchContextBuilder(default_budget=300, snippet_max_tokens=100).build(results, model)
+        assert context.tokens <= 300
+        assert token_counter.count_text(context.text, model) <= 300 + len(context.results) * 2
+    finally:
+        token_counter._tokenizers.pop('per-char', None)
+
+
+def test_build_removes_near_duplicates():
+    """测试转载内容的近似重复摘要被去除"""
+    snippet = "苹果公司今日发布了最新季度财报，营收同比增长百分之八，超出市场预期。"
+    results = [
+        make_result("原文", snippet, "https://a.com/news"),
+        make_result("转载", snippet.replace("。", "！"), "https://b.com/copy"),
+        make_result("其他", "另一条完全不同的新闻内容。", "https://c.com/other"),
+    ]
+    context = SearchContextBuilder(default_budget=1000).build(results)
+    assert [result['url'] for result in context.results] == ["https://a.com/news", "https://c.com/other"]
+    assert context.dropped == 1
+
+
+def test_build_empty():
+    """测试没有搜索结果时的上下文"""
+    assert SearchContextBuilder().build([]).text == EMPTY_CONTEXT
+
+
+if __name__ == "__main__":
+    test_split_sentences()
+    test_truncate_to_tokens()
+    test_truncate_long_sentence_at_word_boundary()
+    test_build_with_budget()
+    test_build_counts_with_model_tokenizer()
+    test_build_removes_near_duplicates()
+    test_build_empty()
+    print("测试完成!")
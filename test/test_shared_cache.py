@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试共享缓存
+测试过期时间、淘汰策略、后台清理和多个进程共用同一个缓存文件
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from shared_cache import CacheBackend, SQLiteCache, MemoryCache, make_key, EVICT_EVERY
+from page_fetcher import PageFetcher
+
+
+def test_sqlite_shared_between_instances():
+    """测试一个实例写入的结果另一个实例（模拟另一个 worker）可以命中，且过期后不再返回"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'cache.db')
+        writer = SQLiteCache(db_path=db_path)
+        reader = SQLiteCache(db_path=db_path)
+        key = make_key('search', 'bing', '人工智能')
+        assert reader.get(key) is None
+
+        writer.set(key, [{'title': '结果', 'url': 'https://example.com'}])
+        assert reader.get(key) == [{'title': '结果', 'url': 'https://example.com'}]
+        assert reader.stats()['hits'] == 1
+
+        writer.set('short', 'value', ttl=0.05)
+        time.sleep(0.1)
+        assert reader.get('short') is None
+        assert writer.evict() == 1
+
+
+def test_sqlite_eviction():
+    """测试超出条数和字节数上限时淘汰最久未访问的条目"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = SQLiteCache(db_path=os.path.join(tmp_dir, 'cache.db'), max_entries=3, max_bytes=10_000)
+        for index in range(5):
+            cache.set(f"key-{index}", index)
+            # 保证访问时间有先后
+            time.sleep(0.01)
+        cache.evict()
+        assert cache.get('key-0') is None and cache.get('key-1') is None
+        assert cache.get('key-4') == 4
+        assert cache.stats()['entries'] == 3
+
+        cache.set('big', 'x' * 6000)
+        cache.set('bigger', 'y' * 6000)
+        cache.evict()
+        assert cache.get('big') is None
+        assert cache.get('bigger') == 'y' * 6000
+        # 超过总上限的单个值不缓存
+        cache.set('huge', 'z' * 20_000)
+        assert cache.get('huge') is None
+
+
+def test_eviction_in_background():
+    """测试写入不等待清理，其他进程持有写锁时清理被跳过"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'cache.db')
+        cache = SQLiteCache(db_path=db_path, max_entries=10, max_bytes=10 ** 6)
+        for index in range(EVICT_EVERY):
+            cache.set(f"key-{index}", index)
+        for _ in range(50):
+            if cache.stats()['entries'] <= 10:
+                break
+            time.sleep(0.1)
+        assert cache.stats()['entries'] == 10
+
+        # 模拟另一个 worker 正在写入
+        other = sqlite3.connect(db_path, isolation_level=None)
+        other.execute('BEGIN IMMEDIATE')
+        started = time.monotonic()
+        try:
+            assert cache.evict(busy_timeout=0.05) == 0
+            assert time.monotonic() - started < 1
+        finally:
+            other.execute('ROLLBACK')
+            other.close()
+
+
+def test_memory_cache():
+    """测试进程内缓存的过期和按最近访问淘汰"""
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    cache.set('d', 4, ttl=-1)
+    assert cache.get('d') is None
+
+
+
+def test_incomplete_backend_rejected():
+    """测试缺少接口方法的后端在创建时即报错"""
+    class BrokenCache(CacheBackend):
+        def get(self, key):
+            return None
+
+    try:
+        BrokenCache()
+    except TypeError:
+        pass
+    else:
+        assert False, '缺少 set/delete/clear 的后端应当无法创建'
+
+
+def test_page_text_shared_between_fetchers():
+    """测试一个抓取器写入的页面正文，使用同一共享缓存的其他抓取器直接命中而不再下载"""
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'cache.db')
+        first = PageFetcher(cache=SQLiteCache(db_path=path), cache_ttl=60)
+        first._download_and_extract = lambda url: ('hash1', '页面正文')
+        assert first.fetch_text('https://example.com/a')[:2] == ('hash1', '页面正文')
+
+        second = PageFetcher(cache=SQLiteCache(db_path=path), cache_ttl=60)
+        second._download_and_extract = lambda url: (_ for _ in ()).throw(AssertionError('不应重新下载'))
+        content_hash, text, fingerprint = second.fetch_text('https://example.com/a')
+        assert (content_hash, text) == ('hash1', '页面正文') and fingerprint is not None
+
+
+if __name__ == "__main__":
+    test_sqlite_shared_between_instances()
+    test_sqlite_eviction()
+    test_eviction_in_background()
+    test_memory_cache()
+    test_incomplete_backend_rejected()
+    test_page_text_shared_between_fetchers()
+    print("测试完成!")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 SimHash 近似重复检测
+测试转载文本的指纹距离、分段索引查找以及重排序时每组只保留得分最高的结果
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from simhash import simhash, hamming_distance, SimHashIndex, result_fingerprint
+from rerank import SearchReranker
+
+ORIGINAL = '国家统计局今日发布数据显示，10月份全国居民消费价格同比上涨0.3%，环比下降0.1%。其中，城市上涨0.3%，农村上涨0.2%。'
+REPOST = '【新华社】国家统计局今日发布数据显示，10月份全国居民消费价格同比上涨0.3%，环比下降0.1%。其中城市上涨0.3%，农村上涨0.2%'
+OTHER = '苹果公司今日发布了新款 MacBook Pro，搭载 M4 芯片，起售价 12999 元，将于下周正式开售。'
+
+
+def test_fingerprint_distance():
+    """测试转载文本的指纹接近，无关文本的指纹相差很大"""
+    assert simhash('') is None
+    assert simhash(ORIGINAL) == simhash(ORIGINAL)
+    assert hamming_distance(simhash(ORIGINAL), simhash(REPOST)) <= 6
+    assert hamming_distance(simhash(ORIGINAL), simhash(OTHER)) > 12
+
+
+def test_index_find():
+    """测试只在相差不超过阈值时命中"""
+    index = SimHashIndex(max_distance=3)
+    index.add(0b1011 << 40, 'a')
+    assert index.find((0b1011 << 40) ^ 0b111) == 'a'
+    assert index.find((0b1011 << 40) ^ 0b1111) is None
+    assert index.find(None) is None
+
+
+def test_result_fingerprint_prefers_content():
+    """测试有正文时使用正文指纹，并把补算的指纹写回结果"""
+    result = {'snippet': OTHER, 'content': ORIGINAL}
+    assert result_fingerprint(result) == simhash(ORIGINAL)
+    assert result['content_simhash'] == simhash(ORIGINAL)
+
+
+def test_rerank_keeps_best_of_cluster():
+    """测试重排序时转载结果只保留得分最高的一条"""
+    results = [
+        {'title': '转载', 'url': 'https://b.com/1', 'snippet': REPOST},
+        {'title': '原文', 'url': 'https://a.com/1', 'snippet': ORIGINAL},
+        {'title': '其他', 'url': 'https://c.com/1', 'snippet': OTHER},
+    ]
+    reranker = SearchReranker()
+    reranker.score = lambda query, search_results, deadline=None: [0.5, 0.9, 0.1]
+    ranked = reranker.rerank('居民消费价格', results, top_n=3)
+    assert [result['title'] for result in ranked] == ['原文', '其他']
+
+
+if __name__ == "__main__":
+    test_fingerprint_distance()
+    test_index_find()
+    test_result_fingerprint_prefers_content()
+    test_rerank_keeps_best_of_cluster()
+    print("测试完成!")
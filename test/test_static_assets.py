@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试静态资源托管和响应压缩
+测试 gzip 协商、Vary 头、小响应不压缩、带指纹的资源 URL 以及 /assets 路由的缓存头和 404
+"""
+
+import os
+import sys
+import gzip
+import tempfile
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from flask import Flask, Response
+from static_assets import (StaticAssets, CompressedPayload, compress_response, CDN_FALLBACKS,
+                           MIN_COMPRESS_SIZE, IMMUTABLE_MAX_AGE)
+
+BODY = b'console.log("hello");\n' * 200
+
+
+def test_payload_gzip_negotiation():
+    """测试按 Accept-Encoding 选择 gzip，不支持压缩或响应过小时原样返回"""
+    payload = CompressedPayload(BODY, 'application/javascript')
+    data, encoding = payload.get('gzip, deflate')
+    assert encoding == 'gzip' and gzip.decompress(data) == BODY
+    assert payload.get('identity') == (BODY, None)
+
+    small = CompressedPayload(b'x' * (MIN_COMPRESS_SIZE - 1), 'application/javascript')
+    assert small.get('gzip')[1] is None
+    assert CompressedPayload(BODY, 'image/png').get('gzip')[1] is None
+
+
+def test_compress_response_sets_vary():
+    """测试文本响应按协商结果压缩并声明 Vary: Accept-Encoding，小响应和流式响应不压缩"""
+    app = Flask(__name__)
+    with app.test_request_context():
+        response = compress_response(Response(BODY, mimetype='application/javascript'), 'gzip')
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.vary
+        assert gzip.decompress(response.get_data()) == BODY
+
+        response = compress_response(Response(b'{}', mimetype='application/json'), 'gzip')
+        assert 'Content-Encoding' not in response.headers and 'Accept-Encoding' in response.vary
+
+        response = compress_response(Response(iter([BODY]), mimetype='text/event-stream'), 'gzip')
+        assert 'Content-Encoding' not in response.headers
+
+
+def test_url_prefers_local_copy():
+    """测试本地存在的资源返回带指纹的地址，缺失的前端依赖回退到 CDN"""
+    with tempfile.TemporaryDirectory() as folder:
+        assets = StaticAssets(folder)
+        path = 'vendor/marked/marked.min.js'
+        assert assets.url(path) == CDN_FALLBACKS[path]
+        assert assets.check(auto_fetch=False) == list(CDN_FALLBACKS)
+
+        os.makedirs(os.path.join(folder, 'vendor', 'marked'))
+        with open(os.path.join(folder, path), 'wb') as f:
+            f.write(BODY)
+        assert assets.url(path) == f"/assets/{assets.fingerprint(path)}/{path}"
+        assert path not in assets.check(auto_fetch=False)
+        assert assets.fingerprint('../secret.txt') is None
+
+
+def test_assets_route_cache_headers():
+    """测试当前指纹长期缓存，旧指纹不长期缓存，不存在的资源返回 404"""
+    import app as app_module
+
+    with tempfile.TemporaryDirectory() as folder:
+        original = app_module.static_assets
+        app_module.static_assets = StaticAssets(folder)
+        try:
+            with open(os.path.join(folder, 'app.js'), 'wb') as f:
+                f.write(BODY)
+            fingerprint = app_module.static_assets.fingerprint('app.js')
+            client = app_module.app.test_client()
+
+            response = client.get(f'/assets/{fingerprint}/app.js', headers={'Accept-Encoding': 'gzip'})
+            assert response.status_code == 200
+            assert response.headers['Content-Encoding'] == 'gzip'
+            assert response.cache_control.max_age == IMMUTABLE_MAX_AGE and response.cache_control.immutable
+            assert 'Accept-Encoding' in response.vary
+
+            response = client.get('/assets/0000000000/app.js')
+            assert response.status_code == 200 and response.cache_control.no_cache
+            assert client.get(f'/assets/{fingerprint}/missing.js').status_code == 404
+        finally:
+            app_module.static_assets = original
+
+
+if __name__ == "__main__":
+    test_payload_gzip_negotiation()
+    test_compress_response_sets_vary()
+    test_url_prefers_local_copy()
+    test_assets_route_cache_headers()
+    print("测试完成!")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试流式生成取消功能
+测试取消标记、上游流关闭回调、登记移除以及从另一个进程取消
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+# 添加src目录到Python路径
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from stream_registry import StreamRegistry
+
+
+def test_cancel_sets_event_and_closes_stream():
+    """测试取消时设置取消标记并调用关闭回调"""
+    with tempfile.TemporaryDirectory() as folder:
+        registry = StreamRegistry(db_path=os.path.join(folder, 'streams.db'))
+        stream_id, cancel_event = registry.register()
+        closed = []
+        registry.attach(stream_id, lambda: closed.append(True))
+
+        assert registry.cancel(stream_id) is True
+        assert cancel_event.is_set()
+        assert closed == [True]
+        registry.unregister(stream_id)
+
+
+def test_cancel_unknown_stream():
+    """测试取消已结束的生成"""
+    with tempfile.TemporaryDirectory() as folder:
+        registry = StreamRegistry(db_path=os.path.join(folder, 'streams.db'))
+        stream_id, _ = registry.register()
+        registry.unregister(stream_id)
+        assert registry.cancel(stream_id) is False
+        assert registry.active_count() == 0
+
+
+def test_cancel_from_another_process():
+    """测试在一个进程中登记的生成可以由另一个进程（另一个 worker）取消"""
+    with tempfile.TemporaryDirectory() as folder:
+        db_path = os.path.join(folder, 'streams.db')
+        registry = StreamRegistry(db_path=db_path, poll_interval=0.05)
+        stream_id, cancel_event = registry.register()
+        closed = []
+        registry.attach(stream_id, lambda: closed.append(True))
+
+        code = (f"import sys; sys.path.insert(0, {SRC_DIR!r})\n"
+                f"from stream_registry import StreamRegistry\n"
+                f"sys.exit(0 if StreamRegistry(db_path={db_path!r}).cancel({stream_id!r}) else 1)\n")
+        result = subprocess.run([sys.executable, '-c', code], cwd=folder, timeout=60)
+        assert result.returncode == 0
+
+        assert cancel_event.wait(5)
+        time.sleep(0.1)
+        assert closed == [True]
+        registry.unregister(stream_id)
+
+
+if __name__ == "__main__":
+    test_cancel_sets_event_and_closes_stream()
+    test_cancel_unknown_stream()
+    test_cancel_from_another_process()
+    print("测试完成!")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试请求耗时分解
+测试阶段记录、Server-Timing 响应头格式和 timing 事件内容
+"""
+
+import os
+import sys
+import time
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from timing import RequestTimer, timed
+
+
+def test_spans_and_server_timing():
+    """测试阶段按顺序记录，并生成合法的 Server-Timing 头"""
+    timer = RequestTimer()
+    with timer.span('keywords'):
+        time.sleep(0.01)
+    try:
+        with timed(timer, 'llm', 'gpt-4o'):
+            raise RuntimeError('上游错误')
+    except RuntimeError:
+        pass
+    timer.add('ttft', 0.25, '首 token')
+
+    header = timer.server_timing()
+    names = [entry.split(';')[0] for entry in header.split(', ')]
+    assert names == ['keywords', 'llm', 'ttft', 'total']
+    assert 'llm;dur=' in header and 'desc="gpt-4o"' in header
+    # 非 ASCII 描述不写入响应头
+    assert '首' not in header
+    header.encode('latin-1')
+    assert float(header.split(', ')[0].split('dur=')[1]) >= 10
+
+    data = timer.to_dict()
+    assert [span['name'] for span in data['spans']] == ['keywords', 'llm', 'ttft']
+    assert data['spans'][2] == {'name': 'ttft', 'ms': 250.0, 'desc': '首 token'}
+    assert data['total_ms'] >= 10
+    assert 'total=' in timer.summary()
+
+
+def test_timed_without_timer():
+    """测试未传入计时器时不计时"""
+    with timed(None, 'search'):
+        pass
+
+
+if __name__ == "__main__":
+    test_spans_and_server_timing()
+    test_timed_without_timer()
+    print("测试完成!")
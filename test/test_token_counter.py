@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试本地 token 计数和上下文长度校验
+测试从本地文件加载分词器、裁剪早期历史、限制 max_tokens 以及当前消息超出上下文时在本地拒绝
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from config import ModelConfig
+from token_counter import TokenCounter, ContextLengthError, TIKTOKEN_AVAILABLE
+
+
+def _model(context_window, tokenizer=None):
+    return ModelConfig(name='test', display_name='test', provider='openai', model_name='openai/test',
+                       api_key_env='TEST_API_KEY', context_window=context_window, tokenizer=tokenizer)
+
+
+def _history(turns):
+    messages = [{'role': 'system', 'content': '回答要求'}]
+    for i in range(turns):
+        messages.append({'role': 'user', 'content': f'问题{i}' + '字' * 200})
+        messages.append({'role': 'assistant', 'content': f'回答{i}' + '字' * 200})
+    messages.append({'role': 'user', 'content': '新问题'})
+    return messages
+
+
+def test_load_local_tokenizers():
+    """测试 tiktoken 编码从 litellm 附带的文件加载，缺少的 Hugging Face 分词器不下载而是按字符估算"""
+    counter = TokenCounter()
+    if TIKTOKEN_AVAILABLE:
+        encoder = counter.load('tiktoken:o200k_base')
+        assert encoder is not None and len(encoder('hello world')) == 2
+    assert counter.load('huggingface:missing/model/tokenizer.json') is None
+
+
+def test_counts_are_cached():
+    """测试同一分词器下相同文本只分词一次，重复校验会话历史不会重新分词"""
+    counter = TokenCounter()
+    calls = []
+    counter._tokenizers['fake'] = lambda text: calls.append(text) or text.split()
+    model = _model(100000, tokenizer='fake')
+    messages = _history(3)
+    first = counter.fit(model, messages, 1000)
+    tokenized = len(calls)
+    second = counter.fit(model, messages + [{'role': 'assistant', 'content': 'a b'}, {'role': 'user', 'content': 'c'}], 1000)
+    assert len(calls) == tokenized + 2
+    assert second.prompt_tokens > first.prompt_tokens
+
+
+def test_fit_clamps_max_tokens():
+    """测试放得下时不裁剪，max_tokens 限制在剩余上下文之内"""
+    counter = TokenCounter()
+    messages = _history(2)
+    prompt_tokens = counter.count_messages(messages, _model(None))
+    fit = counter.fit(_model(prompt_tokens + 500), messages, 1000)
+    assert fit.messages == messages and fit.trimmed == 0
+    assert fit.prompt_tokens == prompt_tokens and fit.max_tokens == 500
+
+
+def test_fit_trims_oldest_history():
+    """测试放不下时从最早的历史开始裁剪，保留系统消息和当前问题，且历史以用户消息开头"""
+    counter = TokenCounter()
+    messages = _history(4)
+    fit = counter.fit(_model(1200), messages, 1000)
+    assert fit.trimmed > 0 and fit.trimmed % 2 == 0
+    assert fit.messages[0] == messages[0] and fit.messages[-1] == messages[-1]
+    assert fit.messages[1]['role'] == 'user'
+    assert fit.prompt_tokens + fit.max_tokens <= 1200
+
+
+def test_fit_rejects_oversized_message():
+    """测试当前消息本身超出上下文时抛出异常"""
+    counter = TokenCounter()
+    try:
+        counter.fit(_model(1000), [{'role': 'user', 'content': '字' * 2000}], 1000)
+    except ContextLengthError:
+        pass
+    else:
+        assert False, '应当拒绝超出上下文的消息'
+
+
+if __name__ == "__main__":
+    test_load_local_tokenizers()
+    test_counts_are_cached()
+    test_fit_clamps_max_tokens()
+    test_fit_trims_oldest_history()
+    test_fit_rejects_oversized_message()
+    print("测试完成!")
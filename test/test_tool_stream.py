@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试工具调用流式响应
+测试工具调用片段的合并、执行工具后继续回答以及最后一轮禁止调用工具
+"""
+
+import os
+import sys
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from myllm import ToolStream, ToolRound, ToolResult, chunk_text, merge_tool_call_deltas
+from fakes import FakeLLM, make_model, make_chunk, make_tool_delta
+
+
+def _model(name):
+    return make_model(name, supports_tools=True)
+
+
+class SearchingLLM(FakeLLM):
+    """允许调用工具时先分两个分块发起搜索，收到工具结果后正常回答"""
+
+    def respond(self, model_key, messages, **kwargs):
+        if kwargs.get('tool_choice') != 'none' and messages[-1]['role'] != 'tool':
+            yield make_chunk(tool_calls=[make_tool_delta(0, '{"queries": ["北京', 'call_1', 'web_search')])
+            yield make_chunk(tool_calls=[make_tool_delta(0, '天气"]}')])
+            return
+        yield make_chunk('今天晴')
+
+
+def test_merge_tool_call_deltas():
+    """测试按 index 合并工具调用片段"""
+    calls = []
+    merge_tool_call_deltas(calls, make_chunk(tool_calls=[make_tool_delta(0, '{"a":', 'id_0', 'f'),
+                                                         make_tool_delta(1, '{}', 'id_1', 'g')]))
+    merge_tool_call_deltas(calls, make_chunk(tool_calls=[make_tool_delta(0, ' 1}')]))
+    assert calls == [{'id': 'id_0', 'name': 'f', 'arguments': '{"a": 1}'},
+                     {'id': 'id_1', 'name': 'g', 'arguments': '{}'}]
+
+
+def test_tool_round_then_answer():
+    """测试执行工具后把结果交给模型继续回答"""
+    llm = SearchingLLM()
+    handled = []
+
+    def handler(name, arguments):
+        handled.append((name, arguments))
+        return '搜索结果', {'results': 3}
+
+    stream = ToolStream(llm, [_model('primary')], [{'role': 'user', 'content': '北京天气'}],
+                        tools=[{'type': 'function'}], tool_handler=handler)
+    items = list(stream)
+    rounds = [item for item in items if isinstance(item, ToolRound)]
+    results = [item for item in items if isinstance(item, ToolResult)]
+
+    assert handled == [('web_search', {'queries': ['北京天气']})]
+    assert len(rounds) == 1 and rounds[0].calls[0]['id'] == 'call_1'
+    assert results[0].summary == {'results': 3}
+    assert ''.join(chunk_text(item) for item in items if hasattr(item, 'choices')) == '今天晴'
+    # 第二轮请求包含助手的工具调用和工具结果
+    messages = llm.requests[1].messages
+    assert messages[1]['tool_calls'][0]['function']['arguments'] == '{"queries": ["北京天气"]}'
+    assert messages[2] == {'role': 'tool', 'tool_call_id': 'call_1', 'content': '搜索结果'}
+
+
+def test_last_round_disables_tools():
+    """测试达到轮数上限后禁止调用工具"""
+    llm = SearchingLLM()
+    stream = ToolStream(llm, [_model('primary')], [{'role': 'user', 'content': '北京天气'}],
+                        tools=[{'type': 'function'}], tool_handler=lambda name, arguments: ('', {}),
+                        max_rounds=0)
+    items = list(stream)
+    assert not any(isinstance(item, ToolRound) for item in items)
+    assert llm.requests[0].kwargs['tool_choice'] == 'none'
+
+
+if __name__ == "__main__":
+    test_merge_tool_call_deltas()
+    test_tool_round_then_answer()
+    test_last_round_disables_tools()
+    print("测试完成!")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试用量统计功能
+测试用量提取、成本计算和按模型/客户端聚合
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from usage import UsageTracker
+from utils import extract_usage, calculate_cost, has_cost_rates
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+class _Chunk:
+    def __init__(self, usage=None):
+        self.choices = []
+        self.usage = usage
+
+
+def test_extract_usage():
+    """测试从响应分块中提取用量"""
+    assert extract_usage(_Chunk()) == {}
+    assert extract_usage(_Chunk(_Usage(10, 5))) == {
+        'prompt_tokens': 10,
+        'completion_tokens': 5,
+        'total_tokens': 15
+    }
+
+
+def test_calculate_cost():
+    """测试成本计算区分输入和输出单价，本地模型和没有价格信息的模型不计费"""
+    assert calculate_cost({}, 'openai/qwen2.5-72b-instruct') == 0.0
+    usage = {'prompt_tokens': 1000, 'completion_tokens': 1000, 'total_tokens': 2000}
+    prompt_cost = calculate_cost({**usage, 'completion_tokens': 0, 'total_tokens': 1000}, 'openai/qwen2.5-72b-instruct')
+    assert abs(prompt_cost - 0.0006) < 1e-9
+    assert calculate_cost(usage, 'openai/qwen2.5-72b-instruct') > 2 * prompt_cost
+    assert calculate_cost(usage, 'ollama_chat/qwen2.5') == 0.0
+    assert calculate_cost(usage, 'openai/unpriced-model') == 0.0
+    assert has_cost_rates('ollama_chat/qwen2.5') and not has_cost_rates('openai/unpriced-model')
+
+
+def test_tracker_aggregation():
+    """测试并发记录后的聚合结果和落盘"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'usage.json')
+        tracker = UsageTracker(file_path=file_path, flush_interval=0, shard_count=4)
+        usage = {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15}
+
+        def worker(client):
+            for _ in range(100):
+                tracker.record('qwq', client, usage, 0.01)
+
+        threads = [threading.Thread(target=worker, args=(f"client-{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        snapshot = tracker.snapshot()
+        assert snapshot['models']['qwq']['requests'] == 400
+        assert snapshot['models']['qwq']['total_tokens'] == 6000
+        assert snapshot['clients']['client-0']['requests'] == 100
+
+        tracker.flush()
+        with open(file_path, encoding='utf-8') as f:
+            assert json.load(f)['models']['qwq']['requests'] == 400
+
+        # 重新加载后继续累计
+        reloaded = UsageTracker(file_path=file_path, flush_interval=0)
+        reloaded.record('qwq', 'client-0', usage, estimated=True)
+        snapshot = reloaded.snapshot()
+        assert snapshot['models']['qwq']['requests'] == 401
+        assert snapshot['models']['qwq']['estimated_requests'] == 1
+
+
+def test_multiprocess_merge():
+    """测试多个 worker 的增量在落盘时合并，而不是互相覆盖"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'usage.json')
+        usage = {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15}
+        master = UsageTracker(file_path=file_path, flush_interval=0)
+        master.record('qwq', 'client-0', usage)
+        master.flush()
+
+        # 模拟 fork：每个 worker 继承主进程已加载的计数
+        workers = [UsageTracker(file_path=file_path, flush_interval=0) for _ in range(2)]
+        for worker in workers:
+            worker.reset_after_fork()
+            worker.record('qwq', 'client-1', usage)
+        workers[0].flush()
+        workers[1].flush()
+        # 没有新增量时落盘不改变总量
+        workers[0].flush()
+
+        with open(file_path, encoding='utf-8') as f:
+            data = json.load(f)
+        assert data['models']['qwq']['requests'] == 3
+        assert data['clients']['client-1']['total_tokens'] == 30
+
+        # 查询结果包含磁盘上的总量和本进程尚未落盘的增量
+        workers[0].record('qwq', 'client-0', usage)
+        assert workers[0].snapshot()['models']['qwq']['requests'] == 4
+
+
+if __name__ == "__main__":
+    test_extract_usage()
+    test_calculate_cost()
+    test_tracker_aggregation()
+    test_multiprocess_merge()
+    print("测试完成!")
@@ -67,9 +67,10 @@ def test_search_engines():
     
     # 测试完整的联网查询流程
     print("\n=== 测试完整联网查询流程 ===")
-    enhanced_prompt, search_results = web_tool.perform_web_search(test_query)
+    enhanced_prompt, search_results, injected = web_tool.perform_web_search(test_query)
     print(f"生成的增强提示词长度: {len(enhanced_prompt)}")
     print(f"搜索结果数量: {len(search_results)}")
+    assert injected == bool(search_results)
     print("\n增强提示词预览:")
     print(enhanced_prompt[:500] + "..." if len(enhanced_prompt) > 500 else enhanced_prompt)
 